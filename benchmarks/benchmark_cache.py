@@ -0,0 +1,78 @@
+"""
+Benchmark the latency of :func:`show()` with a :class:`RenderCache`.
+
+The rendering time of an uncached image is compared to the time for
+taking the image from the memory and from the cache directory,
+including the computation of the scene fingerprint.
+Run this script from the repository root via
+``python benchmarks/benchmark_cache.py``.
+Requires the :mod:`IPython` package.
+"""
+
+import argparse
+import tempfile
+import time
+import warnings
+import ammolite
+from ammolite import PyMOLObject, RenderCache, show
+from benchmark_conversion import benchmark, build_structure
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--atoms", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+        help="The numbers of atoms in the rendered structures"
+    )
+    parser.add_argument(
+        "--size", type=int, nargs=2, default=[400, 300],
+        help="The size of the rendered image"
+    )
+    parser.add_argument(
+        "--repetitions", type=int, default=5,
+        help="The number of repetitions for each cache hit measurement"
+    )
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    print(
+        f"{'atoms':>8}  {'render':>9}  {'memory':>9}  {'disk':>9}  "
+        f"{'fingerprint':>11}"
+    )
+    for n_atoms in args.atoms:
+        ammolite.reset()
+        atoms = build_structure(n_atoms)
+        pymol_object = PyMOLObject.from_structure(atoms)
+        pymol_object.show_as("sticks")
+        pymol_object.zoom()
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(directory=directory)
+            start = time.perf_counter()
+            show(args.size, use_ray=True, cache=cache)
+            render_time = time.perf_counter() - start
+            memory_time = benchmark(
+                show, args.size, True, 60.0, None, cache,
+                repetitions=args.repetitions
+            )
+            # Only the directory is shared with the new cache
+            disk_time = benchmark(
+                lambda: show(
+                    args.size, use_ray=True,
+                    cache=RenderCache(directory=directory)
+                ),
+                repetitions=args.repetitions
+            )
+        fingerprint_time = benchmark(
+            RenderCache.fingerprint, ammolite.cmd, args.size, True,
+            repetitions=args.repetitions
+        )
+        print(
+            f"{atoms.array_length():>8}  {render_time * 1e3:>7.0f}ms  "
+            f"{memory_time * 1e3:>7.1f}ms  {disk_time * 1e3:>7.1f}ms  "
+            f"{fingerprint_time * 1e3:>9.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
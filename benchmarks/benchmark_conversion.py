@@ -0,0 +1,306 @@
+"""
+Benchmark the conversion of large structures between *Biotite* and
+*PyMOL*.
+
+The structures are built by repeating a structure from the test data
+until the desired number of atoms is reached.
+Run this script from the repository root via
+``python benchmarks/benchmark_conversion.py``.
+"""
+
+import argparse
+import time
+import warnings
+from os.path import join, dirname, realpath
+import numpy as np
+import biotite.structure as struc
+import biotite.structure.io.pdbx as pdbx
+from biotite.sequence import ProteinSequence
+from chempy.models import Indexed as IndexedModel
+from chempy import Atom, Bond
+import ammolite
+from ammolite import (
+    PyMOLObject, convert_to_atom_array, convert_to_chempy_model
+)
+from ammolite.convert import BOND_ORDER
+
+
+DATA_DIR = join(dirname(dirname(realpath(__file__))), "tests", "data")
+
+
+def reference_convert_to_chempy_model(atom_array):
+    """
+    The original atom-by-atom implementation of
+    :func:`convert_to_chempy_model()`, kept as a baseline.
+    """
+    model = IndexedModel()
+    annot_cat = atom_array.get_annotation_categories()
+    for i in range(atom_array.array_length()):
+        atom = Atom()
+        atom.segi = atom_array.chain_id[i]
+        atom.chain = atom_array.chain_id[i]
+        atom.resi_number = atom_array.res_id[i]
+        atom.ins_code = atom_array.ins_code[i]
+        res_name = atom_array.res_name[i]
+        atom.resn = res_name
+        if len(res_name) == 1:
+            atom.resn_code = res_name
+        else:
+            try:
+                atom.resn_code = ProteinSequence.convert_letter_3to1(res_name)
+            except KeyError:
+                atom.resn_code = "X"
+        atom.hetatm = 1 if atom_array.hetero[i] else 0
+        atom.name = atom_array.atom_name[i]
+        atom.symbol = atom_array.element[i]
+        if "b_factor" in annot_cat:
+            atom.b = atom_array.b_factor[i]
+        if "occupancy" in annot_cat:
+            atom.q = atom_array.occupancy[i]
+        if "charge" in annot_cat:
+            atom.formal_charge = atom_array.charge[i]
+        atom.coord = tuple(atom_array.coord[..., i, :])
+        atom.index = i+1
+        model.add_atom(atom)
+    for i, j, bond_type in atom_array.bonds.as_array():
+        bond = Bond()
+        bond.order = BOND_ORDER[bond_type]
+        bond.index = [i, j]
+        model.add_bond(bond)
+    return model
+
+
+def reference_convert_to_atom_array(chempy_model):
+    """
+    The original annotation-by-annotation implementation of
+    :func:`convert_to_atom_array()`, kept as a baseline.
+    """
+    atoms = chempy_model.atom
+    atom_array = struc.AtomArray(len(atoms))
+    atom_array.chain_id = np.array([a.chain for a in atoms], dtype="U3")
+    atom_array.res_id = np.array([a.resi_number for a in atoms], dtype=int)
+    atom_array.ins_code = np.array([a.ins_code for a in atoms], dtype="U1")
+    atom_array.res_name = np.array([a.resn for a in atoms], dtype="U3")
+    atom_array.hetero = np.array([a.hetatm for a in atoms], dtype=bool)
+    atom_array.atom_name = np.array([a.name for a in atoms], dtype="U6")
+    atom_array.element = np.array([a.symbol for a in atoms], dtype="U2")
+    atom_array.set_annotation("b_factor", np.array(
+        [a.b if hasattr(a, "b") else 0 for a in atoms], dtype=float
+    ))
+    atom_array.set_annotation("occupancy", np.array(
+        [a.q if hasattr(a, "q") else 1.0 for a in atoms], dtype=float
+    ))
+    atom_array.set_annotation("charge", np.array(
+        [a.formal_charge if hasattr(a, "formal_charge") else 0
+         for a in atoms], dtype=int
+    ))
+    atom_array.set_annotation("altloc_id", np.array(
+        [a.alt if hasattr(a, "alt") else "" for a in atoms], dtype="U1"
+    ))
+    atom_array.coord = np.array([a.coord for a in atoms], dtype=np.float32)
+    return atom_array
+
+
+def build_structure(n_atoms, pdb_id="1aki"):
+    """
+    Repeat the given structure from the test data until it contains
+    at least `n_atoms` atoms.
+
+    This function is also used by the other benchmarks.
+    """
+    pdbx_file = pdbx.PDBxFile.read(join(DATA_DIR, f"{pdb_id}.cif"))
+    atoms = pdbx.get_structure(
+        pdbx_file, model=1, extra_fields=["b_factor", "occupancy", "charge"]
+    )
+    atoms.bonds = struc.connect_via_residue_names(atoms)
+    n_repeats = int(np.ceil(n_atoms / atoms.array_length()))
+    # Place the copies next to each other on a grid,
+    # as overlapping copies would be unrealistic for PyMOL
+    grid_length = int(np.ceil(n_repeats ** (1/3)))
+    offsets = np.stack(np.meshgrid(
+        *([np.arange(grid_length)] * 3), indexing="ij"
+    ), axis=-1).reshape(-1, 3)[:n_repeats]
+    extent = np.ptp(atoms.coord, axis=0) + 5
+    return struc.repeat(
+        atoms,
+        (atoms.coord[np.newaxis] + (offsets * extent)[:, np.newaxis])
+        .astype(np.float32)
+    )
+
+
+def benchmark(function, *args, repetitions=1):
+    """
+    Get the minimum run time of the given function in seconds.
+    """
+    run_times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function(*args)
+        run_times.append(time.perf_counter() - start)
+    return min(run_times)
+
+
+def reference_get_coord(pymol_object):
+    """
+    The original state-by-state readback of the coordinates in
+    :meth:`PyMOLObject.to_structure()`, kept as a baseline.
+    """
+    cmd = ammolite.cmd
+    return np.stack([
+        cmd.get_coordset(pymol_object.name, state=i+1)
+        for i in range(cmd.count_states(pymol_object.name))
+    ])
+
+
+def reference_load_states(atoms):
+    """
+    The original model-by-model loading of an :class:`AtomArrayStack`
+    in :meth:`PyMOLObject.from_structure()`, kept as a baseline.
+    """
+    pymol_object = PyMOLObject.from_structure(atoms[0], delete=False)
+    for coord in atoms.coord[1:]:
+        ammolite.cmd.load_coordset(coord, pymol_object.name)
+    return pymol_object
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--atoms", type=int, nargs="+", default=[10_000, 200_000],
+        help="The number of atoms in the benchmarked structures"
+    )
+    parser.add_argument(
+        "--states", type=int, default=10_000,
+        help="The number of states in the benchmarked multi-state object"
+    )
+    parser.add_argument(
+        "--repetitions", type=int, default=3,
+        help="The number of repetitions for each measurement"
+    )
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    print("AtomArray -> chempy model")
+    print(f"{'atoms':>10}  {'reference':>10}  {'current':>10}  {'speedup':>8}")
+    for n_atoms in args.atoms:
+        atoms = build_structure(n_atoms)
+        ref_time = benchmark(
+            reference_convert_to_chempy_model, atoms,
+            repetitions=args.repetitions
+        )
+        test_time = benchmark(
+            convert_to_chempy_model, atoms, repetitions=args.repetitions
+        )
+        print(
+            f"{atoms.array_length():>10}  {ref_time:>9.3f}s  "
+            f"{test_time:>9.3f}s  {ref_time / test_time:>7.1f}x"
+        )
+    
+    print()
+    print("PyMOL object -> AtomArray")
+    print(
+        f"{'atoms':>10}  {'get_model':>10}  {'reference':>10}  "
+        f"{'chempy':>10}  {'bulk':>10}  {'speedup':>8}"
+    )
+    for n_atoms in args.atoms:
+        ammolite.reset()
+        pymol_object = PyMOLObject.from_structure(build_structure(n_atoms))
+        cmd = ammolite.cmd
+        get_model_time = benchmark(
+            cmd.get_model, pymol_object.name, 1,
+            repetitions=args.repetitions
+        )
+        model = cmd.get_model(pymol_object.name, 1)
+        ref_time = benchmark(
+            reference_convert_to_atom_array, model,
+            repetitions=args.repetitions
+        )
+        chempy_time = benchmark(
+            convert_to_atom_array, model, repetitions=args.repetitions
+        )
+        bulk_time = benchmark(
+            pymol_object.to_structure, 1, "all",
+            repetitions=args.repetitions
+        )
+        print(
+            f"{len(model.atom):>10}  {get_model_time:>9.3f}s  "
+            f"{ref_time:>9.3f}s  {chempy_time:>9.3f}s  {bulk_time:>9.3f}s  "
+            f"{(get_model_time + ref_time) / bulk_time:>7.1f}x"
+        )
+
+    print()
+    print("AtomArray -> PyMOL object")
+    print(f"{'atoms':>10}  {'chempy':>10}  {'cif':>10}  {'speedup':>8}")
+    for n_atoms in [10] + args.atoms:
+        atoms = build_structure(n_atoms)
+        if n_atoms < atoms.array_length():
+            atoms = atoms[:n_atoms]
+        loader_times = []
+        for loader in ["chempy", "cif"]:
+            ammolite.reset()
+            loader_times.append(benchmark(
+                # Keep the object alive until the time is measured
+                lambda: PyMOLObject.from_structure(
+                    atoms, loader=loader, delete=False
+                ),
+                repetitions=args.repetitions
+            ))
+        chempy_time, cif_time = loader_times
+        print(
+            f"{atoms.array_length():>10}  {chempy_time:>9.3f}s  "
+            f"{cif_time:>9.3f}s  {chempy_time / cif_time:>7.1f}x"
+        )
+
+    print()
+    print("AtomArrayStack -> PyMOL multi-state object")
+    print(
+        f"{'states':>10}  {'atoms':>10}  {'reference':>10}  "
+        f"{'current':>10}  {'speedup':>8}"
+    )
+    atoms = build_structure(1)
+    stack = struc.from_template(
+        atoms, np.repeat(atoms.coord[np.newaxis], args.states, axis=0)
+    )
+    ammolite.reset()
+    ref_time = benchmark(
+        reference_load_states, stack, repetitions=args.repetitions
+    )
+    ammolite.reset()
+    test_time = benchmark(
+        lambda: PyMOLObject.from_structure(stack, delete=False),
+        repetitions=args.repetitions
+    )
+    print(
+        f"{args.states:>10}  {atoms.array_length():>10}  "
+        f"{ref_time:>9.3f}s  {test_time:>9.3f}s  "
+        f"{ref_time / test_time:>7.1f}x"
+    )
+
+    print()
+    print("PyMOL multi-state object -> coordinates")
+    print(
+        f"{'states':>10}  {'atoms':>10}  {'reference':>10}  "
+        f"{'all':>10}  {'each 10th':>10}"
+    )
+    atoms = build_structure(1)
+    ammolite.reset()
+    pymol_object = PyMOLObject.from_structure(atoms)
+    for _ in range(args.states - 1):
+        ammolite.cmd.load_coordset(atoms.coord, pymol_object.name)
+    ref_time = benchmark(
+        reference_get_coord, pymol_object, repetitions=args.repetitions
+    )
+    all_time = benchmark(
+        pymol_object.get_coord, repetitions=args.repetitions
+    )
+    stride_time = benchmark(
+        pymol_object.get_coord, range(1, args.states + 1, 10),
+        repetitions=args.repetitions
+    )
+    print(
+        f"{args.states:>10}  {atoms.array_length():>10}  "
+        f"{ref_time:>9.3f}s  {all_time:>9.3f}s  {stride_time:>9.3f}s"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark the latency of :func:`show()`.
+
+The current in-memory capture of the PNG image is compared to the
+original implementation, that wrote the image into a temporary file
+and polled the file size.
+Run this script from the repository root via
+``python benchmarks/benchmark_display.py``.
+Requires the :mod:`IPython` package.
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+import warnings
+from os.path import getsize
+import ammolite
+from ammolite import PyMOLObject, show
+from benchmark_conversion import benchmark, build_structure
+
+
+INTERVAL = 0.1
+
+
+def reference_show(size=None, use_ray=False, timeout=60.0):
+    """
+    The original file-based implementation of :func:`show()`,
+    kept as a baseline.
+    """
+    from IPython.display import Image
+
+    cmd = ammolite.cmd
+    if size is None:
+        width = 0
+        height = 0
+    else:
+        width, height = size
+    ray = 1 if use_ray else 0
+    image_file = tempfile.NamedTemporaryFile(
+        delete=False, prefix="ammolite_", suffix=".png"
+    )
+    image_file.close()
+    start_time = datetime.datetime.now()
+    cmd.png(image_file.name, width, height, ray=ray)
+    while True:
+        if (datetime.datetime.now() - start_time).total_seconds() > timeout:
+            raise TimeoutError(
+                "No PNG image was output within the expected time limit"
+            )
+        if getsize(image_file.name) > 0:
+            break
+        time.sleep(INTERVAL)
+    image = Image(image_file.name)
+    # Unlike the original implementation, do not leave the file behind
+    os.remove(image_file.name)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--atoms", type=int, default=1_000,
+        help="The number of atoms in the rendered structure"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 400, 1000],
+        help="The widths of the rendered images, the aspect ratio is 4:3"
+    )
+    parser.add_argument(
+        "--repetitions", type=int, default=5,
+        help="The number of repetitions for each measurement"
+    )
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    ammolite.reset()
+    pymol_object = PyMOLObject.from_structure(build_structure(args.atoms))
+    pymol_object.show_as("sticks")
+    pymol_object.zoom()
+
+    print(
+        f"{'width':>6}  {'height':>6}  {'ray':>5}  {'file':>9}  "
+        f"{'memory':>9}  {'saved':>9}"
+    )
+    for use_ray in (False, True):
+        for width in args.sizes:
+            size = (width, width * 3 // 4)
+            # Warm up
+            show(size, use_ray)
+            file_time = benchmark(
+                reference_show, size, use_ray, repetitions=args.repetitions
+            )
+            memory_time = benchmark(
+                show, size, use_ray, repetitions=args.repetitions
+            )
+            print(
+                f"{size[0]:>6}  {size[1]:>6}  {str(use_ray):>5}  "
+                f"{file_time * 1e3:>7.1f}ms  {memory_time * 1e3:>7.1f}ms  "
+                f"{(file_time - memory_time) * 1e3:>7.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark the rendering of many thumbnails with a :class:`RenderPool`.
+
+The throughput of a :class:`RenderPool` with different numbers of
+workers is compared to rendering the thumbnails one after another in
+the current process.
+The scaling with the number of workers is bounded by the number of
+available CPU cores.
+Run this script from the repository root via
+``python benchmarks/benchmark_pool.py``.
+"""
+
+import argparse
+import multiprocessing
+import time
+import warnings
+import numpy as np
+import ammolite
+from ammolite import PyMOLObject, RenderPool
+from benchmark_conversion import build_structure
+
+
+STYLE = [("show_as", ("sticks",))]
+
+
+def create_poses(n_poses):
+    """
+    Create randomly rotated copies of a structure from the test data.
+    """
+    import biotite.structure as struc
+
+    atoms = build_structure(1)
+    atoms = atoms[struc.filter_amino_acids(atoms) & (atoms.res_id < 20)]
+    rng = np.random.default_rng(0)
+    return [
+        struc.rotate_centered(atoms, rng.uniform(0, 2 * np.pi, size=3))
+        for _ in range(n_poses)
+    ]
+
+
+def render_serial(poses, size):
+    cmd = ammolite.cmd
+    images = []
+    for atoms in poses:
+        ammolite.reset()
+        pymol_object = PyMOLObject.from_structure(atoms)
+        for method_name, args in STYLE:
+            getattr(pymol_object, method_name)(*args)
+        pymol_object.zoom()
+        images.append(cmd.png(None, *size, ray=0))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--thumbnails", type=int, default=200,
+        help="The number of rendered thumbnails"
+    )
+    parser.add_argument(
+        "--workers", type=int, nargs="+",
+        default=sorted({1, 2, multiprocessing.cpu_count()}),
+        help="The numbers of workers of the benchmarked pools"
+    )
+    parser.add_argument(
+        "--size", type=int, nargs=2, default=[200, 150],
+        help="The size of the thumbnails"
+    )
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    poses = create_poses(args.thumbnails)
+    print(f"CPU cores: {multiprocessing.cpu_count()}")
+    print(
+        f"{'workers':>8}  {'startup':>9}  {'time':>9}  "
+        f"{'images/s':>9}  {'speedup':>8}"
+    )
+
+    start = time.perf_counter()
+    render_serial(poses, args.size)
+    serial_time = time.perf_counter() - start
+    print(
+        f"{'serial':>8}  {'':>9}  {serial_time:>8.2f}s  "
+        f"{args.thumbnails / serial_time:>9.1f}  {1:>7.1f}x"
+    )
+
+    for n_workers in args.workers:
+        start = time.perf_counter()
+        with RenderPool(n_workers) as pool:
+            # Wait until all workers have launched PyMOL
+            list(pool.map(
+                poses[:n_workers], style=STYLE, size=args.size
+            ))
+            startup_time = time.perf_counter() - start
+            start = time.perf_counter()
+            list(pool.map(poses, style=STYLE, size=args.size))
+            pool_time = time.perf_counter() - start
+        print(
+            f"{n_workers:>8}  {startup_time:>8.2f}s  {pool_time:>8.2f}s  "
+            f"{args.thumbnails / pool_time:>9.1f}  "
+            f"{serial_time / pool_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
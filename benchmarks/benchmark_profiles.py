@@ -0,0 +1,142 @@
+"""
+Benchmark the performance profiles of :func:`setup_parameters()`.
+
+For each profile a large structure is loaded and rendered and the
+states of a trajectory are rendered one after another.
+Each profile is measured in a separate process, so that the memory
+allocated by *PyMOL*, i.e. the increase of the resident set size
+during the measurement, can be compared.
+The resident set size is read from ``/proc``, hence this benchmark
+runs only on Linux.
+Run this script from the repository root via
+``python benchmarks/benchmark_profiles.py``.
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from os.path import join
+import numpy as np
+import biotite.structure as struc
+import ammolite
+from ammolite import PyMOLObject, PROFILES
+from benchmark_conversion import benchmark, build_structure
+
+
+def get_memory():
+    """
+    Get the current resident set size of this process in bytes.
+    """
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * resource.getpagesize()
+
+
+def measure(profile, n_atoms, n_states, stride, size):
+    """
+    Measure the run times and allocated memory for the given profile.
+    """
+    warnings.simplefilter("ignore")
+    ammolite.reset(profile)
+    cmd = ammolite.cmd
+    atoms = build_structure(n_atoms)
+    trajectory_atoms = build_structure(1)
+    rng = np.random.default_rng(0)
+    stack = struc.from_template(
+        trajectory_atoms,
+        (
+            trajectory_atoms.coord
+            + rng.normal(
+                scale=0.5, size=(n_states,) + trajectory_atoms.coord.shape
+            )
+        ).astype(np.float32)
+    )
+
+    initial_memory = get_memory()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_file = join(temp_dir, "image.png")
+
+        start = time.perf_counter()
+        pymol_object = PyMOLObject.from_structure(atoms)
+        load_time = time.perf_counter() - start
+
+        def render_structure():
+            pymol_object.show_as("sticks")
+            pymol_object.zoom()
+            cmd.png(image_file, *size, ray=0)
+        render_time = benchmark(render_structure)
+        del pymol_object
+        cmd.delete("all")
+
+        trajectory = PyMOLObject.from_structure(stack)
+
+        def render_trajectory():
+            trajectory.show_as("sticks")
+            trajectory.zoom()
+            for state in range(1, n_states + 1, stride):
+                cmd.frame(state)
+                cmd.png(image_file, *size, ray=0)
+        trajectory_time = benchmark(render_trajectory)
+        memory = get_memory() - initial_memory
+
+    return load_time, render_time, trajectory_time, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--atoms", type=int, default=100_000,
+        help="The number of atoms of the rendered structure"
+    )
+    parser.add_argument(
+        "--states", type=int, default=1_000,
+        help="The number of states of the rendered trajectory"
+    )
+    parser.add_argument(
+        "--stride", type=int, default=20,
+        help="Render each n-th state of the trajectory"
+    )
+    parser.add_argument(
+        "--size", type=int, nargs=2, default=[400, 300],
+        help="The size of the rendered images"
+    )
+    parser.add_argument(
+        "--profile", choices=PROFILES.keys(),
+        help="Measure only the given profile and print the raw values"
+    )
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        print(*measure(
+            args.profile, args.atoms, args.states, args.stride, args.size
+        ))
+        return
+
+    print(
+        f"{'profile':>12}  {'loading':>9}  {'rendering':>9}  "
+        f"{'trajectory':>10}  {'memory':>9}"
+    )
+    for profile in PROFILES:
+        output = subprocess.run(
+            [
+                sys.executable, __file__, "--profile", profile,
+                "--atoms", str(args.atoms), "--states", str(args.states),
+                "--stride", str(args.stride), "--size", *[str(length) for length in args.size]
+            ],
+            capture_output=True, text=True, check=True
+        ).stdout
+        # PyMOL prints its banner on startup
+        load_time, render_time, trajectory_time, memory = [
+            float(value) for value in output.splitlines()[-1].split()
+        ]
+        print(
+            f"{profile:>12}  {load_time:>8.2f}s  {render_time:>8.2f}s  "
+            f"{trajectory_time:>9.2f}s  {memory / 1e6:>6.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark the selection expressions created by
+:meth:`PyMOLObject.where()`.
+
+For different masks of the structures in the test data, the length
+of the selection expression and the time *PyMOL* requires to parse it
+are compared between plain index ranges and the compiled expression.
+Furthermore, the time for repeatedly applying commands to the same
+mask is measured, where the cached named selections save the
+repeated parsing, and the time for selecting fragmented masks via
+atom flags is compared to parsing their expressions.
+Run this script from the repository root via
+``python benchmarks/benchmark_selection.py``.
+"""
+
+import argparse
+import glob
+import warnings
+from os.path import join, basename, splitext
+import numpy as np
+import biotite.structure as struc
+import biotite.structure.io.pdbx as pdbx
+import ammolite
+from ammolite import PyMOLObject
+from ammolite.object import _index_ranges
+from benchmark_conversion import DATA_DIR, benchmark, build_structure
+
+
+def create_masks(atoms):
+    """
+    Create masks that follow the structure of the molecule and
+    a random mask.
+    """
+    rng = np.random.default_rng(0)
+    return {
+        "CA": atoms.atom_name == "CA",
+        "carbon": atoms.element == "C",
+        "backbone": np.isin(atoms.atom_name, ["N", "CA", "C", "O"]),
+        "residues CA": (atoms.res_id % 2 == 0) & (atoms.atom_name == "CA"),
+        "random": rng.random(atoms.array_length()) < 0.1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--atoms", type=int, default=50_000,
+        help="The number of atoms of an additional large structure"
+    )
+    parser.add_argument(
+        "--commands", type=int, default=20,
+        help="The number of commands applied to the same mask"
+    )
+    parser.add_argument(
+        "--repetitions", type=int, default=3,
+        help="The number of repetitions for each measurement"
+    )
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    structures = {}
+    for file_name in sorted(glob.glob(join(DATA_DIR, "*.cif"))):
+        pdbx_file = pdbx.PDBxFile.read(file_name)
+        atoms = pdbx.get_structure(pdbx_file, model=1)
+        atoms.bonds = struc.connect_via_residue_names(atoms)
+        structures[splitext(basename(file_name))[0]] = atoms
+    large_atoms = build_structure(args.atoms, "1f2n")
+    structures[f"1f2n x{large_atoms.array_length() // 4730}"] = large_atoms
+
+    print(
+        f"{'structure':>10}  {'mask':>12}  {'atoms':>7}  "
+        f"{'index length':>12}  {'length':>8}  {'compile':>9}  "
+        f"{'index parse':>11}  {'parse':>9}  {'speedup':>8}"
+    )
+    cmd = ammolite.cmd
+    for structure_name, atoms in structures.items():
+        ammolite.reset()
+        pymol_object = PyMOLObject.from_structure(atoms)
+        # Encode the annotations before the time is measured
+        pymol_object.where(atoms.atom_name == "CA")
+        for mask_name, mask in create_masks(atoms).items():
+            if not mask.any():
+                continue
+            index_expression \
+                = f"model {pymol_object.name} and ({_index_ranges(mask)})"
+            compile_time = benchmark(
+                pymol_object.where, mask, repetitions=args.repetitions
+            )
+            expression = pymol_object.where(mask)
+            index_parse_time = benchmark(
+                cmd.count_atoms, index_expression,
+                repetitions=args.repetitions
+            )
+            parse_time = benchmark(
+                cmd.count_atoms, expression, repetitions=args.repetitions
+            )
+            assert cmd.count_atoms(expression) == np.count_nonzero(mask)
+            print(
+                f"{structure_name:>10}  {mask_name:>12}  "
+                f"{np.count_nonzero(mask):>7}  "
+                f"{len(index_expression):>12}  {len(expression):>8}  "
+                f"{compile_time * 1e3:>7.2f}ms  "
+                f"{index_parse_time * 1e3:>9.2f}ms  "
+                f"{parse_time * 1e3:>7.2f}ms  "
+                f"{index_parse_time / parse_time:>7.1f}x"
+            )
+
+    print()
+    print("Repeated commands")
+    print(
+        f"{'structure':>10}  {'mask':>12}  {'commands':>8}  "
+        f"{'uncached':>9}  {'cached':>9}  {'speedup':>8}"
+    )
+    for structure_name, atoms in structures.items():
+        ammolite.reset()
+        pymol_object = PyMOLObject.from_structure(atoms)
+        mask = create_masks(atoms)["random"]
+        uncached_time = benchmark(
+            lambda: [
+                cmd.color("red", pymol_object.where(mask))
+                for _ in range(args.commands)
+            ],
+            repetitions=1
+        )
+        ammolite.reset()
+        pymol_object = PyMOLObject.from_structure(atoms)
+        cached_time = benchmark(
+            lambda: [
+                pymol_object.color("red", mask)
+                for _ in range(args.commands)
+            ],
+            repetitions=1
+        )
+        print(
+            f"{structure_name:>10}  {'random':>12}  {args.commands:>8}  "
+            f"{uncached_time * 1e3:>7.1f}ms  {cached_time * 1e3:>7.1f}ms  "
+            f"{uncached_time / cached_time:>7.1f}x"
+        )
+
+    print()
+    print("Fragmented masks")
+    print(
+        f"{'structure':>10}  {'fraction':>8}  {'length':>8}  "
+        f"{'parse':>9}  {'tagging':>9}  {'speedup':>8}"
+    )
+    for structure_name, atoms in structures.items():
+        ammolite.reset()
+        pymol_object = PyMOLObject.from_structure(atoms)
+        rng = np.random.default_rng(0)
+        for fraction in (0.01, 0.1, 0.5):
+            mask = rng.random(atoms.array_length()) < fraction
+            expression = pymol_object.where(mask)
+            parse_time = benchmark(
+                cmd.count_atoms, expression, repetitions=args.repetitions
+            )
+            tag_time = benchmark(
+                lambda: cmd.count_atoms(pymol_object._tag_atoms(mask)),
+                repetitions=args.repetitions
+            )
+            print(
+                f"{structure_name:>10}  {fraction:>8}  "
+                f"{len(expression):>8}  {parse_time * 1e3:>7.2f}ms  "
+                f"{tag_time * 1e3:>7.2f}ms  {parse_time / tag_time:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark the streaming of trajectory files into *PyMOL* states via
+:meth:`PyMOLObject.from_trajectory()`.
+
+A synthetic trajectory is written for each given number of frames.
+The number of loaded frames per second and the peak memory allocated
+during loading are reported; the latter should be independent of the
+trajectory length.
+Run this script from the repository root via
+``python benchmarks/benchmark_trajectory.py``.
+Requires the :mod:`mdtraj` package.
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+import warnings
+from os.path import join
+import numpy as np
+import ammolite
+from ammolite import PyMOLObject
+from benchmark_conversion import build_structure
+
+
+def write_trajectory(file_name, atoms, n_frames, file_class, chunk_size=100):
+    """
+    Write a trajectory with randomly displaced coordinates,
+    without keeping all frames in memory.
+    """
+    rng = np.random.default_rng(0)
+
+    def generate_chunks():
+        for i in range(0, n_frames, chunk_size):
+            n_chunk_frames = min(chunk_size, n_frames - i)
+            yield (
+                atoms.coord
+                + rng.normal(
+                    scale=0.5, size=(n_chunk_frames,) + atoms.coord.shape
+                )
+            ).astype(np.float32)
+
+    file_class.write_iter(
+        file_name, (frame for chunk in generate_chunks() for frame in chunk)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--atoms", type=int, default=10_000,
+        help="The number of atoms in the benchmarked trajectory"
+    )
+    parser.add_argument(
+        "--frames", type=int, nargs="+", default=[500, 2000],
+        help="The number of frames in the benchmarked trajectories"
+    )
+    parser.add_argument(
+        "--format", choices=["xtc", "trr", "dcd"], default="xtc",
+        help="The trajectory file format"
+    )
+    args = parser.parse_args()
+
+    from biotite.structure.io.xtc import XTCFile
+    from biotite.structure.io.trr import TRRFile
+    from biotite.structure.io.dcd import DCDFile
+    file_class = {"xtc": XTCFile, "trr": TRRFile, "dcd": DCDFile}[args.format]
+
+    warnings.simplefilter("ignore")
+    atoms = build_structure(args.atoms)
+    print(
+        f"{'frames':>10}  {'atoms':>10}  {'time':>10}  "
+        f"{'frames/s':>10}  {'peak memory':>12}"
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for n_frames in args.frames:
+            file_name = join(temp_dir, f"trajectory.{args.format}")
+            write_trajectory(file_name, atoms, n_frames, file_class)
+
+            ammolite.reset()
+            tracemalloc.start()
+            start = time.perf_counter()
+            pymol_object = PyMOLObject.from_trajectory(atoms, file_name)
+            run_time = time.perf_counter() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert ammolite.cmd.count_states(pymol_object.name) == n_frames
+            del pymol_object
+
+            print(
+                f"{n_frames:>10}  {atoms.array_length():>10}  "
+                f"{run_time:>9.3f}s  {n_frames / run_time:>10.0f}  "
+                f"{peak_memory / 1e6:>9.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -54,13 +54,7 @@ log_rmsf = np.log(rmsf)
 flexibility = log_rmsf / np.max(log_rmsf[cd2.atom_name == "CA"])
 
 # Use a Matplotlib color map for flexibility coloring
-# Use discrete color 'steps'
-N_COLORS = 20
-cmap = plt.get_cmap("Reds")
-for threshold_flex in np.linspace(1.0, 0.0, N_COLORS):
-    # Discard alpha channel
-    color = cmap(threshold_flex)[:3]
-    pymol_cd2.color(color, flexibility <= threshold_flex)
+pymol_cd2.color_by(flexibility, cmap=plt.get_cmap("Reds"), vmin=0, vmax=1)
 ammolite.show(PNG_SIZE)
 # sphinx_gallery_thumbnail_number = 2
 
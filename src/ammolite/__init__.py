@@ -10,10 +10,13 @@ __version__ = "0.8.0"
 __name__ = "ammolite"
 __author__ = "Patrick Kunzmann"
 
+from .cache import *
 from .cgo import *
 from .convert import *
 from .display import *
 from .object import *
+from .pool import *
+from .remote import *
 from .shapes import *
 from .startup import *
 
@@ -0,0 +1,314 @@
+__name__ = "ammolite"
+__author__ = "Patrick Kunzmann"
+__all__ = ["RenderCache"]
+
+import collections
+import glob
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import threading
+from os.path import basename, getmtime, getsize, join, splitext
+
+
+class RenderCache:
+    """
+    A cache for images rendered by :func:`show()` and
+    :func:`render_array()`.
+
+    The images are addressed by a fingerprint of the rendered scene,
+    i.e. the states, representations and colors of all objects,
+    the *PyMOL* settings, the view matrix, the image size and whether
+    the image is ray-traced.
+    Hence, rendering an unchanged scene again returns the cached image,
+    while any change of the scene leads to a new rendering.
+
+    The images are held in memory and optionally also in a directory,
+    so that they persist between sessions.
+    In both places, the least recently used images are removed, if the
+    respective size limit is exceeded.
+    A cache instance is thread-safe and multiple processes may share
+    the same directory.
+
+    Parameters
+    ----------
+    max_memory_size : int, optional
+        The maximum total size of the images held in memory in bytes.
+    directory : str, optional
+        If given, the images are also stored as PNG files in this
+        directory.
+        The directory is created, if it does not exist yet.
+    max_disk_size : int, optional
+        The maximum total size of the images in `directory` in bytes.
+
+    Notes
+    -----
+    The fingerprint is computed from the *PyMOL* session, which takes
+    only a fraction of the rendering time, e.g. roughly 70 ms for a
+    scene with 80,000 atoms.
+
+    Examples
+    --------
+
+    >>> cache = RenderCache(directory="render_cache")
+    >>> image = show((400, 300), use_ray=True, cache=cache)
+    >>> # The unchanged scene is not ray-traced again
+    >>> image = show((400, 300), use_ray=True, cache=cache)
+    >>> print(cache.hits, cache.misses)
+    1 1
+    """
+
+    def __init__(self, max_memory_size=100_000_000, directory=None,
+                 max_disk_size=1_000_000_000):
+        self._max_memory_size = max_memory_size
+        self._max_disk_size = max_disk_size
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # Map the keys to the PNG data in the order of their last use
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        # Map the keys to the file sizes in the order of their last use
+        self._disk = collections.OrderedDict()
+        self._disk_size = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+            self._evict_disk()
+
+    @property
+    def hits(self):
+        """
+        int : The number of images taken from the cache.
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """
+        int : The number of images, that were not found in the cache.
+        """
+        return self._misses
+
+    @property
+    def directory(self):
+        """
+        str : The directory the images are stored in.
+        ``None``, if the images are held only in memory.
+        """
+        return self._directory
+
+    def get(self, key):
+        """
+        Get the PNG data for the given fingerprint.
+
+        Parameters
+        ----------
+        key : str
+            The fingerprint of the scene, as obtained by
+            :meth:`fingerprint()`.
+
+        Returns
+        -------
+        data : bytes or None
+            The PNG data, if the image is in the cache, else ``None``.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                    self._touch(key)
+                self._hits += 1
+                return data
+            if self._directory is not None:
+                # Look into the directory even for unknown keys,
+                # as the file may have been written by another process
+                try:
+                    with open(self._file_name(key), "rb") as file:
+                        data = file.read()
+                except OSError:
+                    # The file was removed, e.g. by another process
+                    if key in self._disk:
+                        self._disk_size -= self._disk.pop(key)
+                else:
+                    self._disk_size += len(data) - self._disk.get(key, 0)
+                    self._disk[key] = len(data)
+                    self._disk.move_to_end(key)
+                    self._touch(key)
+                    self._store_in_memory(key, data)
+                    self._hits += 1
+                    return data
+            self._misses += 1
+            return None
+
+    def put(self, key, data):
+        """
+        Put the PNG data for the given fingerprint into the cache.
+
+        Parameters
+        ----------
+        key : str
+            The fingerprint of the scene, as obtained by
+            :meth:`fingerprint()`.
+        data : bytes
+            The PNG data.
+        """
+        with self._lock:
+            self._store_in_memory(key, data)
+            if self._directory is not None:
+                self._store_on_disk(key, data)
+
+    def clear(self):
+        """
+        Remove all images from the cache, including the files in the
+        cache directory.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self._directory is not None:
+                self._scan_disk()
+            for key in self._disk:
+                self._remove_file(key)
+            self._disk.clear()
+            self._disk_size = 0
+
+    @staticmethod
+    def fingerprint(cmd, size, use_ray):
+        """
+        Compute the fingerprint of the current scene.
+
+        Parameters
+        ----------
+        cmd : module or object
+            The ``cmd`` attribute of the *PyMOL* instance.
+        size : tuple of (int, int) or None
+            The width and height of the image.
+            ``None`` refers to the size of the current viewport.
+        use_ray : bool
+            Whether the image is ray-traced.
+
+        Returns
+        -------
+        key : str
+            The fingerprint as hexadecimal string.
+        """
+        from pymol import setting
+
+        if size is None:
+            size = cmd.get_viewport()
+        binary_dump = cmd.get_setting_int("pse_binary_dump")
+        # The binary representation of the objects is much faster to
+        # obtain than the representation as Python objects
+        cmd.set("pse_binary_dump", 1)
+        try:
+            session = cmd.get_session()
+        finally:
+            cmd.set("pse_binary_dump", binary_dump)
+        scene = [
+            (name, value) for name, value in sorted(session.items())
+            if name not in _IGNORED_SESSION_ITEMS
+        ]
+        scene.append(("settings", [
+            entry for entry in session["settings"]
+            # The setting is changed by this method itself
+            if entry[0] != setting.index_dict["pse_binary_dump"]
+        ]))
+        scene.append(("size", tuple(int(length) for length in size)))
+        scene.append(("use_ray", bool(use_ray)))
+        stream = io.BytesIO()
+        pickler = pickle.Pickler(stream, protocol=4)
+        # Without the memo, equal scenes always give the same pickle
+        # data, independent of the identity of the contained objects
+        pickler.fast = True
+        pickler.dump(scene)
+        return hashlib.sha256(stream.getvalue()).hexdigest()
+
+    def _store_in_memory(self, key, data):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        if len(data) > self._max_memory_size:
+            return
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self._max_memory_size:
+            _, removed = self._memory.popitem(last=False)
+            self._memory_size -= len(removed)
+
+    def _store_on_disk(self, key, data):
+        if key in self._disk:
+            self._disk_size -= self._disk.pop(key)
+        if len(data) > self._max_disk_size:
+            return
+        # Write into a temporary file first, so that other processes
+        # never read a partially written file
+        file_descriptor, temp_file_name = tempfile.mkstemp(
+            dir=self._directory, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temp_file_name, self._file_name(key))
+        except OSError:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+            raise
+        # Other processes may have added or removed files in the meantime
+        self._scan_disk()
+        self._evict_disk()
+
+    def _scan_disk(self):
+        """
+        Read the files in the directory in the order of their last use,
+        as given by their modification time.
+        """
+        entries = []
+        for file_name in glob.glob(join(self._directory, "*.png")):
+            try:
+                entries.append(
+                    (getmtime(file_name), file_name, getsize(file_name))
+                )
+            except OSError:
+                # The file was removed in the meantime
+                pass
+        entries.sort()
+        self._disk.clear()
+        self._disk_size = 0
+        for _, file_name, size in entries:
+            self._disk[splitext(basename(file_name))[0]] = size
+            self._disk_size += size
+
+    def _evict_disk(self):
+        while self._disk_size > self._max_disk_size:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._remove_file(key)
+
+    def _touch(self, key):
+        """
+        Update the modification time of a file, so that the order of
+        use is retained, when the directory is opened again.
+        """
+        try:
+            os.utime(self._file_name(key))
+        except OSError:
+            pass
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._file_name(key))
+        except OSError:
+            pass
+
+    def _file_name(self, key):
+        return join(self._directory, key + ".png")
+
+
+# The session items, that do not affect the rendered image
+# 'settings' is filtered instead
+_IGNORED_SESSION_ITEMS = frozenset(["session", "cache", "settings"])
@@ -2,7 +2,12 @@ __name__ = "ammolite"
 __author__ = "Patrick Kunzmann"
 __all__ = ["convert_to_atom_array", "convert_to_chempy_model"]
 
+import gc
+import itertools
+import operator
+import struct
 import warnings
+from contextlib import contextmanager
 import numpy as np
 from biotite.sequence import ProteinSequence
 import biotite.structure as struc
@@ -48,77 +53,24 @@ def convert_to_atom_array(chempy_model, include_bonds=False):
     
     bonds = chempy_model.bond
 
-    
-    atom_array = struc.AtomArray(len(atoms))
-    
-    
-    # Add annotation arrays
-    atom_array.chain_id = np.array(
-        [a.chain for a in atoms],
-        dtype="U3"
-    )
-    atom_array.res_id = np.array(
-        [a.resi_number for a in atoms],
-        dtype=int
-    )
-    atom_array.ins_code = np.array(
-        [a.ins_code for a in atoms],
-        dtype="U1"
-    )
-    atom_array.res_name = np.array(
-        [a.resn for a in atoms],
-        dtype="U3"
-    )
-    atom_array.hetero = np.array(
-        [a.hetatm for a in atoms],
-        dtype=bool
-    )
-    atom_array.atom_name = np.array(
-        [a.name for a in atoms],
-        dtype="U6"
-    )
-    atom_array.element = np.array(
-        [a.symbol for a in atoms],
-        dtype="U2"
-    )
-    
-    atom_array.set_annotation(
-        "b_factor",
-        np.array(
-            [a.b if hasattr(a, "b") else 0
-             for a in atoms],
-            dtype=float
-        )
-    )
-    atom_array.set_annotation(
-        "occupancy",
-        np.array(
-            [a.q if hasattr(a, "q") else 1.0 for a in atoms],
-            dtype=float
-        )
-    )
-    atom_array.set_annotation(
-        "charge",
-        np.array(
-            [a.formal_charge if hasattr(a, "formal_charge") else 0
-             for a in atoms],
-            dtype=int
-        )
-    )
-    atom_array.set_annotation(
-        "altloc_id",
-        np.array(
-            [a.alt if hasattr(a, "alt") else "" for a in atoms],
-            dtype="U1"
-        )
-    )
-    
 
-    # Set coordinates
-    atom_array.coord = np.array(
-        [a.coord for a in atoms],
-        dtype=np.float32
+    # Get all annotations in a single pass over the atoms
+    # 'chempy.Atom' provides class-level defaults for the optional
+    # attributes, hence no 'hasattr()' checks are required
+    get_annotations = operator.attrgetter(
+        "chain", "resi_number", "ins_code", "resn", "hetatm", "name",
+        "symbol", "b", "q", "formal_charge", "alt"
     )
+    with _paused_gc():
+        if len(atoms) > 0:
+            columns = list(zip(*map(get_annotations, atoms)))
+        else:
+            columns = [()] * 11
+    coord = np.fromiter(
+        itertools.chain.from_iterable([a.coord for a in atoms]),
+        dtype=np.float32, count=3 * len(atoms)
+    ).reshape(-1, 3)
+    atom_array = _create_atom_array(*columns, coord)
 
 
     # Add bonds
@@ -133,6 +85,32 @@ def convert_to_atom_array(chempy_model, include_bonds=False):
     return atom_array
 
 
+def _create_atom_array(chain_id, res_id, ins_code, res_name, hetero,
+                       atom_name, element, b_factor, occupancy, charge,
+                       altloc_id, coord):
+    """
+    Create an :class:`AtomArray` from sequences of annotation values,
+    as they are obtained from *PyMOL*.
+    """
+    atom_array = struc.AtomArray(len(coord))
+
+    atom_array.chain_id = np.array(chain_id, dtype="U3")
+    atom_array.res_id = np.array(res_id, dtype=int)
+    atom_array.ins_code = np.array(ins_code, dtype="U1")
+    atom_array.res_name = np.array(res_name, dtype="U3")
+    atom_array.hetero = np.array(hetero, dtype=bool)
+    atom_array.atom_name = np.array(atom_name, dtype="U6")
+    atom_array.element = np.array(element, dtype="U2")
+    atom_array.set_annotation("b_factor", np.array(b_factor, dtype=float))
+    atom_array.set_annotation("occupancy", np.array(occupancy, dtype=float))
+    atom_array.set_annotation("charge", np.array(charge, dtype=int))
+    atom_array.set_annotation("altloc_id", np.array(altloc_id, dtype="U1"))
+
+    atom_array.coord = coord
+
+    return atom_array
+
+
 def convert_to_chempy_model(atom_array):
     """
     Convert an :class:`AtomArray` into a :class:`chempy.models.Indexed`
@@ -146,60 +124,278 @@ def convert_to_chempy_model(atom_array):
     model = IndexedModel()
 
     annot_cat = atom_array.get_annotation_categories()
+    length = atom_array.array_length()
+    coord = atom_array.coord
+    if coord.ndim == 3:
+        # Only the first model of an 'AtomArrayStack' is converted
+        coord = coord[0]
 
+    # Convert each annotation array into a list as a whole,
+    # as indexing the arrays atom by atom is slow
+    chain_id = atom_array.chain_id.tolist()
+    columns = [
+        chain_id,
+        chain_id,
+        atom_array.res_id.tolist(),
+        atom_array.ins_code.tolist(),
+        atom_array.res_name.tolist(),
+        _get_one_letter_codes(atom_array.res_name),
+        atom_array.hetero.astype(int).tolist(),
+        atom_array.atom_name.tolist(),
+        atom_array.element.tolist(),
+        # The optional annotations fall back to the chempy defaults
+        atom_array.b_factor.tolist() if "b_factor" in annot_cat
+        else itertools.repeat(Atom.b, length),
+        atom_array.occupancy.tolist() if "occupancy" in annot_cat
+        else itertools.repeat(Atom.q, length),
+        atom_array.charge.tolist() if "charge" in annot_cat
+        else itertools.repeat(Atom.formal_charge, length),
+        list(map(tuple, coord.tolist())),
+        range(1, length + 1),
+    ]
 
-    for i in range(atom_array.array_length()):
-        atom = Atom()
+    if atom_array.bonds is not None:
+        bond_array = atom_array.bonds.as_array()
+        # Map the bond types to bond orders only once per unique type
+        bond_types, type_indices = np.unique(
+            bond_array[:, 2], return_inverse=True
+        )
+        orders = np.array(
+            [BOND_ORDER[bond_type] for bond_type in bond_types], dtype=int
+        )[type_indices]
+    else:
+        warnings.warn(
+            "The given atom array (stack) has no associated bond information"
+        )
 
-        atom.segi = atom_array.chain_id[i]
-        atom.chain = atom_array.chain_id[i]
+    # The garbage collector would repeatedly traverse the growing
+    # number of chempy objects, although none of them can be garbage
+    with _paused_gc():
+        for (
+            segi, chain, resi_number, ins_code, resn, resn_code, hetatm,
+            name, symbol, b, q, formal_charge, atom_coord, index
+        ) in zip(*columns):
+            atom = Atom()
+            atom.segi = segi
+            atom.chain = chain
+            atom.resi_number = resi_number
+            atom.ins_code = ins_code
+            atom.resn = resn
+            atom.resn_code = resn_code
+            atom.hetatm = hetatm
+            atom.name = name
+            atom.symbol = symbol
+            atom.b = b
+            atom.q = q
+            atom.formal_charge = formal_charge
+            atom.coord = atom_coord
+            atom.index = index
+            model.atom.append(atom)
 
-        atom.resi_number = atom_array.res_id[i]
+        if atom_array.bonds is not None:
+            for i, j, order in zip(
+                bond_array[:, 0].tolist(),
+                bond_array[:, 1].tolist(),
+                orders.tolist()
+            ):
+                bond = Bond()
+                bond.order = order
+                bond.index = [i, j]
+                model.bond.append(bond)
 
-        atom.ins_code = atom_array.ins_code[i]
-        
-        res_name = atom_array.res_name[i]
-        atom.resn = res_name
-        if len(res_name) == 1:
-            atom.resn_code = res_name
-        else:
-            try:
-                atom.resn_code = ProteinSequence.convert_letter_3to1(res_name)
-            except KeyError:
-                atom.resn_code = "X"
 
-        atom.hetatm = 1 if atom_array.hetero[i] else 0
+    return model
 
-        atom.name = atom_array.atom_name[i]
 
-        atom.symbol = atom_array.element[i]
-        
-        if "b_factor" in annot_cat:
-            atom.b = atom_array.b_factor[i]
-        
-        if "occupancy" in annot_cat:
-            atom.q = atom_array.occupancy[i]
-        
-        if "charge" in annot_cat:
-            atom.formal_charge = atom_array.charge[i]
-        
-        atom.coord = tuple(atom_array.coord[..., i, :])
+def _convert_to_cif(atom_array):
+    """
+    Write an :class:`AtomArray` into an *mmCIF* string that can be
+    loaded by *PyMOL* via ``load_raw()``.
 
-        atom.index = i+1
+    Bonds are written into the *PyMOL*-specific ``pymol_bond`` category,
+    which refers to the atoms via their ``atom_site.id``.
+    The coordinates are written with the usual precision of three
+    decimals.
 
-        model.add_atom(atom)
-    
+    Parameters
+    ----------
+    atom_array : AtomArray
+        The structure to be written.
+        Only the first model of an :class:`AtomArrayStack` is written.
+
+    Returns
+    -------
+    cif : str
+        The *mmCIF* file content.
+    """
+    annot_cat = atom_array.get_annotation_categories()
+    length = atom_array.array_length()
+    coord = atom_array.coord
+    if coord.ndim == 3:
+        coord = coord[0]
+
+    chain_id = _to_cif_column(atom_array.chain_id)
+    atom_site = {
+        "group_PDB": np.where(
+            atom_array.hetero, "HETATM", "ATOM"
+        ).astype(object).tolist(),
+        # Use the same zero-based atom IDs as 'load_model()'
+        "id": list(map(str, range(length))),
+        "type_symbol": _to_cif_column(atom_array.element),
+        "label_atom_id": _to_cif_column(atom_array.atom_name),
+        "label_comp_id": _to_cif_column(atom_array.res_name),
+        "label_asym_id": chain_id,
+        "auth_asym_id": chain_id,
+        "label_seq_id": _to_cif_column(atom_array.res_id),
+        "auth_seq_id": _to_cif_column(atom_array.res_id),
+        "pdbx_PDB_ins_code": _to_cif_column(atom_array.ins_code),
+        "Cartn_x": [f"{x:.3f}" for x in coord[:, 0].tolist()],
+        "Cartn_y": [f"{y:.3f}" for y in coord[:, 1].tolist()],
+        "Cartn_z": [f"{z:.3f}" for z in coord[:, 2].tolist()],
+    }
+    if "occupancy" in annot_cat:
+        atom_site["occupancy"] = _to_cif_column(
+            atom_array.occupancy.astype(np.float32)
+        )
+    if "b_factor" in annot_cat:
+        atom_site["B_iso_or_equiv"] = _to_cif_column(
+            atom_array.b_factor.astype(np.float32)
+        )
+    if "charge" in annot_cat:
+        atom_site["pdbx_formal_charge"] = _to_cif_column(atom_array.charge)
+
+    lines = ["data_ammolite", "loop_"]
+    lines += [f"_atom_site.{key}" for key in atom_site.keys()]
+    lines += map(" ".join, zip(*atom_site.values()))
 
     if atom_array.bonds is not None:
-        for i, j, bond_type in atom_array.bonds.as_array():
-            bond = Bond()
-            bond.order = BOND_ORDER[bond_type]
-            bond.index = [i, j]
-            model.add_bond(bond)
-    else:
-        warnings.warn(
-            "The given atom array (stack) has no associated bond information"
+        bond_array = atom_array.bonds.as_array()
+        bond_types, type_indices = np.unique(
+            bond_array[:, 2], return_inverse=True
         )
+        orders = np.array(
+            [BOND_ORDER[bond_type] for bond_type in bond_types], dtype=int
+        )[type_indices]
+        lines += [
+            "loop_",
+            "_pymol_bond.atom_site_id_1",
+            "_pymol_bond.atom_site_id_2",
+            "_pymol_bond.order",
+        ]
+        lines += map(" ".join, zip(
+            map(str, bond_array[:, 0].tolist()),
+            map(str, bond_array[:, 1].tolist()),
+            map(str, orders.tolist())
+        ))
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _write_dcd(file, coord):
+    """
+    Write coordinates into a *DCD* file in *CHARMM* format, that can be
+    loaded by *PyMOL* via ``load_traj()``.
+
+    Parameters
+    ----------
+    file : file-like object
+        The binary file to write into.
+    coord : ndarray, shape=(m,n,3)
+        The coordinates of each model.
+    """
+    n_models, n_atoms, _ = coord.shape
+    # Each Fortran record is enclosed by its size in bytes
+    def write_record(content):
+        size = struct.pack("<i", len(content))
+        file.write(size + content + size)
     
+    # Number of models, first step, step interval, 6 unused values,
+    # time step, no unit cell, 8 unused values, CHARMM version
+    write_record(struct.pack(
+        "<4s9if10i", b"CORD", n_models, 1, 1, *([0] * 6), 1.0,
+        *([0] * 9), 24
+    ))
+    write_record(struct.pack("<i80s", 1, b"Created by ammolite"))
+    write_record(struct.pack("<i", n_atoms))
+    
+    # Each model consists of one record for each dimension
+    # -> write all records at once
+    records = np.empty((n_models, 3, n_atoms + 2), dtype="<f4")
+    records.view("<i4")[..., [0, -1]] = 4 * n_atoms
+    records[..., 1:-1] = coord.transpose(0, 2, 1)
+    file.write(memoryview(records).cast("B"))
+
 
-    return model
\ No newline at end of file
+def _to_cif_column(array):
+    """
+    Convert an annotation array into a list of *CIF* values.
+
+    Each unique value is formatted and quoted only once.
+    Floating point values are represented with the shortest string
+    that preserves the value.
+    """
+    unique_values, inverse = np.unique(array, return_inverse=True)
+    return np.array(
+        [_quote_cif(value) for value in unique_values.astype(str).tolist()],
+        dtype=object
+    )[inverse].tolist()
+
+
+def _quote_cif(value):
+    """
+    Quote a value for a *CIF* file, if necessary.
+    """
+    if value == "":
+        return "."
+    if (
+        value[0] in "_#$'\"[];"
+        or value in (".", "?")
+        or any(char.isspace() for char in value)
+        or value.lower().startswith(
+            ("data_", "loop_", "save_", "stop_", "global_")
+        )
+    ):
+        if "'" in value:
+            return f'"{value}"'
+        else:
+            return f"'{value}'"
+    return value
+
+
+def _get_one_letter_codes(res_names):
+    """
+    Get the one-letter code for each residue name, looking up each
+    unique residue name only once.
+    """
+    unique_res_names, inverse = np.unique(res_names, return_inverse=True)
+    unique_codes = []
+    for res_name in unique_res_names.tolist():
+        if len(res_name) == 1:
+            unique_codes.append(res_name)
+        else:
+            try:
+                unique_codes.append(
+                    ProteinSequence.convert_letter_3to1(res_name)
+                )
+            except KeyError:
+                unique_codes.append("X")
+    return np.array(unique_codes, dtype=object)[inverse].tolist()
+
+
+@contextmanager
+def _paused_gc():
+    """
+    Disable the garbage collector within the context.
+
+    When a large number of container objects (e.g. *chempy* atoms or
+    tuples) is created, the garbage collector is triggered repeatedly
+    and traverses all of them, although none of them is garbage.
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
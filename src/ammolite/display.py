@@ -1,18 +1,26 @@
 __name__ = "ammolite"
 __author__ = "Patrick Kunzmann"
-__all__ = ["show", "TimeoutError"]
+__all__ = ["show", "render_array", "TimeoutError"]
 
+import io
+import struct
 import tempfile
 import time
-import datetime
-from os.path import getsize
+import zlib
+from os.path import isfile, join
+import numpy as np
+from .cache import RenderCache
 from .startup import get_and_set_pymol_instance
 
 
 INTERVAL = 0.1
 
+# The 'IEND' chunk, that terminates a PNG file
+_PNG_END = b"\x00\x00\x00\x00IEND\xaeB`\x82"
 
-def show(size=None, use_ray=False, timeout=60.0, pymol_instance=None):
+
+def show(size=None, use_ray=False, timeout=60.0, pymol_instance=None,
+         cache=None):
     """
     Render an image of the PyMOL session and display it in the current
     *Jupyter* notebook.
@@ -38,54 +46,292 @@ def show(size=None, use_ray=False, timeout=60.0, pymol_instance=None):
         (``ammolite.pymol``) is used.
         If no *PyMOL* instance is currently running,
         *PyMOL* is started in library mode.
-    
+    cache : RenderCache, optional
+        If given, the image is taken from this cache, if the scene was
+        already rendered with the same parameters.
+        Otherwise, the rendered image is put into the cache.
+
     Raises
     ------
     TimeoutError
         If no image was created after expiry of the `timeout` limit.
+
+    Notes
+    -----
+    The image is obtained from *PyMOL* directly as PNG data in memory.
+    Only if the *PyMOL* version does not support this, the image is
+    written into a temporary file, which is removed afterwards.
     """
     try:
         from IPython.display import Image
     except ImportError:
         raise ImportError("IPython is not installed")
 
+    pymol_instance = get_and_set_pymol_instance(pymol_instance)
+    return Image(
+        data=_get_png(pymol_instance.cmd, size, use_ray, timeout, cache),
+        format="png"
+    )
+
+
+def render_array(size=None, use_ray=False, views=None, timeout=60.0,
+                 pymol_instance=None, cache=None):
+    """
+    Render an image of the PyMOL session and get it as *NumPy* array.
+
+    In contrast to :func:`show()`, this function does not require
+    *IPython*, so it is suitable for image processing pipelines.
+
+    Parameters
+    ----------
+    size : tuple of (int, int), optional
+        The width and height of the rendered image.
+        By default, the size of the current *PyMOL* viewport is used.
+    use_ray : bool, optional
+        If set to true, the a ray-traced image is created.
+        This will also increase the rendering time.
+    views : ndarray, shape=(n,18), dtype=float, optional
+        If given, an image is rendered for each of the view matrices,
+        as obtained by ``cmd.get_view()``.
+        Afterwards the original view is restored.
+    timeout : float
+        The number of seconds to wait for image output from *PyMOL*.
+    pymol_instance : module or SingletonPyMOL or PyMOL, optional
+        If *PyMOL* is used in library mode, the :class:`PyMOL`
+        or :class:`SingletonPyMOL` object is given here.
+        If otherwise *PyMOL* is used in GUI mode, the :mod:`pymol`
+        module is given.
+        By default the currently used *PyMOL* instance
+        (``ammolite.pymol``) is used.
+        If no *PyMOL* instance is currently running,
+        *PyMOL* is started in library mode.
+    cache : RenderCache, optional
+        If given, the image is taken from this cache, if the scene was
+        already rendered with the same parameters.
+        Otherwise, the rendered image is put into the cache.
+
+    Returns
+    -------
+    image : ndarray, shape=(h,w,4) or shape=(n,h,w,4), dtype=uint8
+        The RGBA image.
+        If `views` is given, the images for the views are stacked
+        along the first dimension.
+
+    Raises
+    ------
+    TimeoutError
+        If no image was created after expiry of the `timeout` limit.
+
+    Notes
+    -----
+    *PyMOL* does not expose its image buffer to *Python*, but only
+    PNG data.
+    Hence, the PNG data is decoded in memory, without any file
+    access.
+
+    Examples
+    --------
+
+    >>> pymol_object = PyMOLObject.from_structure(atoms)
+    >>> pymol_object.show_as("sticks")
+    >>> pymol_object.zoom()
+    >>> image = render_array(size=(400, 300))
+    >>> print(image.shape)
+    (300, 400, 4)
+    """
     pymol_instance = get_and_set_pymol_instance(pymol_instance)
     cmd = pymol_instance.cmd
-    
+    if views is None:
+        return _decode_png(_get_png(cmd, size, use_ray, timeout, cache))
+
+    views = np.asarray(views, dtype=float)
+    if views.ndim != 2 or views.shape[1] != 18:
+        raise IndexError(
+            f"Expected view matrices with shape (n,18), "
+            f"but got {views.shape}"
+        )
+    if len(views) == 0:
+        raise IndexError("At least one view is required")
+    original_view = cmd.get_view()
+    images = []
+    try:
+        for view in views:
+            cmd.set_view(view.tolist())
+            images.append(
+                _decode_png(_get_png(cmd, size, use_ray, timeout, cache))
+            )
+    finally:
+        cmd.set_view(original_view)
+    return np.stack(images)
+
+
+def _get_png(cmd, size, use_ray, timeout, cache):
+    """
+    Get the PNG data of the image from the cache or render it.
+    """
+    if cache is None:
+        return _render_png(cmd, size, use_ray, timeout)
+    key = RenderCache.fingerprint(cmd, size, use_ray)
+    data = cache.get(key)
+    if data is None:
+        data = _render_png(cmd, size, use_ray, timeout)
+        cache.put(key, data)
+    return data
+
+
+def _render_png(cmd, size, use_ray, timeout):
+    """
+    Render an image and get it as PNG data.
+    """
     if size is None:
         width = 0
         height = 0
     else:
         width, height = size
+    ray = 1 if use_ray else 0
     
-    if use_ray:
-        ray = 1
-    else:
-        ray = 0
-    
-    image_file = tempfile.NamedTemporaryFile(
-        delete=False, prefix="ammolite_", suffix=".png"
-    )
-    image_file.close()
-    
-    start_time = datetime.datetime.now()
+    try:
+        # 'cmd.png()' waits until the image is rendered
+        # and returns the PNG data, if no file name is given
+        data = cmd.png(None, width, height, ray=ray)
+    except Exception:
+        data = None
+    if isinstance(data, bytes):
+        return data
+
+    # Fallback for PyMOL versions that can only write files
+    with tempfile.TemporaryDirectory(prefix="ammolite_") as temp_dir:
+        file_name = join(temp_dir, "image.png")
+        start_time = time.perf_counter()
+        cmd.png(file_name, width, height, ray=ray)
+        # Wait until pending commands, including the rendering, are done
+        cmd.sync(timeout)
+        while True:
+            # Check if PyMOL has completely written the image to file
+            # by checking for the final chunk
+            # to avoid reading a partially written file
+            if isfile(file_name):
+                with open(file_name, "rb") as file:
+                    data = file.read()
+                if data.endswith(_PNG_END):
+                    return data
+            # After 'timeout' seconds the loop exits with an error
+            if time.perf_counter() - start_time > timeout:
+                raise TimeoutError(
+                    "No PNG image was output within the expected time limit"
+                )
+            time.sleep(INTERVAL)
 
-    cmd.png(image_file.name, width, height, ray=ray)
-    
-    while True:
-        # After 'timeout' seconds the loop exits with an error
-        if (datetime.datetime.now() - start_time).total_seconds() > timeout:
-            raise TimeoutError(
-                "No PNG image was output within the expected time limit"
-            )
-        
-        # Check if PyMOL has already written image data to file
-        if getsize(image_file.name) > 0:
-            break
 
-        time.sleep(INTERVAL)
+def _decode_png(data):
+    """
+    Decode an RGBA PNG image, as created by *PyMOL*.
+
+    The image is decoded with :mod:`PIL`, if it is installed, and
+    with :func:`_decode_png_numpy()` otherwise.
+
+    Parameters
+    ----------
+    data : bytes
+        The PNG file content.
+
+    Returns
+    -------
+    image : ndarray, shape=(h,w,4), dtype=uint8
+        The decoded image.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return _decode_png_numpy(data)
+
+    with Image.open(io.BytesIO(data)) as image:
+        return np.array(image.convert("RGBA"))
+
+
+def _decode_png_numpy(data):
+    """
+    Decode a non-interlaced 8-bit RGBA PNG image, as created by *PyMOL*,
+    without dependencies beyond :mod:`numpy`.
+
+    Parameters
+    ----------
+    data : bytes
+        The PNG file content.
+
+    Returns
+    -------
+    image : ndarray, shape=(h,w,4), dtype=uint8
+        The decoded image.
+    """
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("The data is not a PNG image")
+    header = None
+    compressed = []
+    pos = 8
+    while pos < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos : pos+8])
+        chunk = data[pos+8 : pos+8+length]
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunk_type == b"IDAT":
+            compressed.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+        # Skip length, type and CRC
+        pos += length + 12
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if bit_depth != 8 or color_type != 6 or interlace != 0:
+        raise ValueError(
+            "Only non-interlaced 8-bit RGBA PNG images are supported"
+        )
     
-    return Image(image_file.name)
+    scanlines = np.frombuffer(
+        zlib.decompress(b"".join(compressed)), dtype=np.uint8
+    ).reshape(height, 1 + width * 4)
+    filter_types = scanlines[:, 0]
+    filtered = scanlines[:, 1:].reshape(height, width, 4).astype(np.int16)
+
+    # A pixel depends on its left, upper and upper left neighbor
+    # -> all pixels on the same antidiagonal can be reconstructed at once
+    # For efficient slicing the image is sheared, so that
+    # 'sheared[d+1, y+1]' is the pixel at 'y' on the antidiagonal 'd',
+    # i.e. at 'x = d - y'
+    # The additional zero entries represent the out-of-image neighbors
+    n_diagonals = height + width - 1
+    y, x = np.indices((height, width))
+    sheared_filtered = np.zeros((n_diagonals, height, 4), dtype=np.int16)
+    sheared_filtered[x + y, y] = filtered
+    sheared = np.zeros((n_diagonals + 1, height + 1, 4), dtype=np.int16)
+    # The filter type of each row as boolean masks
+    is_sub, is_up, is_average, is_paeth = [
+        (filter_types == i)[:, np.newaxis] for i in (1, 2, 3, 4)
+    ]
+    for diagonal in range(n_diagonals):
+        start = max(0, diagonal - width + 1)
+        stop = min(diagonal, height - 1) + 1
+        rows = slice(start, stop)
+        left = sheared[diagonal, start+1 : stop+1]
+        up = sheared[diagonal, start : stop]
+        up_left = sheared[diagonal-1, start : stop] if diagonal > 0 else 0
+        # Paeth predictor
+        p_left = np.abs(up - up_left)
+        p_up = np.abs(left - up_left)
+        p_up_left = np.abs(left + up - 2 * up_left)
+        paeth = np.where(
+            (p_left <= p_up) & (p_left <= p_up_left), left,
+            np.where(p_up <= p_up_left, up, up_left)
+        )
+        prediction = (
+            is_sub[rows] * left
+            + is_up[rows] * up
+            + is_average[rows] * ((left + up) >> 1)
+            + is_paeth[rows] * paeth
+        )
+        sheared[diagonal+1, start+1 : stop+1] = (
+            sheared_filtered[diagonal, rows] + prediction
+        ) & 0xFF
+    return sheared[x + y + 1, y + 1].astype(np.uint8)
 
 
 class TimeoutError(Exception):
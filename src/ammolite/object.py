@@ -1,13 +1,27 @@
 __name__ = "ammolite"
 __author__ = "Patrick Kunzmann"
-__all__ = ["PyMOLObject", "NonexistentObjectError", "ModifiedObjectError"]
+__all__ = ["PyMOLObject", "NonexistentObjectError", "ModifiedObjectError",
+           "DeferredCommandError"]
 
+import hashlib
 import numbers
+import os
+import re
+import tempfile
+import threading
+import traceback
+import warnings
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import wraps
 import numpy as np
 import biotite.structure as struc
-from .convert import convert_to_atom_array, convert_to_chempy_model
-from .startup import get_and_set_pymol_instance
+from .convert import (
+    BOND_ORDER, convert_to_atom_array, convert_to_chempy_model,
+    _create_atom_array, _convert_to_cif, _write_dcd, _paused_gc
+)
+from .startup import get_and_set_pymol_instance, suspend_updates
 
 
 def validate(method):
@@ -18,14 +32,23 @@ def validate(method):
     """
     @wraps(method)
     def wrapper(self, *args, **kwargs):
-        self._check_existence()
-        new_atom_count = self._cmd.count_atoms(f"model {self._name}")
-        if new_atom_count != self._atom_count:
-            raise ModifiedObjectError(
-                f"The number of atoms in the object changed "
-                f"from the original {self._atom_count} atoms "
-                f" to {new_atom_count} atoms"
-            )
+        if self._deferred_calls is not None:
+            if method.__name__ in _DEFERRABLE_METHODS:
+                # The caller of this wrapper
+                call_site = traceback.extract_stack(limit=2)[0]
+                self._deferred_calls.append(
+                    (method, args, kwargs, call_site)
+                )
+                return None
+            else:
+                # The method might depend on the result of the
+                # deferred commands
+                self.flush()
+        if self._batch_depth > 0:
+            # The object is validated when leaving the batch
+            self._skipped_validations += 1
+        else:
+            self._validate()
         return method(self, *args, **kwargs)
     return wrapper
 
@@ -67,26 +90,92 @@ class PyMOLObject:
         If set to true, the underlying *PyMOL* object will be removed
         from the *PyMOL* session,
         when this object is garbage collected.
+    track_changes : bool, optional
+        If set to true, :meth:`sync()` obtains the current structure
+        from *PyMOL* on the first call and transfers only the
+        differences to the given structure.
+        Otherwise, :meth:`sync()` recreates the *PyMOL* object from the
+        given structure.
     
     Attributes
     ----------
     name : str
         The name of the *PyMOL* object.
+    skipped_validations : int
+        The total number of validations, that were skipped within
+        :meth:`batch()` contexts.
     """
     
     _object_counter = 0
-    _color_counter = 0
+    _selection_counter = 0
+
+    # The minimum number of atoms, for which the 'cif' loader is used
+    # by default in 'from_structure()':
+    # For smaller structures the overhead of parsing the mmCIF string
+    # outweighs the creation of the chempy model
+    CIF_LOADER_THRESHOLD = 30
+
+    # The maximum number of named colors, that are registered for
+    # RGB values given to 'color()' per PyMOL instance
+    COLOR_REGISTRY_SIZE = 1000
+    # The number of steps per RGB channel, to which the RGB values given
+    # to 'color()' are rounded, or None for no rounding
+    COLOR_RESOLUTION = 255
+
+    # The approximate maximum size of the coordinates in bytes,
+    # that is transferred to PyMOL at once in 'from_structure()'
+    STATE_CHUNK_BYTES = 100_000_000
+
+    # The maximum number of masks, whose selection expressions are
+    # cached per object
+    SELECTION_CACHE_SIZE = 32
+    # The number of times a mask is given to a command, until it is
+    # stored as named selection in PyMOL
+    SELECTION_MATERIALIZATION_USES = 2
+    # The length of a selection expression, above which a mask given
+    # to a command is rather selected by tagging the masked atoms with
+    # the 'SELECTION_FLAG':
+    # The time for parsing an expression increases with its length,
+    # while the time for tagging is independent of the fragmentation of
+    # the mask
+    SELECTION_TAG_THRESHOLD = 1000
+    # The atom flag used for tagging
+    # (flags 16-23 are reserved by PyMOL for external applications)
+    SELECTION_FLAG = 16
     
 
-    def __init__(self, name, pymol_instance=None, delete=True):
+    def __init__(self, name, pymol_instance=None, delete=True,
+                 track_changes=False):
         self._name = name
         self._pymol = get_and_set_pymol_instance(pymol_instance)
         self._delete = delete
         self._cmd = self._pymol.cmd
         self._check_existence()
         self._atom_count = self._cmd.count_atoms(f"model {self._name}")
+        # The structure that was uploaded most recently
+        # -> used by 'sync()'
+        self._snapshot = None
+        # If false, 'sync()' uploads the structure completely,
+        # instead of comparing it to the snapshot
+        self._track_changes = track_changes
+        # The annotations used for compiling selection expressions
+        # -> used by 'where()'
+        self._hierarchy = None
+        # The cached selections for the most recently used masks
+        self._selection_cache = OrderedDict()
+        # The number of nested 'batch()' contexts
+        self._batch_depth = 0
+        self._skipped_validations = 0
+        # Records style commands within a 'coalesce()' context
+        self._style_recorder = None
+        # The commands queued within a 'defer()' context
+        self._deferred_calls = None
 
     def __del__(self):
+        try:
+            self._clear_selection_cache()
+        except:
+            pass
         if self._delete:
             try:
                 # Try to delete this object from PyMOL
@@ -98,7 +187,9 @@ class PyMOLObject:
 
 
     @staticmethod
-    def from_structure(atoms, name=None, pymol_instance=None, delete=True):
+    def from_structure(atoms, name=None, pymol_instance=None, delete=True,
+                       loader="auto", start=None, stop=None, step=None,
+                       track_changes=False):
         """
         Create a :class:`PyMOLObject` from an :class:`AtomArray` or
         :class:`AtomArrayStack` and add it to the *PyMOL* session.
@@ -123,6 +214,42 @@ class PyMOLObject:
             If set to true, the underlying *PyMOL* object will be
             removed from the *PyMOL* session, when this object is
             garbage collected.
+        loader : {'auto', 'chempy', 'cif'}, optional
+            The way the structure is transferred to *PyMOL*:
+
+            - ``'chempy'`` - The structure is converted into a *chempy*
+              model via :func:`convert_to_chempy_model()`, which is
+              loaded with ``load_model()``.
+            - ``'cif'`` - The structure is written into an in-memory
+              *mmCIF* string including its bonds, which is loaded with
+              ``load_raw()``.
+              This avoids the creation of *Python* objects for each
+              atom and is much faster for large structures.
+            - ``'auto'`` - ``'cif'`` is used for structures with
+              bonds and at least :attr:`CIF_LOADER_THRESHOLD` atoms,
+              ``'chempy'`` otherwise.
+
+            All loaders retain the atom order of the given structure.
+        start, stop, step : int, optional
+            If an :class:`AtomArrayStack` is given, only the models
+            ``atoms[start:stop:step]`` are loaded as states.
+            The models are not copied for this purpose.
+        track_changes : bool, optional
+            If set to true, a copy of the annotations, bonds and
+            coordinates (only for an :class:`AtomArray`) is kept, so
+            that :meth:`sync()` transfers only the differences to a
+            later version of the structure.
+            Otherwise, :meth:`sync()` recreates the *PyMOL* object from
+            the given structure.
+            This copy roughly doubles the memory required for the
+            structure.
+
+        Notes
+        -----
+        The models of an :class:`AtomArrayStack` are transferred to
+        *PyMOL* as trajectory in chunks of approximately
+        :attr:`STATE_CHUNK_BYTES` size, which is much faster than
+        loading each model individually.
         """
         pymol_instance = get_and_set_pymol_instance(pymol_instance)
         cmd = pymol_instance.cmd
@@ -131,21 +258,176 @@ class PyMOLObject:
             name = f"ammolite_obj_{PyMOLObject._object_counter}"
             PyMOLObject._object_counter += 1
         
-        if isinstance(atoms, struc.AtomArray) or \
-        (isinstance(atoms, struc.AtomArrayStack) and atoms.stack_depth == 1):
-                model = convert_to_chempy_model(atoms)
-                cmd.load_model(model, name)
+        if isinstance(atoms, struc.AtomArray):
+            _load_structure(cmd, atoms, name, loader)
         elif isinstance(atoms, struc.AtomArrayStack):
-            # Use first model as template
-            model = convert_to_chempy_model(atoms[0])
-            cmd.load_model(model, name)
+            # Slicing gives a view, i.e. the coordinates are not copied
+            coord = atoms.coord[start:stop:step]
+            if len(coord) == 0:
+                raise IndexError("The selected range of models is empty")
+            # Use first selected model as template
+            template = atoms[0]
+            template.coord = coord[0]
+            _load_structure(cmd, template, name, loader)
             # Append states corresponding to all following models
-            for coord in atoms.coord[1:]:
-                cmd.load_coordset(coord, name)
+            _load_states(cmd, name, coord[1:])
         else:
             raise TypeError("Expected 'AtomArray' or 'AtomArrayStack'")
 
-        return PyMOLObject(name, pymol_instance, delete)
+        pymol_object = PyMOLObject(
+            name, pymol_instance, delete, track_changes
+        )
+        if track_changes:
+            pymol_object._snapshot = _take_snapshot(atoms)
+            pymol_object._hierarchy = _SelectionHierarchy.from_snapshot(
+                pymol_object._snapshot
+            )
+        return pymol_object
+
+
+    @staticmethod
+    def from_trajectory(atoms, file_name, name=None, pymol_instance=None,
+                        delete=True, loader="auto", start=None, stop=None,
+                        step=None, chunk_size=None, superimpose=False,
+                        track_changes=False):
+        """
+        Create a :class:`PyMOLObject` from a topology :class:`AtomArray`
+        and the frames of a trajectory file and add it to the *PyMOL*
+        session.
+
+        In contrast to reading the trajectory into an
+        :class:`AtomArrayStack` and calling :meth:`from_structure()`,
+        the frames are streamed from the file into *PyMOL* in chunks.
+        Hence, the required memory is independent of the length of the
+        trajectory.
+
+        Parameters
+        ----------
+        atoms : AtomArray
+            The topology of the trajectory.
+            The atoms must correspond to the atoms in the trajectory
+            file.
+        file_name : str
+            The path of the trajectory file.
+            The file format is determined from the file extension.
+            Supported formats are *XTC* (``.xtc``), *TRR* (``.trr``),
+            *DCD* (``.dcd``) and *NetCDF* (``.nc``, ``.netcdf``).
+        name : str, optional
+            The name of the newly created *PyMOL* object.
+            If omitted, a unique name is generated.
+        pymol_instance : module or SingletonPyMOL or PyMOL, optional
+            If *PyMOL* is used in library mode, the :class:`PyMOL`
+            or :class:`SingletonPyMOL` object is given here.
+            If otherwise *PyMOL* is used in GUI mode, the :mod:`pymol`
+            module is given.
+            By default the currently used *PyMOL* instance
+            (``ammolite.pymol``) is used.
+            If no *PyMOL* instance is currently running,
+            *PyMOL* is started in library mode.
+        delete : PyMOL, optional
+            If set to true, the underlying *PyMOL* object will be
+            removed from the *PyMOL* session, when this object is
+            garbage collected.
+        loader : {'auto', 'chempy', 'cif'}, optional
+            The way the topology is transferred to *PyMOL*.
+            See :meth:`from_structure()` for details.
+        start, stop, step : int, optional
+            Only the frames ``start:stop:step`` of the trajectory are
+            loaded as states.
+            The frame indices start at 0.
+        chunk_size : int, optional
+            The number of frames that are read and transferred at once.
+            By default, the number of frames is chosen so that a chunk
+            is approximately :attr:`STATE_CHUNK_BYTES` large.
+        superimpose : bool or ndarray, dtype=bool, optional
+            If set to true, each frame is superimposed onto the
+            coordinates of `atoms`, before it is transferred to *PyMOL*.
+            If a boolean mask is given, only the atoms covered by the
+            mask are considered for the superimposition
+            (e.g. the CA atoms).
+        track_changes : bool, optional
+            If set to true, :meth:`sync()` obtains the current
+            structure from *PyMOL* on the first call and transfers only
+            the differences to the given structure.
+            Otherwise, :meth:`sync()` recreates the *PyMOL* object from
+            the given structure.
+
+        Returns
+        -------
+        pymol_object : PyMOLObject
+            The created object, containing one state for each loaded
+            frame.
+
+        Notes
+        -----
+        Reading the trajectory file requires the :mod:`mdtraj`
+        package.
+        """
+        # Import here, as the trajectory modules are optional
+        from biotite.structure.io.xtc import XTCFile
+        from biotite.structure.io.trr import TRRFile
+        from biotite.structure.io.dcd import DCDFile
+        from biotite.structure.io.netcdf import NetCDFFile
+
+        file_classes = {
+            ".xtc": XTCFile,
+            ".trr": TRRFile,
+            ".dcd": DCDFile,
+            ".nc": NetCDFFile,
+            ".netcdf": NetCDFFile,
+        }
+        extension = os.path.splitext(file_name)[1].lower()
+        try:
+            file_class = file_classes[extension]
+        except KeyError:
+            raise ValueError(
+                f"'{extension}' is not a supported trajectory file format"
+            )
+        if not isinstance(atoms, struc.AtomArray):
+            raise TypeError("Expected 'AtomArray'")
+        
+        pymol_instance = get_and_set_pymol_instance(pymol_instance)
+        cmd = pymol_instance.cmd
+
+        if name is None:
+            name = f"ammolite_obj_{PyMOLObject._object_counter}"
+            PyMOLObject._object_counter += 1
+        
+        if chunk_size is None:
+            chunk_size = max(
+                1, PyMOLObject.STATE_CHUNK_BYTES
+                   // (atoms.array_length() * 3 * 4)
+            )
+        if isinstance(superimpose, (bool, np.bool_)):
+            atom_mask = None
+        else:
+            atom_mask = np.asarray(superimpose, dtype=bool)
+            superimpose = True
+        
+        pymol_object = None
+        for coord, _, _ in file_class.read_iter(
+            file_name, start, stop, step, stack_size=chunk_size
+        ):
+            if superimpose:
+                coord, _ = struc.superimpose(atoms.coord, coord, atom_mask)
+                coord = coord.astype(np.float32, copy=False)
+            if pymol_object is None:
+                # Use first frame as template
+                template = atoms.copy()
+                template.coord = coord[0]
+                _load_structure(cmd, template, name, loader)
+                pymol_object = PyMOLObject(
+                    name, pymol_instance, delete, track_changes
+                )
+                coord = coord[1:]
+            _load_states(cmd, name, coord)
+            # Free the chunk before the next one is read
+            del coord
+        
+        if pymol_object is None:
+            raise IndexError("The selected range of frames is empty")
+        return pymol_object
+
 
     def to_structure(self, state=None, altloc="first", extra_fields=None,
                      include_bonds=False):
@@ -158,10 +440,13 @@ class PyMOLObject:
 
         Parameters
         ----------
-        state : int, optional
+        state : int or iterable of int, optional
             If this parameter is given, the function will return an
             :class:`AtomArray` corresponding to the given state of the
             *PyMOL* object.
+            If an iterable of states is given, e.g.
+            ``range(1, 1001, 10)``, an :class:`AtomArrayStack`
+            containing only these states is returned.
             If this parameter is omitted, an :class:`AtomArrayStack`
             containing all states will be returned, even if the *PyMOL*
             object contains only one state.
@@ -187,31 +472,20 @@ class PyMOLObject:
             The converted structure.
             Whether an :class:`AtomArray` or :class:`AtomArrayStack` is
             returned depends on the `state` parameter.
+        
+        See also
+        --------
+        get_coord
+            Get only the coordinates, optionally into a preallocated
+            array.
         """
-        if state is None:
-            model = self._cmd.get_model(self._name, state=1)
-            template = convert_to_atom_array(
-                model, include_bonds
-            )
-            expected_length = None
-            coord = []
-            for i in range(self._cmd.count_states(self._name)):
-                state_coord = self._cmd.get_coordset(self._name, state=i+1)
-                if expected_length is None:
-                    expected_length = len(state_coord)
-                elif len(state_coord) != expected_length:
-                    raise ValueError(
-                        "The models have different numbers of atoms"
-                    )
-                coord.append(state_coord)
-            coord = np.stack(coord)
-            structure = struc.from_template(template, coord)
+        self.flush()
+        if state is None or not isinstance(state, numbers.Integral):
+            template = self._get_atom_array(1, include_bonds)
+            structure = struc.from_template(template, self.get_coord(state))
         
         else:
-            model = self._cmd.get_model(self._name, state=state)
-            structure = convert_to_atom_array(
-                model, include_bonds
-            )
+            structure = self._get_atom_array(state, include_bonds)
         
         # Filter altloc IDs and return
         if altloc == "occupancy":
@@ -236,7 +510,515 @@ class PyMOLObject:
             raise ValueError(f"'{altloc}' is not a valid 'altloc' option")
 
 
-    
+    def _get_atom_array(self, state, include_bonds):
+        """
+        Get an :class:`AtomArray` for the given state of this object.
+
+        The annotations are transferred with a single ``iterate_state()``
+        call and the coordinates with a single ``get_coords()`` call,
+        instead of creating an intermediate *chempy* model.
+        """
+        if include_bonds and not hasattr(self._cmd, "get_bonds"):
+            # Older PyMOL versions provide bonds only via a chempy model
+            return convert_to_atom_array(
+                self._cmd.get_model(self._name, state=state), include_bonds
+            )
+        
+        selection = f"model {self._name}"
+        annotations = []
+        with _paused_gc():
+            self._cmd.iterate_state(
+                state, selection,
+                "annotations.append("
+                "(chain, resv, resi, resn, type, name, elem, b, q, "
+                "formal_charge, alt)"
+                ")",
+                space={"annotations": annotations}
+            )
+            if len(annotations) > 0:
+                columns = list(zip(*annotations))
+            else:
+                columns = [()] * 11
+        (
+            chain_id, res_id, res_id_str, res_name, record, atom_name,
+            element, b_factor, occupancy, charge, altloc_id
+        ) = columns
+        # PyMOL appends the insertion code to the residue ID string
+        ins_codes = {
+            res_str: res_str[-1] if res_str and not res_str[-1].isdigit()
+            else ""
+            for res_str in set(res_id_str)
+        }
+        ins_code = [ins_codes[res_str] for res_str in res_id_str]
+        hetero = np.array(record) == "HETATM"
+        
+        coord = self._cmd.get_coords(selection, state)
+        if coord is None:
+            # PyMOL returns 'None' for an empty selection
+            coord = np.zeros((0, 3), dtype=np.float32)
+
+        atom_array = _create_atom_array(
+            chain_id, res_id, ins_code, res_name, hetero, atom_name,
+            element, b_factor, occupancy, charge, altloc_id, coord
+        )
+        if include_bonds:
+            bond_array = np.array(
+                self._cmd.get_bonds(selection, state), dtype=np.uint32
+            ).reshape(-1, 3)
+            atom_array.bonds = struc.BondList(
+                atom_array.array_length(), bond_array
+            )
+        return atom_array
+
+
+    def get_coord(self, state=None, out=None):
+        """
+        Get the coordinates of one, multiple or all states of this
+        object.
+
+        In contrast to :meth:`to_structure()` no annotations are
+        transferred.
+        The coordinates of each state are directly copied from *PyMOL*
+        into the respective part of the output array, without creating
+        intermediate arrays.
+        Hence, the peak memory consumption is the size of the output
+        array, which may even be preallocated by the caller.
+
+        Parameters
+        ----------
+        state : int or iterable of int, optional
+            If an integer is given, the coordinates of this state are
+            returned as *(n,3)* array.
+            If an iterable of states is given, e.g.
+            ``range(1, 1001, 10)``, the coordinates of these states are
+            returned as *(m,n,3)* array.
+            By default, the coordinates of all states are returned as
+            *(m,n,3)* array.
+        out : ndarray, dtype=float32, optional
+            If given, the coordinates are written into this array,
+            which must have the shape of the returned array.
+            For example, this may be a :class:`numpy.memmap`, if the
+            coordinates of all states do not fit into memory.
+        
+        Returns
+        -------
+        coord : ndarray, shape=(n,3) or shape=(m,n,3), dtype=float32
+            The coordinates.
+            If `out` is given, `out` is returned.
+        """
+        self.flush()
+        n_atoms = self._atom_count
+        n_states = self._cmd.count_states(self._name)
+
+        single_state = isinstance(state, numbers.Integral)
+        if single_state:
+            states = [state]
+        elif state is None:
+            states = range(1, n_states+1)
+        else:
+            states = list(state)
+        for s in states:
+            if s < 1 or s > n_states:
+                raise IndexError(
+                    f"State {s} is out of range "
+                    f"for an object with {n_states} states"
+                )
+        
+        shape = (n_atoms, 3) if single_state else (len(states), n_atoms, 3)
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif out.shape != shape:
+            raise ValueError(
+                f"Expected an output array with shape {shape}, "
+                f"but got {out.shape}"
+            )
+        for i, s in enumerate(states):
+            # The coordinate set does not need to be copied by PyMOL,
+            # as it is copied into the output array anyway
+            state_coord = self._cmd.get_coordset(self._name, s, copy=0)
+            if len(state_coord) != n_atoms:
+                raise ValueError(
+                    "The models have different numbers of atoms"
+                )
+            if single_state:
+                out[...] = state_coord
+            else:
+                out[i] = state_coord
+        return out
+
+
+    @validate
+    def set_coord(self, coord, state=None):
+        """
+        Replace the coordinates of one, multiple or all states of this
+        object.
+
+        In contrast to creating a new object via
+        :meth:`from_structure()`, only the coordinates are transferred
+        and all other properties of the object, such as colors and
+        representations, are kept.
+
+        Parameters
+        ----------
+        coord : ndarray, shape=(n,3) or shape=(m,n,3), dtype=float
+            The new coordinates.
+        state : int or iterable of int, optional
+            If an integer is given, the coordinates of this state are
+            replaced by the *(n,3)* `coord`.
+            If an iterable of states is given, e.g.
+            ``range(1, 1001, 10)``, the coordinates of these states are
+            replaced by the *(m,n,3)* `coord`.
+            By default, the coordinates of all states are replaced,
+            i.e. *m* must be equal to the number of states.
+        
+        See also
+        --------
+        append_states
+        """
+        n_states = self._cmd.count_states(self._name)
+        single_state = isinstance(state, numbers.Integral)
+        if single_state:
+            states = [state]
+        elif state is None:
+            states = range(1, n_states+1)
+        else:
+            states = list(state)
+        for s in states:
+            if s < 1 or s > n_states:
+                raise IndexError(
+                    f"State {s} is out of range "
+                    f"for an object with {n_states} states"
+                )
+        
+        coord = np.asarray(coord)
+        shape = (self._atom_count, 3) if single_state \
+                else (len(states), self._atom_count, 3)
+        if coord.shape != shape:
+            raise IndexError(
+                f"Expected coordinates with shape {shape}, "
+                f"but got {coord.shape}"
+            )
+        if single_state:
+            coord = coord[np.newaxis]
+        
+        # Transfer consecutive states at once
+        run_start = 0
+        for i in range(1, len(states) + 1):
+            if i == len(states) or states[i] != states[i-1] + 1:
+                _load_states(
+                    self._cmd, self._name, coord[run_start : i],
+                    states[run_start]
+                )
+                run_start = i
+
+
+    @validate
+    def append_states(self, coord):
+        """
+        Append one or multiple states with the given coordinates to
+        this object.
+
+        Parameters
+        ----------
+        coord : ndarray, shape=(n,3) or shape=(m,n,3), dtype=float
+            The coordinates of the new state(s).
+        
+        See also
+        --------
+        set_coord
+        """
+        coord = np.asarray(coord)
+        if coord.ndim == 2:
+            coord = coord[np.newaxis]
+        if coord.ndim != 3 or coord.shape[1:] != (self._atom_count, 3):
+            raise IndexError(
+                f"Expected coordinates for {self._atom_count} atoms, "
+                f"but got shape {coord.shape}"
+            )
+        _load_states(self._cmd, self._name, coord)
+
+
+    def sync(self, atoms):
+        """
+        Update this object, so that it reflects the given structure.
+
+        If this object was created via :meth:`from_structure()` with
+        `track_changes` enabled, the structure is compared to the
+        structure that was uploaded most recently via
+        :meth:`from_structure()` or :meth:`sync()` and only the
+        differences are transferred to *PyMOL*:
+        Changed annotations are altered only for the affected atoms and
+        the coordinates are only transferred, if they have changed.
+        Hence, synchronizing an unchanged structure is cheap.
+        If the object was created otherwise with `track_changes`
+        enabled, e.g. via the constructor, the structure is obtained
+        from *PyMOL* on the first call for this purpose.
+
+        Only if the topology changed, i.e. the number of atoms, the
+        bonds or the number of models, the underlying *PyMOL* object is
+        recreated.
+        In this case all other properties of the object, such as colors
+        and representations, are lost.
+        If this object was created without `track_changes`, which is
+        the default, the object is always recreated.
+
+        Parameters
+        ----------
+        atoms : AtomArray or AtomArrayStack
+            The structure to synchronize this object with.
+            The models of an :class:`AtomArrayStack` correspond to the
+            states of this object.
+            As the coordinates of an :class:`AtomArrayStack` are not
+            stored for comparison, they are always transferred.
+        
+        Returns
+        -------
+        rebuilt : bool
+            True, if the *PyMOL* object was recreated.
+        """
+        self.flush()
+        self._check_existence()
+        if isinstance(atoms, struc.AtomArray):
+            n_models = 1
+        elif isinstance(atoms, struc.AtomArrayStack):
+            n_models = atoms.stack_depth()
+        else:
+            raise TypeError("Expected 'AtomArray' or 'AtomArrayStack'")
+        
+        if not self._track_changes:
+            # Without snapshot the differences are unknown
+            # -> upload the structure completely
+            self._reload(atoms)
+            self._hierarchy = None
+            return True
+
+        if self._snapshot is None:
+            # The object was not uploaded by this object
+            # -> obtain the current structure from PyMOL
+            self._snapshot = _take_snapshot(
+                self._get_atom_array(1, include_bonds=True)
+            )
+        snapshot = self._snapshot
+        new_snapshot = _take_snapshot(atoms)
+        if (
+            atoms.array_length() != self._atom_count
+            or self._cmd.count_atoms(f"model {self._name}")
+            != self._atom_count
+            or self._cmd.count_states(self._name) != n_models
+            or not _arrays_equal(new_snapshot["bonds"], snapshot["bonds"])
+        ):
+            self._reload(atoms)
+            self._snapshot = new_snapshot
+            self._hierarchy = _SelectionHierarchy.from_snapshot(new_snapshot)
+            return True
+        
+        changed_masks = {}
+        for category, new_values in new_snapshot["annotations"].items():
+            old_values = snapshot["annotations"][category]
+            if not _arrays_equal(new_values, old_values):
+                changed_masks[category] = new_values != old_values
+        # The residue ID and insertion code are combined in PyMOL
+        if "res_id" in changed_masks or "ins_code" in changed_masks:
+            changed_masks["res_id"] = (
+                changed_masks.pop("res_id", False)
+                | changed_masks.pop("ins_code", False)
+            )
+        
+        for category, mask in changed_masks.items():
+            indices = np.nonzero(mask)[0]
+            expression, converter = _SYNC_EXPRESSIONS[category]
+            if category == "res_id":
+                new_values = np.char.add(
+                    atoms.res_id[indices].astype(str), atoms.ins_code[indices]
+                )
+            else:
+                new_values = new_snapshot["annotations"][category][indices]
+            # PyMOL atom indices start at 1
+            values = dict(zip(
+                (indices + 1).tolist(),
+                map(converter, new_values.tolist())
+            ))
+            # The annotations used by 'where()' are outdated at this point
+            self._cmd.alter(
+                f"model {self._name} and ({_index_ranges(mask)})",
+                expression, space={"values": values}
+            )
+        
+        if n_models == 1:
+            if not _arrays_equal(new_snapshot["coord"], snapshot["coord"]):
+                self._cmd.load_coordset(atoms.coord, self._name, 1)
+        else:
+            self.set_coord(atoms.coord)
+        
+        self._snapshot = new_snapshot
+        if changed_masks.keys() & _SELECTION_ANNOTATIONS:
+            self._hierarchy = _SelectionHierarchy.from_snapshot(new_snapshot)
+            self._clear_selection_cache()
+        return False
+
+    def _reload(self, atoms):
+        """
+        Recreate the *PyMOL* object from the given structure.
+        """
+        self._cmd.delete(self._name)
+        if isinstance(atoms, struc.AtomArray):
+            _load_structure(self._cmd, atoms, self._name, "auto")
+        else:
+            _load_structure(self._cmd, atoms[0], self._name, "auto")
+            _load_states(self._cmd, self._name, atoms.coord[1:])
+        self._atom_count = atoms.array_length()
+        self._clear_selection_cache()
+
+    @validate
+    def set_atom_property(self, name, values, selection=None):
+        """
+        Set an atom property to the given value for each atom.
+
+        In contrast to :meth:`alter()` with an expression per atom,
+        the values of all atoms are transferred with a single ``alter()``
+        command.
+
+        Parameters
+        ----------
+        name : str
+            The name of the atom property.
+            Supported are ``'b'``, ``'q'``, ``'partial_charge'``,
+            ``'vdw'``, ``'formal_charge'``, ``'ss'``, ``'reps'``,
+            ``'color'``, ``'label'`` and user-defined properties,
+            whose name is prefixed with ``'p.'``, e.g. ``'p.score'``.
+        values : array-like, shape=(n,)
+            The property value for each atom of this *PyMOL* object.
+            The values are converted into the type of the property,
+            i.e. :class:`float` for ``'b'``, ``'q'``,
+            ``'partial_charge'`` and ``'vdw'``, :class:`int` for
+            ``'formal_charge'``, ``'reps'`` (bitmask of visible
+            representations) and ``'color'`` (color index) and
+            :class:`str` for ``'ss'`` and ``'label'``.
+            The values of user-defined properties retain their type.
+        selection : str or int or slice or ndarray, dtype=bool or ndarray, dtype=int, optional
+            A *Biotite* compatible atom selection index,
+            e.g. a boolean mask, or a *PyMOL* selection expression that
+            selects the atoms of this *PyMOL* object to apply the
+            command on.
+            By default, the command is applied on all atoms of this
+            *PyMOL* object.
+            Independent of the selection, `values` must contain a value
+            for each atom.
+
+        See also
+        --------
+        get_atom_property
+        """
+        if name.startswith("p."):
+            if not name[2:].isidentifier():
+                raise ValueError(f"'{name}' is not a valid property name")
+            dtype = None
+        else:
+            try:
+                dtype = _ATOM_PROPERTY_TYPES[name]
+            except KeyError:
+                raise ValueError(
+                    f"'{name}' is not a supported atom property"
+                )
+        values = np.asarray(values, dtype=dtype)
+        if values.shape != (self._atom_count,):
+            raise IndexError(
+                f"Expected an array with shape ({self._atom_count},), "
+                f"but got {values.shape}"
+            )
+
+        pymol_selection = self._into_selection(selection)
+        # The leading 'None' allows indexing with the PyMOL atom index,
+        # which starts at 1
+        self._cmd.alter(
+            pymol_selection, f"{name} = values[index]",
+            space={"values": [None] + values.tolist()}
+        )
+        if name in ("ss", "reps"):
+            self._cmd.rebuild(pymol_selection)
+        elif name == "color":
+            self._cmd.recolor(pymol_selection)
+
+        # Keep the structure for 'sync()' up to date
+        category = _SNAPSHOT_PROPERTIES.get(name)
+        if self._snapshot is not None and category is not None:
+            if isinstance(selection, str):
+                # The affected atoms are unknown
+                # -> obtain the structure from PyMOL in 'sync()'
+                self._snapshot = None
+            else:
+                snapshot_values = self._snapshot["annotations"][category]
+                if selection is None:
+                    snapshot_values[:] = values
+                else:
+                    mask = self._to_mask(np.asarray(selection))
+                    snapshot_values[mask] = values[mask]
+
+    @validate
+    def get_atom_property(self, name):
+        """
+        Get the value of one or multiple atom properties for each atom.
+
+        In contrast to :meth:`to_structure()`, only the requested
+        properties are transferred, using a single ``iterate()``
+        command.
+
+        Parameters
+        ----------
+        name : str or iterable object of str
+            The name of the atom property.
+            Supported are the same properties as in
+            :meth:`set_atom_property()`, including user-defined
+            properties, whose name is prefixed with ``'p.'``.
+
+        Returns
+        -------
+        values : ndarray, shape=(n,) or dict of (str -> ndarray)
+            The property value for each atom of this *PyMOL* object.
+            If multiple property names are given, a dictionary maps
+            each name to the corresponding values.
+            The values of user-defined properties are ``None`` for
+            atoms, where the property is not set; in this case the
+            array has an object *dtype*.
+
+        See also
+        --------
+        set_atom_property
+        """
+        names = [name] if isinstance(name, str) else list(name)
+        for property_name in names:
+            if property_name.startswith("p."):
+                if not property_name[2:].isidentifier():
+                    raise ValueError(
+                        f"'{property_name}' is not a valid property name"
+                    )
+            elif property_name not in _ATOM_PROPERTY_TYPES:
+                raise ValueError(
+                    f"'{property_name}' is not a supported atom property"
+                )
+
+        values = []
+        with _paused_gc():
+            self._cmd.iterate(
+                f"model {self._name}",
+                f"values.append(({', '.join(names)},))",
+                space={"values": values}
+            )
+        if len(values) > 0:
+            columns = list(zip(*values))
+        else:
+            columns = [()] * len(names)
+
+        arrays = {}
+        for property_name, column in zip(names, columns):
+            dtype = _ATOM_PROPERTY_TYPES.get(property_name)
+            if dtype is None and None in column:
+                # Avoid conversion of 'None' into a string or 'NaN'
+                dtype = object
+            arrays[property_name] = np.array(column, dtype=dtype)
+        return arrays[name] if isinstance(name, str) else arrays
+
+
     @property
     def name(self):
         return self._name
@@ -254,6 +1036,243 @@ class PyMOLObject:
         """
         return self._name in self._cmd.get_object_list()
 
+    @contextmanager
+    def batch(self):
+        """
+        Create a context, in which the object is validated only once
+        on entry and once on exit, instead of before each method call.
+
+        Usually, each method checks whether the underlying *PyMOL*
+        object still exists and whether its number of atoms has
+        changed, before the actual command is executed.
+        For large objects, counting the atoms may take longer than the
+        command itself.
+        Within this context these checks are skipped, saving two
+        requests to *PyMOL* per method call.
+
+        Hence, the *PyMOL* object must not be deleted and atoms must not
+        be added or removed within the context.
+        If this happened nevertheless, the appropriate exception is
+        raised on exit.
+
+        Yields
+        ------
+        pymol_object : PyMOLObject
+            This object.
+
+        Examples
+        --------
+
+        >>> with pymol_object.batch():
+        ...     pymol_object.show_as("sticks")
+        ...     pymol_object.color("red", atom_array.element == "O")
+        ...     pymol_object.color("blue", atom_array.element == "N")
+        """
+        self._validate()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._validate()
+
+    @contextmanager
+    def coalesce(self):
+        """
+        Create a context, in which style commands are recorded and
+        combined into a minimal set of *PyMOL* commands on exit.
+
+        Within this context :meth:`color()`, :meth:`surface_color()`,
+        :meth:`show()`, :meth:`hide()` and :meth:`show_as()` are not
+        executed immediately.
+        Instead, the resulting color and visibility of each atom is
+        tracked, where later commands overwrite the effect of earlier
+        commands on the same atoms.
+        On exit, a single command is executed for each distinct final
+        color and at most two commands for each representation.
+        Hence, styling scripts that apply many commands with
+        overlapping selections send fewer and shorter selections to
+        *PyMOL*.
+
+        All other commands are executed immediately, i.e. they may
+        apply before recorded style commands that were called earlier.
+        All representations, including abbreviated names like
+        ``'stick'``, are recorded.
+
+        Yields
+        ------
+        pymol_object : PyMOLObject
+            This object.
+
+        Examples
+        --------
+
+        >>> with pymol_object.coalesce():
+        ...     pymol_object.show_as("cartoon")
+        ...     pymol_object.color("gray")
+        ...     pymol_object.show("sticks", atom_array.hetero)
+        ...     pymol_object.color("red", atom_array.element == "O")
+        """
+        if self._style_recorder is not None:
+            # Nested context -> the outermost context executes the commands
+            yield self
+            return
+        self._style_recorder = _StyleRecorder(self._atom_count)
+        try:
+            yield self
+        finally:
+            recorder = self._style_recorder
+            self._style_recorder = None
+            for method_name, args in recorder.get_commands():
+                getattr(self, method_name)(*args)
+
+    @contextmanager
+    def defer(self):
+        """
+        Create a context, in which commands are queued and executed
+        together on exit or when :meth:`flush()` is called.
+
+        Each command sent to *PyMOL* may cause locking and redraw
+        overhead, especially in GUI mode.
+        When the queued commands are executed, viewer updates are
+        suspended and the object is validated only once, as in
+        :meth:`batch()`.
+
+        All wrapper methods of *PyMOL* commands, :meth:`color_by()`,
+        :meth:`set_atom_property()`, :meth:`set_coord()` and
+        :meth:`append_states()` are queued.
+        Methods that return information about the object, e.g.
+        :meth:`where()` or :meth:`to_structure()`, execute the queued
+        commands first.
+        Arrays given to queued commands must not be modified until the
+        commands are executed.
+
+        If a queued command fails, a :exc:`DeferredCommandError`
+        pointing to the original call of the method is raised and the
+        remaining commands are discarded.
+
+        Yields
+        ------
+        pymol_object : PyMOLObject
+            This object.
+
+        Examples
+        --------
+
+        >>> with pymol_object.defer():
+        ...     pymol_object.show_as("sticks")
+        ...     pymol_object.color("red", atom_array.element == "O")
+        ...     pymol_object.orient()
+        """
+        if self._deferred_calls is not None:
+            # Nested context -> the outermost context executes the commands
+            yield self
+            return
+        self._deferred_calls = []
+        try:
+            yield self
+        finally:
+            try:
+                self.flush()
+            finally:
+                self._deferred_calls = None
+
+    def flush(self):
+        """
+        Execute the commands queued within a :meth:`defer()` context.
+
+        Outside of such context this method does nothing.
+        """
+        calls = self._deferred_calls
+        if not calls:
+            return
+        # Execute the commands immediately instead of queuing them again
+        self._deferred_calls = None
+        try:
+            with self.batch(), suspend_updates(self._pymol):
+                for method, args, kwargs, call_site in calls:
+                    try:
+                        method(self, *args, **kwargs)
+                    except Exception as e:
+                        raise DeferredCommandError(
+                            f"Deferred '{method.__name__}()' called at "
+                            f"{call_site.filename}:{call_site.lineno} "
+                            f"failed: {e}",
+                            call_site
+                        ) from e
+        finally:
+            self._deferred_calls = []
+
+    def _record_style(self, method_name, selection, *args):
+        """
+        Record a style command, if this object is in a
+        :meth:`coalesce()` context.
+
+        Returns
+        -------
+        recorded : bool
+            True, if the command was recorded, false if it needs to be
+            executed.
+        """
+        if self._style_recorder is None:
+            return False
+        if method_name in ("show", "hide", "show_as"):
+            try:
+                args = (_to_repmask(args[0]),) + args[1:]
+            except Exception:
+                # Invalid representation
+                # -> PyMOL raises the error, when the command is executed
+                return False
+        getattr(self._style_recorder, method_name)(
+            self._resolve_mask(selection), *args
+        )
+        return True
+
+    def _resolve_mask(self, selection):
+        """
+        Convert a selection index or a selection expression into
+        a boolean mask.
+        """
+        if selection is None:
+            return np.ones(self._atom_count, dtype=bool)
+        elif isinstance(selection, str):
+            indices = []
+            self._cmd.iterate(
+                f"model {self._name} and ({selection})",
+                "indices.append(index)", space={"indices": indices}
+            )
+            mask = np.zeros(self._atom_count, dtype=bool)
+            # PyMOL atom indices start at 1
+            mask[np.array(indices, dtype=int) - 1] = True
+            return mask
+        else:
+            return self._to_mask(np.asarray(selection))
+
+    @property
+    def skipped_validations(self):
+        """
+        int: The total number of validations, that were skipped within
+        :meth:`batch()` contexts.
+        Each skipped validation saves two requests to *PyMOL*.
+        """
+        return self._skipped_validations
+    
+    def _validate(self):
+        """
+        Check if the object name still exists and if the atom count has
+        been modified.
+        If this is the case, raise the appropriate exception.
+        """
+        self._check_existence()
+        new_atom_count = self._cmd.count_atoms(f"model {self._name}")
+        if new_atom_count != self._atom_count:
+            raise ModifiedObjectError(
+                f"The number of atoms in the object changed "
+                f"from the original {self._atom_count} atoms "
+                f" to {new_atom_count} atoms"
+            )
+
     def _check_existence(self):
         if not self.exists():
             raise NonexistentObjectError(
@@ -278,12 +1297,36 @@ class PyMOLObject:
         -------
         expression : str
             A *PyMOL* compatible selection expression.
+
+        Notes
+        -----
+        The selected atoms are expressed in terms of chains, residues,
+        residue names, atom names and elements, where possible,
+        e.g. ``chain A+B and name CA`` or ``chain A and resi 10-25``.
+        Ranges of atom indices are only used, if they give a shorter
+        expression.
+        Hence, also masks that select many scattered atoms result
+        in expressions that *PyMOL* can parse quickly.
+
+        These annotations are taken from the structure that was
+        uploaded most recently via :meth:`from_structure()` or
+        :meth:`sync()`, or are obtained from *PyMOL* after
+        :meth:`alter()` is called.
+        If the annotations are changed outside of this object, e.g.
+        via ``cmd.alter()``, the selection expression might select
+        the wrong atoms.
         """
         if isinstance(index, numbers.Integral):
             # PyMOLs indexing starts at 1
             return f"model {self._name} and index {index}"
-        
-        elif isinstance(index, np.ndarray) and index.dtype == bool:
+        return self._get_cached_selection(self._to_mask(index)).expression
+    
+    def _to_mask(self, index):
+        """
+        Convert a *Biotite*-compatible atom selection index into
+        a boolean mask.
+        """
+        if isinstance(index, np.ndarray) and index.dtype == bool:
             mask = index
             if len(mask) != self._atom_count:
                 raise IndexError(
@@ -295,38 +1338,125 @@ class PyMOLObject:
             # Convert any other index type into a boolean mask
             mask = np.zeros(self._atom_count, dtype=bool)
             mask[index] = True
+        return mask
+    
+    def _get_cached_selection(self, mask):
+        """
+        Get the cache entry for the given mask, containing the
+        selection expression and the name of a named selection,
+        if it was already created.
+
+        The most recently used masks are cached to avoid compiling the
+        same selection expression repeatedly.
+        """
+        key = hashlib.blake2b(
+            np.ascontiguousarray(mask).view(np.uint8), digest_size=16
+        ).digest()
+        cached = self._selection_cache.get(key)
+        if cached is not None:
+            self._selection_cache.move_to_end(key)
+            return cached
         
-        # Indices where the mask changes from True to False
-        # or from False to True
-        # The '+1' makes each index refer to the position
-        # after the change i.e. the new value
-        changes = np.where(np.diff(mask))[0] + 1
-        # If first element is True, insert index 0 at start
-        # -> the first change is always from False to True
-        if mask[0]:
-            changes = np.concatenate(([0], changes))
-        # If the last element is True, insert append length of mask
-        # as exclusive stop index
-        # -> the last change is always from True to False
-        if mask[-1]:
-            changes = np.concatenate((changes, [len(mask)]))
-        # -> Changes are alternating (F->T, T->F, F->T, ..., F->T, T->F)
-        # Reshape into pairs ([F->T, T->F], [F->T, T->F], ...)
-        # -> these are the intervals where the mask is True
-        intervals = np.reshape(changes, (-1, 2))
-
-        if len(intervals) > 0:
-            # Convert interval into selection string
-            # Two things to note:
-            # - PyMOLs indexing starts at 1-> 'start+1'
-            # - Stop in 'intervals' is exclusive -> 'stop+1-1' -> 'stop'
-            index_selection = " or ".join(
-                [f"index {start+1}-{stop}" for start, stop in intervals]
-            )
+        cached = _CachedSelection(self._compile_selection(mask))
+        self._selection_cache[key] = cached
+        while len(self._selection_cache) > self.SELECTION_CACHE_SIZE:
+            _, evicted = self._selection_cache.popitem(last=False)
+            if evicted.name is not None:
+                self._cmd.delete(evicted.name)
+        return cached
+    
+    def _clear_selection_cache(self):
+        """
+        Remove all cached selections, including the named selections
+        in *PyMOL*.
+
+        This is necessary, when the annotations of this object
+        change, as the cached expressions might refer to them.
+        """
+        for cached in self._selection_cache.values():
+            if cached.name is not None:
+                self._cmd.delete(cached.name)
+        self._selection_cache.clear()
+    
+    def _compile_selection(self, mask):
+        """
+        Compile a boolean mask into a selection expression.
+        """
+        if not mask.any():
+            return "none"
+        index_selection = _index_ranges(mask)
+        if " or " in index_selection:
+            # A single index range cannot be expressed more concisely
+            structure_selection = self._get_hierarchy().compile(mask)
+        else:
+            structure_selection = None
+        if (
+            structure_selection is None
+            or len(index_selection) < len(structure_selection)
+        ):
             # Constrain the selection to given object name
             return f"model {self._name} and ({index_selection})"
+        elif structure_selection == "":
+            # All atoms are selected
+            return f"model {self._name}"
         else:
-            return "none"
+            return f"model {self._name} and ({structure_selection})"
+    
+    def _get_hierarchy(self):
+        """
+        Get the chain IDs, residue IDs, residue names, atom names and
+        elements of this object, that are used to compile selection
+        expressions.
+
+        They are taken from the most recently uploaded structure, or
+        if it is not available, obtained from *PyMOL*.
+        """
+        if self._hierarchy is None:
+            annotations = []
+            with _paused_gc():
+                self._cmd.iterate(
+                    f"model {self._name}",
+                    "annotations.append((chain, resv, resi, resn, name, elem))",
+                    space={"annotations": annotations}
+                )
+            if len(annotations) > 0:
+                columns = list(zip(*annotations))
+            else:
+                columns = [()] * 6
+            (
+                chain_id, res_id, res_id_str, res_name, atom_name, element
+            ) = columns
+            # PyMOL appends the insertion code to the residue ID string
+            ins_codes = {
+                res_str: res_str[-1] if res_str and not res_str[-1].isdigit()
+                else ""
+                for res_str in set(res_id_str)
+            }
+            self._hierarchy = _SelectionHierarchy(
+                np.array(chain_id, dtype=str),
+                np.array(res_id, dtype=int),
+                np.array([ins_codes[res_str] for res_str in res_id_str],
+                         dtype=str),
+                np.array(res_name, dtype=str),
+                np.array(atom_name, dtype=str),
+                np.array(element, dtype=str),
+            )
+        return self._hierarchy
+    
+    def _get_color_name(self, color):
+        """
+        Get a *PyMOL* color name for the given color name or RGB value,
+        using the color registry of the *PyMOL* instance.
+        """
+        try:
+            registry = _color_registries[self._cmd]
+        except KeyError:
+            registry = _ColorRegistry(self._cmd)
+            _color_registries[self._cmd] = registry
+        if isinstance(color, str):
+            return registry.check_name(color)
+        else:
+            return registry.get_name(color)
     
     def _into_selection(self, selection, not_none=False):
         """
@@ -338,10 +1468,57 @@ class PyMOLObject:
         elif isinstance(selection, str):
             return f"model {self._name} and ({selection})"
         else:
-            sel = self.where(np.asarray(selection))
-            if sel == "none" and not_none:
-                raise ValueError("Selection contains no atoms")
-            return sel
+            mask = self._to_mask(np.asarray(selection))
+            cached = self._get_cached_selection(mask)
+            if cached.expression == "none":
+                if not_none:
+                    raise ValueError("Selection contains no atoms")
+                return cached.expression
+            if cached.name is None:
+                expression = cached.expression
+                is_tagged = len(expression) > self.SELECTION_TAG_THRESHOLD
+                if is_tagged:
+                    # Parsing the expression would take longer than
+                    # tagging the atoms
+                    expression = self._tag_atoms(mask)
+                cached.uses += 1
+                # Tagged atoms are always stored as named selection,
+                # as the flag is overwritten, when the next mask is
+                # tagged, e.g. for the second operand of the same command
+                if is_tagged \
+                        or cached.uses >= self.SELECTION_MATERIALIZATION_USES:
+                    # Frequently used masks are stored as named selection,
+                    # so that PyMOL parses the expression only once
+                    # The leading underscore hides the selection in PyMOL
+                    name = f"_ammolite_sel_{PyMOLObject._selection_counter}"
+                    PyMOLObject._selection_counter += 1
+                    self._cmd.select(name, expression, enable=0)
+                    cached.name = name
+                else:
+                    return expression
+            return cached.name
+    
+    def _tag_atoms(self, mask):
+        """
+        Set the :attr:`SELECTION_FLAG` for the atoms in the mask and
+        clear it for all other atoms.
+
+        Returns
+        -------
+        expression : str
+            A selection expression, that selects the tagged atoms, as
+            long as the flag is not changed again.
+            Hence, the expression must be stored as named selection,
+            before another mask is tagged.
+        """
+        bit = 1 << self.SELECTION_FLAG
+        self._cmd.alter(
+            f"model {self._name}",
+            f"flags = (flags | {bit}) if mask[index-1] "
+            f"else (flags & {~bit & 0xFFFFFFFF})",
+            space={"mask": mask.tolist()}
+        )
+        return f"model {self._name} and flag {self.SELECTION_FLAG}"
 
 
 
@@ -367,6 +1544,10 @@ class PyMOLObject:
             this expression.
         """
         self._cmd.alter(self._into_selection(selection), expression)
+        # The annotations might have changed
+        # -> obtain them from PyMOL in the next call of 'where()'
+        self._hierarchy = None
+        self._clear_selection_cache()
     
     @validate
     def cartoon(self, type, selection=None):
@@ -492,23 +1673,105 @@ class PyMOLObject:
         
         Notes
         -----
-        If an RGB color is given, the color is registered as a unique
-        named color via the ``set_color()`` command.
+        If an RGB color is given, the color is registered as a named
+        color via the ``set_color()`` command.
+        Identical RGB values, after rounding them to
+        :attr:`COLOR_RESOLUTION` steps, reuse the same named color.
+        At most :attr:`COLOR_REGISTRY_SIZE` of these colors are
+        registered per *PyMOL* instance:
+        If this limit is reached, further RGB colors are given to
+        *PyMOL* as direct ``0xRRGGBB`` colors, which need no
+        registration.
         """
-        if not isinstance(color, str):
-            color_name = f"ammolite_color_{PyMOLObject._color_counter}"
-            PyMOLObject._color_counter += 1
-            self._cmd.set_color(color_name, tuple(color))
+        if representation is not None and representation not in (
+            "sphere", "surface", "mesh", "dot", "cartoon", "ribbon"
+        ):
+            raise ValueError(
+                f"'{representation}' is not a supported representation"
+            )
+        if self._record_style("color", selection, color, representation):
+            return
+        color_name = self._get_color_name(color)
+        
+        if representation is None:
+            self._cmd.color(color_name, self._into_selection(selection))
         else:
-            color_name = color
-            registered = [name for name, _ in self._cmd.get_color_indices()]
-            if color_name not in registered:
-                raise ValueError(
-                    f"Unknown color '{color_name}'"
+            self._cmd.set(
+                f"{representation}_color",
+                color_name, self._into_selection(selection)
+            )
+    
+    
+    @validate
+    def color_by(self, values, cmap=None, vmin=None, vmax=None,
+                 selection=None, representation=None):
+        """
+        Change the color of each atom individually, based on an array
+        of RGB values or scalar values.
+
+        In contrast to calling :meth:`color()` for each color, the
+        colors of all atoms are set with a constant number of *PyMOL*
+        commands, independent of the number of distinct colors.
+
+        Parameters
+        ----------
+        values : ndarray, shape=(n,3) or shape=(n,), dtype=float
+            Either the RGB value (0.0 to 1.0) for each atom of this
+            *PyMOL* object or a scalar value for each atom, that is
+            mapped to a color via `cmap`.
+        cmap : Colormap or str or ndarray, shape=(k,3), dtype=float, optional
+            The colormap used to map scalar `values` to colors.
+            Either a *Matplotlib* colormap, the name of a *Matplotlib*
+            colormap or an array of RGB values (0.0 to 1.0), that are
+            linearly interpolated between `vmin` and `vmax`.
+            Must be given, if scalar `values` are given.
+        vmin, vmax : float, optional
+            The scalar values that are mapped to the lower and upper
+            end of the colormap, respectively.
+            Values outside this range are clipped.
+            By default, the minimum and maximum of `values` is used.
+        selection : str or int or slice or ndarray, dtype=bool or ndarray, dtype=int, optional
+            A *Biotite* compatible atom selection index,
+            e.g. a boolean mask, or a *PyMOL* selection expression that
+            selects the atoms of this *PyMOL* object to apply the
+            command on.
+            By default, the command is applied on all atoms of this
+            *PyMOL* object.
+            Independent of the selection, `values` must contain a value
+            for each atom.
+        representation : {"sphere", "surface", "mesh", "dot", "cartoon", "ribbon"}, optional
+            Colors only the given representation by setting the atom
+            level ``xxx_color`` setting.
+            By default, all representations are affected.
+        
+        Notes
+        -----
+        The colors are not registered as named colors, but are written
+        as direct RGB colors into the atom properties via a single
+        ``alter()`` command.
+        """
+        values = np.asarray(values)
+        if values.ndim == 1:
+            if cmap is None:
+                raise TypeError(
+                    "A colormap is required to color by scalar values"
                 )
+            rgb = _apply_colormap(values, cmap, vmin, vmax)
+        elif values.ndim == 2 and values.shape[1] == 3:
+            rgb = values
+        else:
+            raise IndexError(
+                f"Expected an array with shape ({self._atom_count},) "
+                f"or ({self._atom_count}, 3), but got {values.shape}"
+            )
+        if len(rgb) != self._atom_count:
+            raise IndexError(
+                f"Got {len(rgb)} colors, but the number of "
+                f"atoms in the PyMOL model is {self._atom_count}"
+            )
         
         if representation is None:
-            self._cmd.color(color_name, self._into_selection(selection))
+            expression = "color=colors[index-1]"
         else:
             if representation not in (
                 "sphere", "surface", "mesh", "dot", "cartoon", "ribbon"
@@ -516,10 +1779,18 @@ class PyMOLObject:
                 raise ValueError(
                     f"'{representation}' is not a supported representation"
                 )
-            self._cmd.set(
-                f"{representation}_color",
-                color_name, self._into_selection(selection)
-            )
+            expression = f"s.{representation}_color=colors[index-1]"
+        
+        pymol_selection = self._into_selection(selection)
+        self._cmd.alter(
+            pymol_selection, expression,
+            space={"colors": _to_direct_colors(rgb).tolist()}
+        )
+        if representation is None:
+            self._cmd.recolor(pymol_selection)
+        else:
+            # Atom-level settings do not invalidate the representations
+            self._cmd.rebuild(pymol_selection)
     
     
     @validate
@@ -545,10 +1816,13 @@ class PyMOLObject:
         
         Notes
         -----
-        If an RGB color is given, the color is registered as a unique
-        named color via the ``set_color()`` command.
+        If an RGB color is given, the color is registered as a named
+        color via the ``set_color()`` command, as described in
+        :meth:`color()`.
         """
-        color_name = self._created_named_color(color)
+        if self._record_style("color", selection, color, "surface"):
+            return
+        color_name = self._get_color_name(color)
         self._cmd.set(
             "surface_color", color_name, self._into_selection(selection)
         )
@@ -723,6 +1997,8 @@ class PyMOLObject:
             By default, the command is applied on all atoms of this
             *PyMOL* object.
         """
+        if self._record_style("hide", selection, representation):
+            return
         self._cmd.hide(representation, self._into_selection(selection))
     
     @validate
@@ -963,6 +2239,8 @@ class PyMOLObject:
             By default, the command is applied on all atoms of this
             *PyMOL* object.
         """
+        if self._record_style("show", selection, representation):
+            return
         self._cmd.show(representation, self._into_selection(selection))
 
     @validate
@@ -1002,6 +2280,8 @@ class PyMOLObject:
             By default, the command is applied on all atoms of this
             *PyMOL* object.
         """
+        if self._record_style("show_as", selection, representation):
+            return
         self._cmd.show_as(representation, self._into_selection(selection))
     
     @validate
@@ -1158,6 +2438,950 @@ class PyMOLObject:
         )
 
 
+def _load_structure(cmd, atoms, name, loader):
+    """
+    Load the first model of the given structure as new *PyMOL* object
+    using the given loader.
+    """
+    if loader == "auto":
+        if (
+            atoms.bonds is not None
+            and atoms.array_length() >= PyMOLObject.CIF_LOADER_THRESHOLD
+        ):
+            loader = "cif"
+        else:
+            loader = "chempy"
+
+    if loader == "chempy":
+        cmd.load_model(convert_to_chempy_model(atoms), name)
+    elif loader == "cif":
+        if atoms.bonds is None:
+            # PyMOL would determine the bonds itself,
+            # if the file contains no bonds
+            warnings.warn(
+                "The given atom array (stack) has no associated bond "
+                "information"
+            )
+        cmd.load_raw(_convert_to_cif(atoms), "cif", name)
+        # The mmCIF file contains rounded coordinates
+        # -> set the exact coordinates afterwards
+        cmd.load_coordset(
+            atoms.coord if atoms.coord.ndim == 2 else atoms.coord[0],
+            name, state=1
+        )
+    else:
+        raise ValueError(f"'{loader}' is not a valid loader")
+
+
+def _apply_colormap(values, cmap, vmin, vmax):
+    """
+    Map scalar values to RGB values (0.0 to 1.0) via the given
+    colormap.
+    """
+    if vmin is None:
+        vmin = np.nanmin(values)
+    if vmax is None:
+        vmax = np.nanmax(values)
+    if vmax > vmin:
+        normalized = np.clip((values - vmin) / (vmax - vmin), 0, 1)
+    else:
+        normalized = np.zeros(len(values))
+    
+    if isinstance(cmap, str):
+        # Import here, as Matplotlib is an optional dependency
+        import matplotlib
+        cmap = matplotlib.colormaps[cmap]
+    if callable(cmap):
+        # Matplotlib colormap -> discard alpha channel
+        return np.asarray(cmap(normalized))[:, :3]
+    else:
+        cmap = np.asarray(cmap, dtype=float)
+        positions = np.linspace(0, 1, len(cmap))
+        return np.stack(
+            [np.interp(normalized, positions, channel) for channel in cmap.T],
+            axis=-1
+        )
+
+
+def _to_direct_colors(rgb):
+    """
+    Convert RGB values (0.0 to 1.0) into *PyMOL* color indices, that
+    directly encode the RGB value and hence need no registration.
+    """
+    rgb = np.clip(np.round(np.asarray(rgb) * 255), 0, 255).astype(np.int64)
+    return (
+        _DIRECT_COLOR_FLAG
+        | (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+    )
+
+
+def _load_states(cmd, name, coord, state=0):
+    """
+    Write the given coordinates into consecutive states of an existing
+    *PyMOL* object, starting at the given `state`.
+    By default, the states are appended.
+
+    The coordinates are written chunk-wise into a temporary *DCD* file,
+    which is loaded via ``load_traj()``.
+    If *PyMOL* was built without the required trajectory plugin, the
+    coordinates of each model are loaded individually instead.
+    For a :class:`RemotePyMOL`, the coordinates are transferred directly
+    in a single request, as the remote process cannot access the
+    temporary file.
+    """
+    from pymol import CmdException
+    from .remote import _RemoteCmd
+
+    if len(coord) == 0:
+        return
+    if isinstance(cmd, _RemoteCmd):
+        with cmd._remote.batch():
+            for i, model_coord in enumerate(coord):
+                cmd.load_coordset(
+                    model_coord, name, 0 if state == 0 else state + i
+                )
+        return
+    if len(coord) == 1:
+        # Writing a file does not pay off for a single state
+        cmd.load_coordset(coord[0], name, state)
+        return
+    
+    chunk_size = max(
+        1, PyMOLObject.STATE_CHUNK_BYTES // (coord.shape[1] * 3 * 4)
+    )
+    # PyMOL may enable 'defer_builds_mode' for large trajectories
+    # -> restore the original value afterwards
+    defer_builds_mode = cmd.get_setting_int("defer_builds_mode")
+    # Hide the message for each loaded state
+    # and restore the user's feedback setting afterwards
+    details_feedback = _get_details_feedback(cmd)
+    cmd.feedback("disable", "objectmolecule", "details")
+    fd, path = tempfile.mkstemp(suffix=".dcd")
+    os.close(fd)
+    try:
+        for i in range(0, len(coord), chunk_size):
+            chunk = coord[i : i + chunk_size]
+            chunk_state = 0 if state == 0 else state + i
+            with open(path, "wb") as file:
+                _write_dcd(file, chunk)
+            try:
+                # The DCD plugin prints messages for each loaded file
+                with _silenced_stdout():
+                    cmd.load_traj(
+                        path, name, state=chunk_state, format="dcd"
+                    )
+            except CmdException:
+                # The DCD plugin is not available
+                for j, model_coord in enumerate(coord[i:]):
+                    cmd.load_coordset(
+                        model_coord, name, 0 if state == 0 else state + i + j
+                    )
+                break
+    finally:
+        os.remove(path)
+        if details_feedback:
+            cmd.feedback("enable", "objectmolecule", "details")
+        if cmd.get_setting_int("defer_builds_mode") != defer_builds_mode:
+            cmd.set("defer_builds_mode", defer_builds_mode)
+
+
+def _get_details_feedback(cmd):
+    """
+    Check whether the detailed feedback of the ``objectmolecule``
+    module is enabled.
+    """
+    from pymol.constants import fb_mask, fb_module
+
+    return bool(cmd._feedback(fb_module.objectmolecule, fb_mask.details))
+
+
+# Guard the redirection of the standard output, as the file descriptor
+# is shared by all threads of the process
+_stdout_lock = threading.Lock()
+_stdout_redirections = 0
+_saved_stdout_fd = None
+
+
+@contextmanager
+def _silenced_stdout():
+    """
+    Redirect the standard output of the process to the null device
+    within the context.
+
+    In contrast to :func:`contextlib.redirect_stdout()`, this also
+    affects output written by C extensions, such as the *molfile*
+    plugins used by *PyMOL*.
+    The context may be entered by multiple threads concurrently:
+    only the first entry redirects the output and only the last exit
+    restores it.
+    """
+    global _stdout_redirections, _saved_stdout_fd
+
+    with _stdout_lock:
+        if _stdout_redirections == 0:
+            _saved_stdout_fd = _redirect_stdout()
+        _stdout_redirections += 1
+    try:
+        yield
+    finally:
+        with _stdout_lock:
+            _stdout_redirections -= 1
+            if _stdout_redirections == 0:
+                _restore_stdout(_saved_stdout_fd)
+                _saved_stdout_fd = None
+
+
+def _redirect_stdout():
+    """
+    Redirect the standard output file descriptor to the null device.
+
+    Returns
+    -------
+    saved_fd : int or None
+        A duplicate of the original file descriptor.
+        ``None``, if the process has no standard output.
+    """
+    import sys
+
+    sys.stdout.flush()
+    stdout_fd = 1
+    try:
+        saved_fd = os.dup(stdout_fd)
+    except OSError:
+        # The process has no standard output
+        return None
+    null_fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(null_fd, stdout_fd)
+    finally:
+        os.close(null_fd)
+    return saved_fd
+
+
+def _restore_stdout(saved_fd):
+    """
+    Restore the standard output file descriptor redirected by
+    :func:`_redirect_stdout()`.
+    """
+    import ctypes
+
+    if saved_fd is None:
+        return
+    try:
+        # Write buffered C output, while it is still redirected
+        ctypes.CDLL(None).fflush(None)
+    except (OSError, AttributeError, TypeError):
+        # The C library is not accessible, e.g. on Windows
+        pass
+    try:
+        os.dup2(saved_fd, 1)
+    finally:
+        os.close(saved_fd)
+
+
+# The PyMOL expression to alter an annotation category
+# and the function to convert an annotation value into the property value
+_SYNC_EXPRESSIONS = {
+    "chain_id":  ("chain=values[index]; segi=values[index]", str),
+    "res_id":    ("resi=values[index]", str),
+    "res_name":  ("resn=values[index]", str),
+    "hetero":    ("type=values[index]",
+                  lambda hetero: "HETATM" if hetero else "ATOM"),
+    "atom_name": ("name=values[index]", str),
+    "element":   ("elem=values[index]", str),
+    "b_factor":  ("b=values[index]", float),
+    "occupancy": ("q=values[index]", float),
+    "charge":    ("formal_charge=values[index]", int),
+    "altloc_id": ("alt=values[index]", str),
+}
+
+
+class _ColorRegistry:
+    """
+    The named colors of a *PyMOL* instance, that were registered for
+    RGB values and the known color names.
+
+    Identical RGB values reuse the same name.
+    The number of registered colors is limited to
+    :attr:`PyMOLObject.COLOR_REGISTRY_SIZE`:
+    As atoms may still use a registered color, a name is never
+    redefined, instead direct ``0xRRGGBB`` colors are used for further
+    RGB values.
+    """
+
+    def __init__(self, cmd):
+        # A strong reference would keep the registry's key in
+        # '_color_registries' alive
+        self._cmd = weakref.proxy(cmd)
+        # Maps the (rounded) RGB value to its name
+        self._names = {}
+        self._name_counter = 0
+        self._known_names = None
+    
+    def get_name(self, rgb):
+        """
+        Get the name of the given RGB color, registering it if
+        necessary.
+        """
+        resolution = PyMOLObject.COLOR_RESOLUTION
+        if resolution is None:
+            key = tuple(float(c) for c in rgb)
+        else:
+            key = tuple(round(float(c) * resolution) for c in rgb)
+        
+        if resolution is None:
+            rgb = key
+        else:
+            rgb = tuple(c / resolution for c in key)
+
+        name = self._names.get(key)
+        if name is not None:
+            # 'reinitialize()' removes registered colors
+            if self._cmd.get_color_index(name) != -1:
+                return name
+            del self._names[key]
+        
+        if len(self._names) >= PyMOLObject.COLOR_REGISTRY_SIZE:
+            # The direct color contains the RGB value in the lower bits
+            direct_color = _to_direct_colors(np.array([rgb]))[0]
+            return f"0x{direct_color & 0xFFFFFF:06x}"
+        name = f"ammolite_color_{self._name_counter}"
+        self._name_counter += 1
+        self._cmd.set_color(name, rgb)
+        self._names[key] = name
+        return name
+    
+    def check_name(self, name):
+        """
+        Check if the given color name is known to *PyMOL*.
+        """
+        if self._known_names is None or name not in self._known_names:
+            # The color may have been added since the last lookup
+            self._known_names = set(
+                color_name for color_name, _
+                # Include also names with underscores
+                in self._cmd.get_color_indices(all=1)
+            )
+            if name not in self._known_names:
+                raise ValueError(f"Unknown color '{name}'")
+        return name
+
+
+# The type of the values of the atom properties supported by
+# 'set_atom_property()'
+_ATOM_PROPERTY_TYPES = {
+    "b": float,
+    "q": float,
+    "partial_charge": float,
+    "vdw": float,
+    "formal_charge": int,
+    "reps": int,
+    "color": int,
+    "ss": str,
+    "label": str,
+}
+
+# Maps atom properties to the corresponding annotation category
+# in the structure used by 'sync()'
+_SNAPSHOT_PROPERTIES = {
+    "b": "b_factor",
+    "q": "occupancy",
+    "formal_charge": "charge",
+}
+
+
+# The methods, that are queued in 'PyMOLObject.defer()'
+_DEFERRABLE_METHODS = frozenset([
+    "set_coord", "append_states", "set_atom_property", "alter", "cartoon",
+    "center", "clip", "color", "color_by", "surface_color", "desaturate",
+    "disable", "distance", "dss", "enable", "hide", "indicate", "label",
+    "orient", "origin", "select", "set", "set_bond", "show", "show_as",
+    "smooth", "unset", "unset_bond", "zoom",
+])
+
+# The annotation categories that may be part of a selection expression
+# created by 'where()'
+_SELECTION_ANNOTATIONS = {
+    "chain_id", "res_id", "res_name", "atom_name", "element"
+}
+
+
+# Maps each PyMOL 'cmd' to its color registry
+# -> the registry is removed, when the PyMOL instance is discarded
+_color_registries = weakref.WeakKeyDictionary()
+
+# Color indices with this flag represent a 24-bit RGB value
+_DIRECT_COLOR_FLAG = 0x40000000
+
+# Maps a 'BondType' to the PyMOL bond order via indexing
+_BOND_ORDER_TABLE = np.zeros(max(BOND_ORDER.keys()) + 1, dtype=np.uint32)
+_BOND_ORDER_TABLE[list(BOND_ORDER.keys())] = list(BOND_ORDER.values())
+
+# The values PyMOL uses for missing optional annotation categories
+_DEFAULT_ANNOTATIONS = {
+    "b_factor": 0.0,
+    "occupancy": 1.0,
+    "charge": 0,
+    "altloc_id": "",
+}
+
+
+def _take_snapshot(atoms):
+    """
+    Copy the parts of a structure, that are represented in *PyMOL*,
+    for later comparison in :meth:`PyMOLObject.sync()`.
+
+    The coordinates are only copied for an :class:`AtomArray`, to
+    avoid duplicating the coordinates of a potentially large
+    :class:`AtomArrayStack`.
+    """
+    annotations = {}
+    for category in _SYNC_EXPRESSIONS.keys():
+        if category == "res_id":
+            # The comparison of a string ID would be slower
+            values = atoms.res_id
+        elif category in atoms.get_annotation_categories():
+            values = atoms.get_annotation(category)
+        else:
+            values = np.full(
+                atoms.array_length(), _DEFAULT_ANNOTATIONS[category]
+            )
+        if category in ("b_factor", "occupancy"):
+            # PyMOL stores these values in single precision
+            values = values.astype(np.float32)
+        else:
+            values = values.copy()
+        annotations[category] = values
+    annotations["ins_code"] = atoms.ins_code.copy()
+    return {
+        "annotations": annotations,
+        "bonds": _normalize_bonds(atoms.bonds),
+        "coord": atoms.coord.copy() if atoms.coord.ndim == 2 else None,
+    }
+
+
+def _normalize_bonds(bonds):
+    """
+    Convert a :class:`BondList` into a sorted array of bonds with
+    *PyMOL* bond orders, so that two bond lists can be compared.
+    """
+    if bonds is None:
+        return None
+    bond_array = bonds.as_array()
+    bond_array[:, 2] = _BOND_ORDER_TABLE[bond_array[:, 2]]
+    return bond_array[np.lexsort((bond_array[:, 1], bond_array[:, 0]))]
+
+
+def _arrays_equal(array1, array2):
+    """
+    Check two arrays (or ``None``) for equality.
+
+    Arrays with the same *dtype* are compared via their raw bytes,
+    which is considerably faster than an element-wise comparison for
+    string arrays.
+    """
+    if array1 is None or array2 is None:
+        return array1 is array2
+    if array1.shape != array2.shape:
+        return False
+    if array1.dtype != array2.dtype:
+        return np.array_equal(array1, array2)
+    return np.array_equal(
+        np.ascontiguousarray(array1).reshape(-1).view(np.uint8),
+        np.ascontiguousarray(array2).reshape(-1).view(np.uint8)
+    )
+
+
+def _to_repmask(representation):
+    """
+    Convert a representation name into the corresponding *PyMOL*
+    representation bit mask.
+
+    Like in *PyMOL*, the name may be abbreviated, may be an alias like
+    ``'licorice'`` or may contain multiple space-separated names.
+    """
+    from pymol.viewing import repmasks, repmasks_sc
+
+    repmask = 0
+    for name in representation.split():
+        repmask |= repmasks[repmasks_sc.auto_err(name, "representation")]
+    return repmask
+
+
+def _get_representation_names():
+    """
+    Map each bit of a *PyMOL* representation bit mask to the name of
+    the corresponding representation.
+    """
+    from pymol.viewing import repmasks
+
+    return {
+        repmask: name for name, repmask in repmasks.items()
+        # Only single representations
+        if repmask & (repmask - 1) == 0
+    }
+
+
+class _StyleRecorder:
+    """
+    Tracks the final color and visibility of each atom for the style
+    commands recorded in :meth:`PyMOLObject.coalesce()`.
+
+    The representations are given as *PyMOL* representation bit masks.
+    """
+
+    def __init__(self, atom_count):
+        self._atom_count = atom_count
+        # Representation (or None for the atom color) ->
+        # index of the color in 'self._colors' for each atom,
+        # -1 for atoms whose color is not changed
+        self._color_indices = {}
+        self._colors = []
+        self._color_keys = {}
+        # Representation bit -> visibility of each atom,
+        # -1 for atoms whose visibility is not changed
+        self._visibilities = {}
+        self._everything = _to_repmask("everything")
+        # Atoms for which all representations were hidden or shown
+        # most recently
+        self._hidden = np.zeros(atom_count, dtype=bool)
+        self._shown = np.zeros(atom_count, dtype=bool)
+
+    def color(self, mask, color, representation):
+        key = color if isinstance(color, str) \
+              else tuple(float(c) for c in color)
+        color_index = self._color_keys.get(key)
+        if color_index is None:
+            color_index = len(self._colors)
+            self._color_keys[key] = color_index
+            self._colors.append(color)
+        if representation not in self._color_indices:
+            self._color_indices[representation] = np.full(
+                self._atom_count, -1, dtype=np.int32
+            )
+        self._color_indices[representation][mask] = color_index
+
+    def show(self, mask, repmask):
+        if repmask == self._everything:
+            self._shown |= mask
+            self._hidden &= ~mask
+        self._set_visibility(mask, repmask, 1)
+
+    def hide(self, mask, repmask):
+        if repmask == self._everything:
+            self._hidden |= mask
+            self._shown &= ~mask
+        self._set_visibility(mask, repmask, 0)
+
+    def show_as(self, mask, repmask):
+        self.hide(mask, self._everything)
+        self.show(mask, repmask)
+
+    def _set_visibility(self, mask, repmask, visible):
+        bit = 1
+        while bit <= repmask:
+            if repmask & bit:
+                if bit not in self._visibilities:
+                    self._visibilities[bit] = np.full(
+                        self._atom_count, -1, dtype=np.int8
+                    )
+                self._visibilities[bit][mask] = visible
+            bit <<= 1
+
+    def get_commands(self):
+        """
+        Get the minimal set of commands that result in the recorded
+        colors and visibilities.
+
+        Returns
+        -------
+        commands : list of tuple(str, tuple)
+            The method name and positional arguments of each command.
+        """
+        commands = []
+        names = _get_representation_names()
+
+        # For atoms, for which all representations were hidden or shown,
+        # this is done with a single command,
+        # so that only the deviating representations need to be changed
+        if self._hidden.any():
+            commands.append(("hide", ("everything", self._hidden)))
+        if self._shown.any():
+            commands.append(("show", ("everything", self._shown)))
+        for bit, visible in self._visibilities.items():
+            hide_mask = (visible == 0) & ~self._hidden
+            if hide_mask.any():
+                commands.append(("hide", (names[bit], hide_mask)))
+        for bit, visible in self._visibilities.items():
+            show_mask = (visible == 1) & ~self._shown
+            if show_mask.any():
+                commands.append(("show", (names[bit], show_mask)))
+
+        for representation, color_indices in self._color_indices.items():
+            for color_index in np.unique(color_indices):
+                if color_index == -1:
+                    continue
+                commands.append((
+                    "color", (
+                        self._colors[color_index],
+                        color_indices == color_index,
+                        representation
+                    )
+                ))
+
+        return commands
+
+
+class _CachedSelection:
+    """
+    The selection expression for a mask and the name of the
+    corresponding named selection, if it was created.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.name = None
+        # The number of times the mask was given to a command
+        self.uses = 0
+
+
+def _index_ranges(mask):
+    """
+    Convert a boolean mask into a selection expression consisting of
+    an ``index`` range for each contiguous run of selected atoms.
+    """
+    # Indices where the mask changes from True to False
+    # or from False to True
+    # The '+1' makes each index refer to the position
+    # after the change i.e. the new value
+    changes = np.where(np.diff(mask))[0] + 1
+    # If first element is True, insert index 0 at start
+    # -> the first change is always from False to True
+    if mask[0]:
+        changes = np.concatenate(([0], changes))
+    # If the last element is True, insert append length of mask
+    # as exclusive stop index
+    # -> the last change is always from True to False
+    if mask[-1]:
+        changes = np.concatenate((changes, [len(mask)]))
+    # -> Changes are alternating (F->T, T->F, F->T, ..., F->T, T->F)
+    # Reshape into pairs ([F->T, T->F], [F->T, T->F], ...)
+    # -> these are the intervals where the mask is True
+    intervals = np.reshape(changes, (-1, 2))
+    # Convert interval into selection string
+    # Two things to note:
+    # - PyMOLs indexing starts at 1-> 'start+1'
+    # - Stop in 'intervals' is exclusive -> 'stop+1-1' -> 'stop'
+    return " or ".join(
+        [f"index {start+1}-{stop}" for start, stop in intervals]
+    )
+
+
+class _SelectionHierarchy:
+    """
+    The chain IDs, residue IDs, residue names, atom names and
+    elements of a *PyMOL* object, used to compile a boolean mask into
+    a concise selection expression.
+
+    The annotations are encoded lazily, as they are only required
+    for masks that are not a single contiguous run of atoms.
+    """
+
+    # Values that can be used in a selection expression without escaping
+    _TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_']+$")
+    # Insertion codes that can be appended to a residue ID
+    _INS_CODE_PATTERN = re.compile(r"^[A-Za-z]?$")
+
+    def __init__(self, chain_id, res_id, ins_code, res_name, atom_name,
+                 element):
+        self._annotations = {
+            "chain": chain_id,
+            "resn": res_name,
+            "name": atom_name,
+            "elem": element,
+        }
+        self._res_id = res_id
+        self._ins_code = ins_code
+        # Keyword -> (unique values, code of each atom, usable values)
+        self._encodings = {}
+        self._residues = None
+
+    @staticmethod
+    def from_snapshot(snapshot):
+        annotations = snapshot["annotations"]
+        return _SelectionHierarchy(
+            annotations["chain_id"], annotations["res_id"],
+            annotations["ins_code"], annotations["res_name"],
+            annotations["atom_name"], annotations["element"]
+        )
+
+    def compile(self, mask):
+        """
+        Find the shortest expression of the form
+        ``<chains, residue names or residues> and <atom names or
+        elements>``, that selects exactly the atoms in the mask.
+
+        Returns ``None`` if the mask cannot be expressed in this form
+        and an empty string if all atoms are selected.
+        """
+        groups = [(None, None, None)]
+        for keyword in ("chain", "resn"):
+            groups.append((keyword,) + self._select(keyword, mask))
+        residue_codes = self._get_residues()["codes"]
+        selected_residues = np.zeros(residue_codes.max() + 1, dtype=bool)
+        selected_residues[residue_codes[mask]] = True
+        groups.append(
+            ("resi", selected_residues, selected_residues[residue_codes])
+        )
+        attributes = [(None, None, None)]
+        for keyword in ("name", "elem"):
+            attributes.append((keyword,) + self._select(keyword, mask))
+
+        best_expression = None
+        # The expression of a group is only created,
+        # if it is part of a matching expression
+        group_expressions = {}
+        for group, group_selected, group_mask in groups:
+            for attribute, attribute_selected, attribute_mask in attributes:
+                if group_mask is None:
+                    test_mask = attribute_mask
+                elif attribute_mask is None:
+                    test_mask = group_mask
+                else:
+                    test_mask = group_mask & attribute_mask
+                if test_mask is None:
+                    if not mask.all():
+                        continue
+                elif not np.array_equal(test_mask, mask):
+                    continue
+
+                if group not in group_expressions:
+                    group_expressions[group] \
+                        = self._format(group, group_selected)
+                group_expression = group_expressions[group]
+                attribute_expression \
+                    = self._format(attribute, attribute_selected)
+                if group_expression is None or attribute_expression is None:
+                    # The expression would contain unusable values
+                    continue
+                if group_expression and attribute_expression:
+                    if " or " in group_expression:
+                        group_expression = f"({group_expression})"
+                    expression = f"{group_expression} and " \
+                                 f"{attribute_expression}"
+                else:
+                    expression = group_expression + attribute_expression
+                if best_expression is None \
+                   or len(expression) < len(best_expression):
+                        best_expression = expression
+        return best_expression
+
+    def _encode(self, keyword):
+        if keyword not in self._encodings:
+            values, codes = np.unique(
+                self._annotations[keyword], return_inverse=True
+            )
+            usable = _usable_values(values, self._TOKEN_PATTERN)
+            self._encodings[keyword] = (values, codes, usable)
+        return self._encodings[keyword]
+
+    def _select(self, keyword, mask):
+        """
+        Get the values of an annotation that occur in the mask and the
+        mask of all atoms that have one of these values.
+        """
+        _, codes, _ = self._encode(keyword)
+        selected = np.zeros(codes.max() + 1, dtype=bool)
+        selected[codes[mask]] = True
+        return selected, selected[codes]
+
+    def _get_residues(self):
+        """
+        Get the residues, identified by chain, residue ID and insertion
+        code, sorted by these.
+        """
+        if self._residues is None:
+            chain_values, chain_codes, _ = self._encode("chain")
+            ins_values, ins_codes = np.unique(
+                self._ins_code, return_inverse=True
+            )
+            if len(self._res_id) > 0:
+                min_res_id = self._res_id.min()
+                n_res_ids = int(self._res_id.max()) - int(min_res_id) + 1
+            else:
+                min_res_id = 0
+                n_res_ids = 1
+            # Combine the chain, residue ID and insertion code into
+            # a single integer, whose order is the residue order
+            keys, codes = np.unique(
+                (
+                    chain_codes.astype(np.int64) * n_res_ids
+                    + (self._res_id - min_res_id)
+                ) * len(ins_values) + ins_codes,
+                return_inverse=True
+            )
+            chains, remainder = np.divmod(keys, n_res_ids * len(ins_values))
+            res_ids = remainder // len(ins_values) + min_res_id
+            residue_ins_codes = ins_values[remainder % len(ins_values)]
+            self._residues = {
+                "codes": codes,
+                "chain": chains,
+                "res_id": res_ids,
+                "ins_code": residue_ins_codes,
+                "usable": _usable_values(
+                    ins_values, self._INS_CODE_PATTERN
+                )[remainder % len(ins_values)],
+                # Residues are sorted by chain
+                # -> the residues of each chain are a contiguous range
+                "chain_starts": np.searchsorted(
+                    chains, np.arange(len(chain_values) + 1)
+                ),
+            }
+        return self._residues
+
+    def _format(self, keyword, selected):
+        """
+        Create the expression for the selected values of an annotation.
+
+        Returns ``None`` if a value cannot be used in an expression.
+        """
+        if keyword is None:
+            return ""
+        if keyword == "resi":
+            return self._format_residues(selected)
+        values, _, usable = self._encode(keyword)
+        if not usable[selected].all():
+            return None
+        return f"{keyword} " + "+".join(values[selected].tolist())
+
+    def _format_residues(self, selected):
+        residues = self._get_residues()
+        chain_values, _, chain_usable = self._encode("chain")
+        chain_starts = residues["chain_starts"]
+        complete_chains = []
+        partial_chains = []
+        for chain in np.unique(residues["chain"][selected]):
+            if not chain_usable[chain]:
+                return None
+            start, stop = chain_starts[chain], chain_starts[chain+1]
+            chain_selected = selected[start:stop]
+            if chain_selected.all():
+                complete_chains.append(chain_values[chain])
+                continue
+            residue_ids = self._format_residue_ids(
+                chain_selected,
+                residues["res_id"][start:stop],
+                residues["ins_code"][start:stop],
+                residues["usable"][start:stop]
+            )
+            if residue_ids is None:
+                return None
+            partial_chains.append(
+                f"chain {chain_values[chain]} and resi {residue_ids}"
+            )
+
+        expressions = []
+        if len(complete_chains) > 0:
+            expressions.append("chain " + "+".join(complete_chains))
+        expressions += partial_chains
+        if len(expressions) == 1:
+            return expressions[0]
+        else:
+            return " or ".join(f"({expression})" for expression in expressions)
+
+    @staticmethod
+    def _format_residue_ids(selected, res_ids, ins_codes, usable):
+        """
+        Create the residue ID list for the selected residues of a
+        chain.
+
+        A range of residue IDs (``resi a-b``) comprises all
+        residues in this range including those with insertion codes.
+        Hence, ranges are used where all residues of consecutive
+        residue IDs are selected, otherwise the residues are listed
+        individually.
+        """
+        unique_ids, starts = np.unique(res_ids, return_index=True)
+        stops = np.append(starts[1:], len(res_ids))
+        complete = np.logical_and.reduceat(selected, starts)
+        partial = np.logical_or.reduceat(selected, starts)
+
+        tokens = []
+        occurring = np.nonzero(partial)[0]
+        i = 0
+        while i < len(occurring):
+            id_index = occurring[i]
+            if complete[id_index]:
+                # Find the end of the range of completely selected IDs
+                j = i
+                while (
+                    j + 1 < len(occurring)
+                    and occurring[j+1] == occurring[j] + 1
+                    and complete[occurring[j+1]]
+                ):
+                    j += 1
+                if j > i:
+                    tokens.append(
+                        f"{_escape_res_id(unique_ids[id_index])}-"
+                        f"{_escape_res_id(unique_ids[occurring[j]])}"
+                    )
+                    i = j + 1
+                    continue
+            for residue in range(starts[id_index], stops[id_index]):
+                if selected[residue]:
+                    if not usable[residue]:
+                        return None
+                    tokens.append(
+                        _escape_res_id(res_ids[residue]) + ins_codes[residue]
+                    )
+            i += 1
+        return "+".join(tokens)
+
+
+def _usable_values(values, pattern):
+    """
+    Determine which of the given unique values can be used in a
+    selection expression.
+
+    Values must not contain special characters and must not be equal
+    to another value when ignoring the case, as *PyMOL* may be
+    configured to match values case-insensitively.
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    _, inverse, counts = np.unique(
+        np.char.upper(values), return_inverse=True, return_counts=True
+    )
+    unambiguous = counts[inverse] == 1
+    return unambiguous & np.array(
+        [pattern.match(value) is not None for value in values.tolist()],
+        dtype=bool
+    )
+
+
+def _escape_res_id(res_id):
+    # A leading '-' would be interpreted as range delimiter
+    return f"\\{res_id}" if res_id < 0 else str(res_id)
+
+
+class DeferredCommandError(Exception):
+    """
+    Indicates that a command queued in :meth:`PyMOLObject.defer()`
+    failed.
+
+    The original exception is available as ``__cause__``.
+
+    Attributes
+    ----------
+    call_site : FrameSummary
+        The location, where the failed command was called.
+    """
+
+    def __init__(self, message, call_site):
+        super().__init__(message)
+        self.call_site = call_site
+
+
 class NonexistentObjectError(Exception):
     """
     Indicates that a *PyMOL* object with a given name does not exist.
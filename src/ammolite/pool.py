@@ -0,0 +1,461 @@
+__name__ = "ammolite"
+__author__ = "Patrick Kunzmann"
+__all__ = ["RenderPool", "RenderError"]
+
+import collections
+import itertools
+import multiprocessing
+import pickle
+import threading
+import traceback
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+
+class RenderPool:
+    """
+    A pool of worker processes, each running its own *PyMOL* instance,
+    that render images of structures in parallel.
+
+    As *PyMOL* holds global state, rendering can only be parallelized
+    to a limited extent with threads.
+    Instead, each worker process launches *PyMOL* once via
+    :func:`launch_pymol()` and renders the submitted jobs one after
+    another, so that the startup time is spent only once per worker.
+    Before each job the worker's *PyMOL* workspace is reset, so that
+    the jobs are independent of each other.
+
+    If a worker process dies, e.g. due to a crash of *PyMOL*, it is
+    restarted and its current job is submitted again.
+    A worker that dies before *PyMOL* is launched is not restarted.
+
+    Parameters
+    ----------
+    n_workers : int, optional
+        The number of worker processes.
+        By default, the number of CPU cores is used.
+    max_pending : int, optional
+        The maximum number of submitted jobs, that are not finished yet.
+        If this number is reached, :meth:`submit()` blocks until a job
+        is finished, so that jobs are not submitted faster than they
+        are rendered.
+        By default, the number is unlimited.
+    profile : {'interactive', 'throughput', 'low_memory'}, optional
+        The performance profile of the workers' *PyMOL* instances,
+        see :func:`setup_parameters()`.
+        Note that with the ``'throughput'`` and ``'low_memory'``
+        profiles the `style` of a job must show the representations
+        explicitly.
+        By default, the *PyMOL* defaults are used.
+    max_retries : int, optional
+        The number of times a job is submitted again after the worker
+        rendering it died.
+
+    Notes
+    -----
+    The worker processes are started with the *spawn* method, so that
+    they do not inherit a *PyMOL* instance from the parent process.
+    Hence, a script creating a :class:`RenderPool` must guard its entry
+    point with ``if __name__ == "__main__":``.
+
+    Examples
+    --------
+
+    >>> with RenderPool(n_workers=4) as pool:
+    ...     futures = [
+    ...         pool.submit(
+    ...             atoms, style=[("show_as", ("sticks",))], size=(200, 150)
+    ...         )
+    ...         for atoms in ligand_poses
+    ...     ]
+    ...     png_images = [future.result() for future in futures]
+    """
+
+    def __init__(self, n_workers=None, max_pending=None, profile=None,
+                 max_retries=2):
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        if n_workers < 1:
+            raise ValueError("At least one worker is required")
+        self._profile = profile
+        self._max_retries = max_retries
+        self._context = multiprocessing.get_context("spawn")
+        if max_pending is None:
+            self._pending_slots = None
+        else:
+            self._pending_slots = threading.BoundedSemaphore(max_pending)
+        self._job_ids = itertools.count()
+        # The jobs, that are not assigned to a worker yet
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        # Wakes up the dispatcher thread, if a job is submitted
+        self._wakeup_receiver, self._wakeup_sender \
+            = self._context.Pipe(duplex=False)
+        self._workers = [self._start_worker() for _ in range(n_workers)]
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, daemon=True
+        )
+        self._dispatcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    @property
+    def n_workers(self):
+        """
+        int : The number of running worker processes.
+        """
+        return len(self._workers)
+
+    def submit(self, atoms, style=None, view=None, size=(400, 300),
+               use_ray=False, output="png"):
+        """
+        Submit a job for rendering an image of a structure.
+
+        Parameters
+        ----------
+        atoms : AtomArray or AtomArrayStack
+            The structure to be rendered.
+        style : iterable object of tuple, optional
+            The methods of the :class:`PyMOLObject` of `atoms`, that are
+            called in the given order to style the structure.
+            Each method is given as tuple ``(name, args)`` or
+            ``(name, args, kwargs)``, e.g.
+            ``("color", ("red", atoms.element == "O"))``.
+        view : ndarray, shape=(18,), dtype=float, optional
+            The view matrix as obtained by ``cmd.get_view()``.
+            By default, the structure is zoomed on.
+        size : tuple of (int, int), optional
+            The width and height of the rendered image.
+        use_ray : bool, optional
+            If set to true, a ray-traced image is created.
+        output : {'png', 'array'}, optional
+            If ``'png'``, the image is returned as PNG encoded bytes.
+            If ``'array'``, the image is returned as
+            *(height, width, 4)* ``uint8`` array.
+
+        Returns
+        -------
+        future : Future
+            The future for the rendered image.
+            If the rendering fails, the exception raised by the worker
+            is set for the future.
+            If the worker died more than `max_retries` times, a
+            :exc:`RenderError` is set instead.
+        """
+        if output not in ("png", "array"):
+            raise ValueError(f"'{output}' is not a valid output type")
+        style = [
+            (command[0], tuple(command[1]),
+             dict(command[2]) if len(command) > 2 else {})
+            for command in (style if style is not None else [])
+        ]
+        if self._pending_slots is not None:
+            # Back-pressure
+            self._pending_slots.acquire()
+        future = Future()
+        job = _Job(
+            next(self._job_ids), future,
+            (atoms, style, view, tuple(size), use_ray, output)
+        )
+        with self._lock:
+            if self._closed:
+                if self._pending_slots is not None:
+                    self._pending_slots.release()
+                raise RuntimeError("The pool is already closed")
+            self._queue.append(job)
+            self._wakeup_sender.send(None)
+        return future
+
+    def map(self, atoms_iterable, **kwargs):
+        """
+        Render an image for each structure.
+
+        Parameters
+        ----------
+        atoms_iterable : iterable object of (AtomArray or AtomArrayStack)
+            The structures to be rendered.
+        **kwargs
+            Additional parameters for :meth:`submit()`, that apply to all
+            structures.
+
+        Yields
+        ------
+        image : bytes or ndarray
+            The rendered images in the order of the given structures.
+        """
+        futures = collections.deque()
+        for atoms in atoms_iterable:
+            futures.append(self.submit(atoms, **kwargs))
+            # Yield finished images as early as possible,
+            # to keep the memory consumption low
+            while futures and futures[0].done():
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def close(self):
+        """
+        Stop all worker processes.
+
+        Jobs, that are not finished yet, are cancelled:
+        Queued jobs are cancelled, for jobs that are currently rendered
+        a :exc:`RenderError` is set, unless the worker finishes the job
+        meanwhile.
+        Calls of :meth:`submit()`, that are blocked due to
+        `max_pending`, raise an exception.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup_sender.send(None)
+        self._dispatcher.join()
+        for worker in self._workers:
+            try:
+                worker.connection.send(None)
+            except (OSError, EOFError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            try:
+                # Receive the results, that arrived in the meantime
+                while worker.job is not None and worker.connection.poll():
+                    self._handle_message(worker, worker.connection.recv())
+            except (OSError, EOFError):
+                pass
+            worker.connection.close()
+            job = worker.job
+            worker.job = None
+            if job is not None:
+                job.future.set_exception(
+                    RenderError("The pool was closed during rendering")
+                )
+                self._release(job)
+        for job in self._queue:
+            # Retried jobs are already running and cannot be cancelled
+            if not job.future.cancel():
+                job.future.set_exception(
+                    RenderError("The pool was closed before rendering")
+                )
+            # Wake up blocked 'submit()' calls, which raise an exception
+            self._release(job)
+        self._queue.clear()
+
+    def _start_worker(self):
+        connection, worker_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_render, args=(worker_connection, self._profile),
+            daemon=True
+        )
+        process.start()
+        # Only the worker uses this end of the pipe
+        worker_connection.close()
+        return _Worker(process, connection)
+
+    def _dispatch(self):
+        """
+        Assign the queued jobs to idle workers and receive the results.
+        This method runs in a separate thread.
+        """
+        while True:
+            with self._lock:
+                if self._closed:
+                    break
+                if not self._workers:
+                    # No worker could be started
+                    while self._queue:
+                        job = self._queue.popleft()
+                        job.future.set_exception(
+                            RenderError("No worker is running")
+                        )
+                        self._release(job)
+                for worker in self._workers:
+                    if worker.ready and worker.job is None and self._queue:
+                        job = self._queue.popleft()
+                        future = job.future
+                        # Retried jobs are already running
+                        if not future.running() \
+                                and not future.set_running_or_notify_cancel():
+                            self._release(job)
+                            continue
+                        worker.job = job
+                        try:
+                            worker.connection.send((job.job_id, job.task))
+                        except OSError:
+                            # The worker died -> handled via the sentinel
+                            pass
+
+            connections = {
+                worker.connection: worker for worker in self._workers
+            }
+            sentinels = {
+                worker.process.sentinel: worker for worker in self._workers
+            }
+            for ready in wait(
+                [self._wakeup_receiver]
+                + list(connections.keys()) + list(sentinels.keys())
+            ):
+                if ready is self._wakeup_receiver:
+                    self._wakeup_receiver.recv()
+                elif ready in connections:
+                    worker = connections[ready]
+                    try:
+                        message = ready.recv()
+                    except (OSError, EOFError):
+                        # The worker died -> handled via the sentinel
+                        continue
+                    self._handle_message(worker, message)
+                else:
+                    self._restart(sentinels[ready])
+
+    def _handle_message(self, worker, message):
+        if message is None:
+            # The worker has launched PyMOL
+            worker.ready = True
+            return
+        job_id, success, result = message
+        job = worker.job
+        worker.job = None
+        if job is None or job.job_id != job_id:
+            return
+        if success:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(result)
+        self._release(job)
+
+    def _restart(self, worker):
+        """
+        Replace a dead worker and submit its current job again.
+        """
+        worker.connection.close()
+        worker.process.join()
+        index = self._workers.index(worker)
+        with self._lock:
+            if self._closed:
+                return
+            if not worker.ready:
+                # PyMOL cannot be launched -> restarting would not help
+                del self._workers[index]
+                return
+            self._workers[index] = self._start_worker()
+            job = worker.job
+            if job is None:
+                return
+            job.attempts += 1
+            if job.attempts > self._max_retries:
+                job.future.set_exception(RenderError(
+                    f"The worker died {job.attempts} times "
+                    f"while rendering the job, "
+                    f"the last exit code was {worker.process.exitcode}"
+                ))
+                self._release(job)
+            else:
+                # Prefer the job over the jobs submitted later
+                self._queue.appendleft(job)
+
+    def _release(self, job):
+        if self._pending_slots is not None:
+            self._pending_slots.release()
+
+
+class _Worker:
+    """
+    The state of a worker process as seen by the parent process.
+    """
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        # Becomes true, when the worker has launched PyMOL
+        self.ready = False
+        # The job currently rendered by the worker
+        self.job = None
+
+
+class _Job:
+    """
+    A submitted job with the future for its result.
+    """
+
+    def __init__(self, job_id, future, task):
+        self.job_id = job_id
+        self.future = future
+        self.task = task
+        # The number of times the worker rendering this job died
+        self.attempts = 0
+
+
+def _render(connection, profile):
+    """
+    The main function of a worker process.
+    """
+    import warnings
+    from .display import _decode_png, _render_png
+    from .object import PyMOLObject
+    from .startup import launch_pymol, reset
+
+    # Warm startup: PyMOL is launched only once per worker
+    cmd = launch_pymol(profile).cmd
+    connection.send(None)
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            # The parent process is gone
+            break
+        if message is None:
+            break
+        job_id, (atoms, style, view, size, use_ray, output) = message
+        try:
+            reset(profile)
+            with warnings.catch_warnings():
+                # Missing bonds are irrelevant for many images
+                warnings.simplefilter("ignore")
+                pymol_object = PyMOLObject.from_structure(atoms)
+            for method_name, args, kwargs in style:
+                getattr(pymol_object, method_name)(*args, **kwargs)
+            if view is None:
+                pymol_object.zoom()
+            else:
+                cmd.set_view([float(value) for value in view])
+            image = _render_png(cmd, size, use_ray, timeout=60.0)
+            if output == "array":
+                image = _decode_png(image)
+            del pymol_object
+            result = (job_id, True, image)
+        except Exception as e:
+            try:
+                # Check if the exception can be sent to the parent process
+                pickle.loads(pickle.dumps(e))
+                result = (job_id, False, e)
+            except Exception:
+                result = (job_id, False, RenderError("".join(
+                    traceback.format_exception(type(e), e, e.__traceback__)
+                )))
+        connection.send(result)
+
+
+# As '__name__' is overwritten in this module, the worker function
+# would not be found when it is unpickled in the worker process
+_render.__module__ = "ammolite.pool"
+
+
+class RenderError(Exception):
+    """
+    Indicates that a job of a :class:`RenderPool` could not be rendered.
+    """
+    pass
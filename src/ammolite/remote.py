@@ -0,0 +1,331 @@
+__name__ = "ammolite"
+__author__ = "Patrick Kunzmann"
+__all__ = ["RemotePyMOL"]
+
+import base64
+import pickle
+import queue
+import threading
+import xmlrpc.client
+from contextlib import contextmanager
+
+
+class RemotePyMOL:
+    """
+    An adapter to a *PyMOL* process, that is remote controlled via
+    *XML-RPC*, e.g. a *PyMOL* GUI launched with ``pymol -R``.
+
+    An instance of this class can be given as `pymol_instance` to
+    :class:`PyMOLObject`, :func:`draw_cgo()`, :func:`show()` and the
+    other functions accepting a *PyMOL* instance or be selected via
+    :func:`use_pymol_instance()`.
+    Like for the *PyMOL* instances in the current process, *PyMOL*
+    commands can be invoked via the :attr:`cmd` attribute.
+
+    The function calls are transferred as *pickle* data, so that
+    arguments and return values like coordinates and masks are
+    transferred efficiently as binary data.
+    For this purpose, a small handler function is installed in the
+    *PyMOL* process on connection.
+    Multiple threads can use the same instance, as each concurrent
+    call uses its own connection from a connection pool.
+
+    Parameters
+    ----------
+    host : str, optional
+        The host name of the *XML-RPC* server.
+    port : int, optional
+        The port of the *XML-RPC* server.
+        *PyMOL* uses the first free port starting from 9123.
+    pool_size : int, optional
+        The maximum number of open connections.
+    timeout : float, optional
+        The timeout for a single call in seconds.
+        By default, calls do not time out.
+
+    Attributes
+    ----------
+    cmd : object
+        The proxy for the :mod:`pymol.cmd` module of the *PyMOL*
+        process.
+
+    Notes
+    -----
+    File names given to ``cmd.png()`` refer to the local file system,
+    i.e. the image is rendered in the *PyMOL* process and written
+    locally.
+    Other file names, e.g. in ``cmd.load()``, refer to the file system
+    of the *PyMOL* process.
+    Coordinates, e.g. in :meth:`PyMOLObject.from_structure()`,
+    :meth:`PyMOLObject.set_coord()` or
+    :meth:`PyMOLObject.from_trajectory()`, are always transferred
+    directly, so that the processes do not need to share the file
+    system.
+
+    As *pickle* data is transferred, only connect to *PyMOL* processes
+    you trust.
+    """
+
+    # The commands, whose return values are not required by ammolite
+    # -> can be queued in 'batch()'
+    BATCHABLE_COMMANDS = frozenset([
+        "alter", "bg_color", "cartoon", "center", "clip", "color", "delete",
+        "desaturate", "disable", "distance", "dss", "enable", "frame", "hide",
+        "indicate", "label", "load_cgo", "load_coordset", "load_model",
+        "load_raw", "orient", "origin", "rebuild", "recolor", "select", "set",
+        "set_bond", "set_color", "set_view", "show", "show_as", "smooth",
+        "unset", "unset_bond", "zoom",
+    ])
+
+    def __init__(self, host="localhost", port=9123, pool_size=4,
+                 timeout=None):
+        self._url = f"http://{host}:{port}"
+        self._timeout = timeout
+        self._connections = queue.LifoQueue()
+        # Limits the number of connections, that are used at the same time
+        self._connection_slots = threading.BoundedSemaphore(pool_size)
+        self._thread_state = threading.local()
+        self._stopped = False
+        with self._connection() as connection:
+            connection.do(_SERVER_COMMAND, 0, 0)
+        self.cmd = _RemoteCmd(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        """
+        str : The URL of the *XML-RPC* server.
+        """
+        return self._url
+
+    @contextmanager
+    def batch(self):
+        """
+        Create a context, in which commands are sent together to the
+        *PyMOL* process.
+
+        Calls of the commands in :attr:`BATCHABLE_COMMANDS` return
+        ``None`` immediately and are queued, until the context is exited
+        or any other function is called, e.g. ``cmd.count_atoms()``.
+        Then the queued commands and the function call are transferred
+        in a single request.
+        Hence, an exception raised by a queued command is raised
+        belatedly.
+
+        The queue is thread-local, i.e. commands from different threads
+        are not mixed.
+        """
+        if self._get_queue() is not None:
+            # Nested context -> the outermost context sends the commands
+            yield self
+            return
+        self._thread_state.queue = []
+        try:
+            yield self
+        finally:
+            try:
+                self.flush()
+            finally:
+                self._thread_state.queue = None
+
+    def flush(self):
+        """
+        Send the commands queued within a :meth:`batch()` context.
+        """
+        calls = self._get_queue()
+        if calls:
+            self._thread_state.queue = []
+            self._send(calls)
+
+    def stop(self):
+        """
+        Close all connections to the *PyMOL* process.
+
+        The remote *PyMOL* process itself keeps running.
+        """
+        self._stopped = True
+        while True:
+            try:
+                connection = self._connections.get_nowait()
+            except queue.Empty:
+                break
+            connection("close")()
+
+    def _call(self, name, args, kwargs):
+        """
+        Call a function of the remote ``cmd`` module.
+        """
+        calls = self._get_queue()
+        if calls is not None and name in RemotePyMOL.BATCHABLE_COMMANDS:
+            calls.append((name, args, kwargs))
+            return None
+        if calls:
+            self._thread_state.queue = []
+        else:
+            calls = []
+        return self._send(calls + [(name, args, kwargs)])
+
+    def _send(self, calls):
+        """
+        Execute the given calls in the remote process in a single
+        request and return the return value of the last call.
+        """
+        with self._connection() as connection:
+            response = connection.ammolite_call(xmlrpc.client.Binary(
+                pickle.dumps(calls, protocol=pickle.HIGHEST_PROTOCOL)
+            ))
+        success, results = pickle.loads(response.data)
+        if not success:
+            # 'results' is the exception
+            raise results
+        for (name, args, kwargs), (_, space) in zip(calls, results):
+            if space is not None:
+                # The 'space' was modified remotely, e.g. in 'iterate()'
+                _update_space(kwargs["space"], space)
+        return results[-1][0]
+
+    @contextmanager
+    def _connection(self):
+        """
+        Borrow a connection from the pool.
+        """
+        if self._stopped:
+            raise RuntimeError("The connection to PyMOL was closed")
+        with self._connection_slots:
+            try:
+                connection = self._connections.get_nowait()
+            except queue.Empty:
+                connection = xmlrpc.client.ServerProxy(
+                    self._url, allow_none=True,
+                    transport=_TimeoutTransport(self._timeout)
+                )
+            try:
+                yield connection
+            except (OSError, xmlrpc.client.ProtocolError):
+                # Do not reuse a broken connection
+                connection("close")()
+                raise
+            else:
+                self._connections.put(connection)
+
+    def _get_queue(self):
+        return getattr(self._thread_state, "queue", None)
+
+
+class _RemoteCmd:
+    """
+    The proxy for the ``cmd`` module of a remote *PyMOL* process.
+    """
+
+    def __init__(self, remote):
+        self._remote = remote
+
+    def __getattr__(self, name):
+        if name.startswith("_") and name not in _PRIVATE_COMMANDS:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            )
+        if name == "png":
+            return self._png
+
+        def call(*args, **kwargs):
+            return self._remote._call(name, args, kwargs)
+        call.__name__ = name
+        return call
+
+    def _png(self, filename, *args, **kwargs):
+        """
+        Render the image remotely and write it to the local file.
+        """
+        data = self._remote._call("png", (None,) + args, kwargs)
+        if filename is None:
+            return data
+        with open(filename, "wb") as file:
+            file.write(data)
+        return 1
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    """
+    A transport with a timeout for the connection.
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self._timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        if self._timeout is not None:
+            connection.timeout = self._timeout
+        return connection
+
+
+# The functions of the 'cmd' module used by ammolite,
+# that are not part of the public API
+_PRIVATE_COMMANDS = frozenset(["_feedback"])
+
+
+def _update_space(space, remote_space):
+    """
+    Transfer the changes of a remotely modified ``space`` dictionary
+    into the local one.
+    Lists and dictionaries are updated in place, as the caller might
+    hold references to them.
+    """
+    for key, value in remote_space.items():
+        local_value = space.get(key)
+        if isinstance(local_value, list):
+            local_value[:] = value
+        elif isinstance(local_value, dict):
+            local_value.clear()
+            local_value.update(value)
+        else:
+            space[key] = value
+
+
+# Installed in the PyMOL process,
+# executes the pickled calls of a 'RemotePyMOL' object
+_SERVER_CODE = '''
+def ammolite_call(data):
+    import pickle
+    import traceback
+    from xmlrpc.client import Binary
+    from pymol import cmd
+
+    calls = pickle.loads(data.data)
+    results = []
+    try:
+        for name, args, kwargs in calls:
+            result = getattr(cmd, name)(*args, **kwargs)
+            if name.startswith("iterate"):
+                # The caller expects the modified 'space'
+                results.append((result, kwargs.get("space")))
+            else:
+                results.append((result, None))
+        response = (True, results)
+    except Exception as e:
+        response = (False, e)
+    try:
+        data = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # The return value or exception cannot be pickled
+        data = pickle.dumps((False, RuntimeError(traceback.format_exc())))
+    return Binary(data)
+
+from pymol import cmd
+cmd.ammolite_call = ammolite_call
+'''
+
+# The PyMOL command, that installs the handler
+# As PyMOL commands are single lines, the code is encoded
+_SERVER_COMMAND = (
+    "/exec(__import__('base64').b64decode('"
+    + base64.b64encode(_SERVER_CODE.encode()).decode()
+    + "').decode())"
+)
@@ -0,0 +1,155 @@
+import os
+import time
+from os.path import join
+import pytest
+import biotite.structure.io.pdbx as pdbx
+import ammolite
+from ammolite import PyMOLObject, RenderCache, render_array, show
+from .util import data_dir
+
+
+pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+structure = pdbx.get_structure(pdbx_file, model=1)
+
+
+@pytest.fixture
+def pymol_obj():
+    ammolite.reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    pymol_obj.show_as("spheres")
+    pymol_obj.zoom()
+    return pymol_obj
+
+
+def test_fingerprint(pymol_obj):
+    """
+    Check if the fingerprint is the same for an unchanged scene and
+    different for any change of the scene.
+    """
+    cmd = ammolite.cmd
+    size = (60, 40)
+    ref_key = RenderCache.fingerprint(cmd, size, False)
+    assert RenderCache.fingerprint(cmd, size, False) == ref_key
+
+    assert RenderCache.fingerprint(cmd, (40, 60), False) != ref_key
+    assert RenderCache.fingerprint(cmd, size, True) != ref_key
+
+    keys = [ref_key]
+    cmd.turn("x", 10)
+    keys.append(RenderCache.fingerprint(cmd, size, False))
+    pymol_obj.color("red", structure.element == "O")
+    keys.append(RenderCache.fingerprint(cmd, size, False))
+    pymol_obj.show("sticks")
+    keys.append(RenderCache.fingerprint(cmd, size, False))
+    pymol_obj.set_coord(pymol_obj.get_coord() + 1)
+    keys.append(RenderCache.fingerprint(cmd, size, False))
+    cmd.set("sphere_scale", 0.5)
+    keys.append(RenderCache.fingerprint(cmd, size, False))
+    assert len(set(keys)) == len(keys)
+
+
+def test_show(pymol_obj):
+    """
+    Check if an image of an unchanged scene is taken from the cache and
+    if the hits and misses are counted.
+    """
+    pytest.importorskip("IPython")
+
+    cache = RenderCache()
+    ref_image = show((60, 40), use_ray=True, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    start = time.perf_counter()
+    image = show((60, 40), use_ray=True, cache=cache)
+    assert time.perf_counter() - start < 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert image.data == ref_image.data
+
+    pymol_obj.color("red")
+    image = show((60, 40), use_ray=True, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert image.data != ref_image.data
+
+    # 'render_array()' uses the same cache
+    render_array((60, 40), use_ray=True, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_lru():
+    """
+    Check if the least recently used images are removed, if the size
+    limit is exceeded.
+    """
+    cache = RenderCache(max_memory_size=30)
+    cache.put("a", b"0" * 10)
+    cache.put("b", b"1" * 10)
+    cache.put("c", b"2" * 10)
+    # Make 'a' the most recently used image
+    assert cache.get("a") == b"0" * 10
+    cache.put("d", b"3" * 10)
+    assert cache.get("b") is None
+    for key in ("a", "c", "d"):
+        assert cache.get(key) is not None
+    # Images exceeding the limit are not cached at all
+    cache.put("e", b"4" * 31)
+    assert cache.get("e") is None
+    assert cache.get("a") is not None
+    assert (cache.hits, cache.misses) == (5, 2)
+
+
+def test_disk(tmp_path):
+    """
+    Check if the images in the cache directory are used by another
+    cache instance and if the size limit is obeyed.
+    """
+    directory = str(tmp_path)
+    cache = RenderCache(max_memory_size=0, directory=directory)
+    cache.put("a", b"0" * 10)
+    cache.put("b", b"1" * 10)
+    # The order of use is given by the modification time
+    os.utime(join(directory, "a.png"), (1, 1))
+    os.utime(join(directory, "b.png"), (2, 2))
+
+    cache = RenderCache(directory=directory, max_disk_size=15)
+    # 'b' is more recent
+    assert cache.get("a") is None
+    assert cache.get("b") == b"1" * 10
+    assert len(list(tmp_path.iterdir())) == 1
+
+    cache.put("c", b"2" * 10)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["c.png"]
+    cache.clear()
+    assert cache.get("c") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_shared_directory(tmp_path):
+    """
+    Check if cache instances, that are open at the same time, use the
+    images of each other and obey the size limit for all images in the
+    shared directory.
+    """
+    directory = str(tmp_path)
+    cache_1 = RenderCache(
+        max_memory_size=0, directory=directory, max_disk_size=25
+    )
+    cache_2 = RenderCache(
+        max_memory_size=0, directory=directory, max_disk_size=25
+    )
+    cache_1.put("a", b"0" * 10)
+    assert cache_2.get("a") == b"0" * 10
+    os.utime(join(directory, "a.png"), (1, 1))
+
+    cache_2.put("b", b"1" * 10)
+    os.utime(join(directory, "b.png"), (2, 2))
+    assert cache_1.get("b") == b"1" * 10
+    os.utime(join(directory, "b.png"), (3, 3))
+    # 'a' is the least recently used image, although 'cache_2' has not
+    # written it
+    cache_2.put("c", b"2" * 10)
+    assert sorted(path.name for path in tmp_path.iterdir()) \
+        == ["b.png", "c.png"]
+    assert cache_1.get("a") is None
+
+    cache_1.clear()
+    assert list(tmp_path.iterdir()) == []
+    assert cache_2.get("b") is None
@@ -3,6 +3,7 @@ import numpy as np
 import pytest
 import biotite.structure as struc
 import biotite.structure.io.pdbx as pdbx
+from pymol import cmd
 from ammolite import PyMOLObject, reset
 from .util import data_dir
 
@@ -61,6 +62,26 @@ expr = "resi 1-10"
             "representation": "surface",
         }),
         
+        ("color_by", {
+            "values": np.linspace(0, 1, structure.array_length()),
+            "cmap": [[0.0, 0.0, 1.0], [1.0, 0.0, 0.0]],
+        }),
+        ("color_by", {
+            "values": np.random.default_rng(0).random(
+                (structure.array_length(), 3)
+            ),
+            "selection": mask,
+            "representation": "cartoon",
+        }),
+        
+        ("surface_color", {
+            "color": "green",
+        }),
+        ("surface_color", {
+            "color": (0.0, 1.0, 1.0),
+            "selection": mask,
+        }),
+        
         # Not available in Open Source PyMOL
         #("desaturate", {
         #}),
@@ -108,6 +129,12 @@ expr = "resi 1-10"
         ("select", {
             "name": "selection1",
         }),
+
+        ("set_atom_property", {
+            "name": "b",
+            "values": np.zeros(structure.array_length()),
+            "selection": mask,
+        }),
         
         ("set", {
             "name": "sphere_color",
@@ -149,4 +176,411 @@ def test_command(command_name, kwargs):
     structure.bonds = struc.connect_via_residue_names(structure)
     pymol_obj = PyMOLObject.from_structure(structure)
     command = getattr(PyMOLObject, command_name)
-    command(pymol_obj, **kwargs)
\ No newline at end of file
+    command(pymol_obj, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "use_cmap, representation", [
+        (False, None),
+        (True, None),
+        (False, "sphere"),
+    ]
+)
+def test_color_by(use_cmap, representation):
+    """
+    Check if each atom gets the color given in the color array.
+    """
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    n_atoms = structure.array_length()
+    if use_cmap:
+        values = np.arange(n_atoms)
+        cmap = [[0.0, 0.0, 0.0], [1.0, 0.5, 0.0]]
+        ref_rgb = np.stack([
+            values / (n_atoms - 1),
+            values / (n_atoms - 1) * 0.5,
+            np.zeros(n_atoms),
+        ], axis=-1)
+        pymol_obj.color_by(values, cmap, selection=mask)
+    else:
+        ref_rgb = np.random.default_rng(0).random((n_atoms, 3))
+        pymol_obj.color_by(
+            ref_rgb, selection=mask, representation=representation
+        )
+
+    expression = "color" if representation is None \
+                 else f"s.{representation}_color"
+    colors = []
+    cmd.iterate(
+        pymol_obj.where(mask), f"colors.append({expression})",
+        space={"colors": colors}
+    )
+    test_rgb = np.array(
+        [cmd.get_color_tuple(color) for color in colors]
+    )
+    assert np.allclose(test_rgb, ref_rgb[mask], atol=1/255)
+
+
+@pytest.mark.parametrize(
+    "name, values", [
+        ("b", np.linspace(0, 100, structure.array_length())),
+        ("q", np.linspace(0, 1, structure.array_length())),
+        ("formal_charge", np.arange(structure.array_length()) % 3 - 1),
+        ("ss", np.where(np.arange(structure.array_length()) % 2, "H", "S")),
+        ("reps", np.arange(structure.array_length()) % 4),
+        ("p.score", np.linspace(-1, 1, structure.array_length())),
+        ("p.tag", np.arange(structure.array_length()).astype(str)),
+    ]
+)
+@pytest.mark.parametrize("use_mask", [False, True])
+def test_set_atom_property(name, values, use_mask):
+    """
+    Check if each atom gets the property value given in the array.
+    """
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    selection = mask if use_mask else None
+    pymol_obj.set_atom_property(name, values, selection)
+
+    test_values = []
+    cmd.iterate(
+        pymol_obj.name, f"test_values.append({name})",
+        space={"test_values": test_values}
+    )
+    ref_values = values.tolist()
+    if use_mask:
+        # The other atoms retain their original value
+        test_values = [
+            value for value, is_masked in zip(test_values, mask) if is_masked
+        ]
+        ref_values = [
+            value for value, is_masked in zip(ref_values, mask) if is_masked
+        ]
+    if isinstance(ref_values[0], float):
+        assert np.allclose(test_values, ref_values, atol=1e-5)
+    else:
+        assert test_values == ref_values
+
+
+def test_set_atom_property_sync():
+    """
+    Check if :meth:`PyMOLObject.sync()` takes property changes into
+    account.
+    """
+    reset()
+    atoms = structure[0]
+    atoms.bonds = struc.connect_via_residue_names(atoms)
+    atoms.set_annotation("b_factor", np.zeros(atoms.array_length()))
+    pymol_obj = PyMOLObject.from_structure(atoms, track_changes=True)
+    pymol_obj.set_atom_property("b", np.ones(atoms.array_length()), mask)
+    # Restoring the uploaded structure must reset the B-factors
+    pymol_obj.sync(atoms)
+    b_factors = []
+    cmd.iterate(
+        pymol_obj.name, "b_factors.append(b)", space={"b_factors": b_factors}
+    )
+    assert b_factors == [0.0] * atoms.array_length()
+
+
+def test_set_atom_property_invalid():
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    with pytest.raises(ValueError):
+        pymol_obj.set_atom_property("unknown", np.zeros(mask.shape))
+    with pytest.raises(ValueError):
+        pymol_obj.set_atom_property("p.not valid", np.zeros(mask.shape))
+    with pytest.raises(IndexError):
+        pymol_obj.set_atom_property("b", np.zeros(len(mask) + 1))
+
+
+def test_get_atom_property():
+    """
+    Check if the read properties are equal to the written ones and to
+    the annotations of the converted structure.
+    """
+    reset()
+    atoms = structure[0]
+    atoms.bonds = struc.connect_via_residue_names(atoms)
+    pymol_obj = PyMOLObject.from_structure(atoms)
+    n_atoms = atoms.array_length()
+
+    # Properties that are not changed
+    ref_structure = pymol_obj.to_structure(
+        state=1, extra_fields=["b_factor", "occupancy", "charge"]
+    )
+    test_values = pymol_obj.get_atom_property(["b", "q", "formal_charge"])
+    assert np.allclose(test_values["b"], ref_structure.b_factor)
+    assert np.allclose(test_values["q"], ref_structure.occupancy)
+    assert test_values["formal_charge"].tolist() \
+        == ref_structure.charge.tolist()
+
+    # Properties that are changed
+    scores = np.linspace(0, 1, n_atoms)
+    pymol_obj.set_atom_property("p.score", scores, mask)
+    pymol_obj.show_as("sticks", mask)
+    pymol_obj.color("red", mask)
+    test_scores = pymol_obj.get_atom_property("p.score")
+    assert test_scores.dtype == object
+    assert test_scores[~mask].tolist() == [None] * np.count_nonzero(~mask)
+    assert np.allclose(test_scores[mask].astype(float), scores[mask])
+    test_values = pymol_obj.get_atom_property(["reps", "color"])
+    assert len(np.unique(test_values["reps"][mask])) == 1
+    assert (test_values["reps"][mask] != test_values["reps"][~mask][0]).all()
+    assert (test_values["color"][mask] == cmd.get_color_index("red")).all()
+
+    with pytest.raises(ValueError):
+        pymol_obj.get_atom_property("unknown")
+
+
+@pytest.mark.parametrize("random_seed", range(5))
+def test_coalesce(monkeypatch, random_seed):
+    """
+    Check if the style commands recorded in a :meth:`coalesce()`
+    context give the same result as executing them immediately,
+    using fewer *PyMOL* commands.
+    """
+    atoms = structure[0]
+    atoms.bonds = struc.connect_via_residue_names(atoms)
+    rng = np.random.default_rng(random_seed)
+    commands = []
+    for _ in range(30):
+        method_name = rng.choice(
+            ["color", "surface_color", "show", "hide", "show_as"]
+        )
+        selection = rng.choice([False, True], atoms.array_length())
+        if method_name in ("color", "surface_color"):
+            args = (str(rng.choice(["red", "green", "blue"])), selection)
+            if method_name == "color":
+                args += (rng.choice([None, "sphere"]),)
+        else:
+            args = (
+                str(rng.choice(
+                    ["sticks", "spheres", "cartoon", "everything"]
+                )),
+                selection
+            )
+        commands.append((str(method_name), args))
+    # Also include a selection expression
+    commands.append(("show", ("lines", "name CA")))
+
+    # Count the style commands sent to PyMOL
+    call_count = 0
+    for method_name in ["color", "set", "show", "hide", "show_as"]:
+        def counted(*args, _original=getattr(cmd, method_name), **kwargs):
+            nonlocal call_count
+            call_count += 1
+            return _original(*args, **kwargs)
+        monkeypatch.setattr(cmd, method_name, counted)
+
+    results = []
+    call_counts = []
+    for use_coalesce in [False, True]:
+        reset()
+        pymol_obj = PyMOLObject.from_structure(atoms)
+        call_count = 0
+        if use_coalesce:
+            with pymol_obj.coalesce():
+                for method_name, args in commands:
+                    getattr(pymol_obj, method_name)(*args)
+        else:
+            for method_name, args in commands:
+                getattr(pymol_obj, method_name)(*args)
+        call_counts.append(call_count)
+        styles = []
+        cmd.iterate(
+            pymol_obj.name,
+            "styles.append((color, reps, s.sphere_color, s.surface_color))",
+            space={"styles": styles}
+        )
+        results.append(styles)
+
+    assert results[1] == results[0]
+    assert call_counts[1] < call_counts[0]
+
+
+@pytest.mark.parametrize(
+    "representation", ["labels", "label", "stick", "licorice", "ellipsoids"]
+)
+def test_coalesce_representations(representation):
+    """
+    Check if all representations, including abbreviated names and
+    aliases, are recorded in a :meth:`coalesce()` context, so that they
+    are applied in the correct order relative to ``'everything'``.
+    """
+    atoms = structure[0]
+    atoms.bonds = struc.connect_via_residue_names(atoms)
+    mask = atoms.res_id < 5
+
+    results = []
+    for use_coalesce in [False, True]:
+        reset()
+        pymol_obj = PyMOLObject.from_structure(atoms)
+        if use_coalesce:
+            with pymol_obj.coalesce():
+                pymol_obj.hide("everything")
+                pymol_obj.show(representation, mask)
+        else:
+            pymol_obj.hide("everything")
+            pymol_obj.show(representation, mask)
+        atom_reps = []
+        cmd.iterate(
+            pymol_obj.name, "atom_reps.append(reps)",
+            space={"atom_reps": atom_reps}
+        )
+        results.append(atom_reps)
+
+    assert results[1] == results[0]
+    assert any(reps != 0 for reps in results[0])
+
+
+def test_color_registry(monkeypatch):
+    """
+    Check if identical RGB colors reuse the same named color and if the
+    number of registered colors is limited.
+    """
+    monkeypatch.setattr(PyMOLObject, "COLOR_REGISTRY_SIZE", 3)
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    
+    def registered_colors():
+        return [
+            name for name, _ in cmd.get_color_indices(all=1)
+            if name.startswith("ammolite_color_")
+        ]
+    
+    def atom_color(index=0):
+        colors = []
+        cmd.iterate(
+            pymol_obj.where(np.array([index])), "colors.append(color)",
+            space={"colors": colors}
+        )
+        return cmd.get_color_tuple(colors[0])
+    
+    n_colors = len(registered_colors())
+    pymol_obj.color((1.0, 0.0, 0.0))
+    pymol_obj.color((1.0, 0.0, 0.0))
+    # Equal after rounding
+    pymol_obj.color((1.0, 0.0, 1e-6))
+    assert len(registered_colors()) == max(n_colors, 1)
+    assert atom_color() == pytest.approx((1.0, 0.0, 0.0))
+
+    for i in range(10):
+        pymol_obj.color((0.0, i / 10, 0.0), np.array([i + 1]))
+        assert atom_color(i + 1) \
+            == pytest.approx((0.0, i / 10, 0.0), abs=1e-2)
+    assert len(registered_colors()) <= 3
+    # Atoms colored with a registered color keep their color,
+    # when the limit is reached
+    assert atom_color() == pytest.approx((1.0, 0.0, 0.0))
+    for i in range(10):
+        assert atom_color(i + 1) \
+            == pytest.approx((0.0, i / 10, 0.0), abs=1e-2)
+
+    # A reset removes the registered colors
+    # -> the registry must register the color again
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    pymol_obj.color((0.0, 0.9, 0.0))
+    assert atom_color() == pytest.approx((0.0, 0.9, 0.0), abs=1e-2)
+
+    with pytest.raises(ValueError):
+        pymol_obj.color("nonexistent_color")
+    # Newly defined colors names are found
+    cmd.set_color("new_color", (0.5, 0.5, 0.5))
+    pymol_obj.color("new_color")
+    cmd.set_color("newcolor", (0.5, 0.5, 0.5))
+    pymol_obj.color("newcolor")
+
+
+def test_batch():
+    """
+    Check if validations are skipped within a batch and if the object
+    is validated on exit.
+    """
+    from ammolite import ModifiedObjectError, NonexistentObjectError
+
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    with pymol_obj.batch():
+        pymol_obj.show_as("sticks")
+        with pymol_obj.batch():
+            pymol_obj.color("red", mask)
+        pymol_obj.hide("sticks", mask)
+    assert pymol_obj.skipped_validations == 3
+    # Outside of the context the object is validated again
+    pymol_obj.show("spheres")
+    assert pymol_obj.skipped_validations == 3
+
+    with pytest.raises(ModifiedObjectError):
+        with pymol_obj.batch():
+            cmd.remove(pymol_obj.where(mask))
+            # Not validated within the batch
+            pymol_obj.show("sticks")
+    
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    with pytest.raises(NonexistentObjectError):
+        with pymol_obj.batch():
+            cmd.delete(pymol_obj.name)
+
+
+def test_defer():
+    """
+    Check if commands within a :meth:`PyMOLObject.defer()` context are
+    executed only on exit or when information is read from the object
+    and if the result equals immediate execution.
+    """
+    def apply_commands(pymol_obj):
+        pymol_obj.show_as("sticks")
+        pymol_obj.color("red", mask)
+        pymol_obj.set_atom_property("b", np.arange(structure.array_length()))
+        pymol_obj.label(mask, "resn")
+
+    reset()
+    ref_obj = PyMOLObject.from_structure(structure[0])
+    apply_commands(ref_obj)
+    ref_colors = ref_obj.get_atom_property("color")
+    ref_b = ref_obj.get_atom_property("b")
+
+    reset()
+    cmd.set("suspend_updates", 0)
+    test_obj = PyMOLObject.from_structure(structure[0])
+    with test_obj.defer():
+        with test_obj.defer():
+            apply_commands(test_obj)
+        # Not executed yet
+        assert cmd.count_atoms(f"model {test_obj.name} and rep sticks") == 0
+    assert (test_obj.get_atom_property("color") == ref_colors).all()
+    assert (test_obj.get_atom_property("b") == ref_b).all()
+    # Viewer updates are not suspended anymore
+    assert cmd.get_setting_int("suspend_updates") == 0
+
+    reset()
+    test_obj = PyMOLObject.from_structure(structure[0])
+    with test_obj.defer():
+        test_obj.show_as("sticks")
+        # Reading from the object executes the queued commands first
+        assert test_obj.get_atom_property("reps").any()
+        test_obj.set_atom_property("b", np.zeros(structure.array_length()))
+        assert (test_obj.to_structure().b_factor == 0).all()
+
+
+def test_defer_error():
+    """
+    Check if a failing deferred command points to its original call.
+    """
+    from ammolite import DeferredCommandError
+
+    reset()
+    pymol_obj = PyMOLObject.from_structure(structure[0])
+    with pytest.raises(DeferredCommandError) as exc_info:
+        with pymol_obj.defer():
+            pymol_obj.show_as("sticks")
+            pymol_obj.set_atom_property("b", np.zeros(3))
+            pymol_obj.color("red")
+    assert isinstance(exc_info.value.__cause__, IndexError)
+    assert exc_info.value.call_site.filename == __file__
+    assert exc_info.value.call_site.line \
+        == 'pymol_obj.set_atom_property("b", np.zeros(3))'
+    # The commands before the failing one are executed
+    assert cmd.count_atoms(f"model {pymol_obj.name} and rep sticks") > 0
@@ -6,7 +6,9 @@ import pytest
 import biotite.structure as struc
 import biotite.structure.io.pdbx as pdbx
 from pymol import cmd
-from ammolite import PyMOLObject, convert_to_chempy_model, reset
+from ammolite import (
+    PyMOLObject, convert_to_atom_array, convert_to_chempy_model, reset
+)
 from .util import data_dir
 
 
@@ -70,20 +72,21 @@ def test_to_pymol(path):
 
 
 @pytest.mark.parametrize(
-    "path, state",
+    "path, state, loader",
     itertools.product(
         glob.glob(join(data_dir, "*.cif")),
         # AtomArray or AtomArrayStack
-        [1, None]
+        [1, None],
+        ["chempy", "cif"]
     )
 )
-def test_both_directions(path, state):
+def test_both_directions(path, state, loader):
     pdbx_file = pdbx.PDBxFile.read(path)
     ref_array = pdbx.get_structure(pdbx_file, model=state)
     ref_array.bonds = struc.connect_via_residue_names(ref_array)
 
     reset()
-    test_array = PyMOLObject.from_structure(ref_array) \
+    test_array = PyMOLObject.from_structure(ref_array, loader=loader) \
                             .to_structure(state=state, include_bonds=True)
     
     for cat in ref_array.get_annotation_categories():
@@ -95,4 +98,377 @@ def test_both_directions(path, state):
     # PyMOL does not distinguish between 'normal' and aromatic bonds
     test_array.bonds.remove_aromaticity()
     ref_array.bonds.remove_aromaticity()
-    assert test_array.bonds.as_set() == ref_array.bonds.as_set()
\ No newline at end of file
+    assert test_array.bonds.as_set() == ref_array.bonds.as_set()
+
+
+@pytest.mark.parametrize("path", glob.glob(join(data_dir, "*.cif")))
+def test_loader_consistency(path):
+    """
+    Check if the *mmCIF* based loader gives the same *PyMOL* object as
+    the *chempy* based loader.
+    """
+    pdbx_file = pdbx.PDBxFile.read(path)
+    atom_array = pdbx.get_structure(
+        pdbx_file, model=1,
+        extra_fields=["b_factor", "occupancy", "charge"]
+    )
+    atom_array.bonds = struc.connect_via_residue_names(atom_array)
+
+    reset()
+    ref_object = PyMOLObject.from_structure(atom_array, loader="chempy")
+    test_object = PyMOLObject.from_structure(atom_array, loader="cif")
+
+    for attribute in ["ID", "ss", "type", "segi", "vdw", "formal_charge"]:
+        ref_values = []
+        test_values = []
+        cmd.iterate(
+            ref_object.name, f"values.append({attribute})",
+            space={"values": ref_values}
+        )
+        cmd.iterate(
+            test_object.name, f"values.append({attribute})",
+            space={"values": test_values}
+        )
+        assert test_values == ref_values
+    assert np.array_equal(
+        cmd.get_coords(test_object.name), cmd.get_coords(ref_object.name)
+    )
+    ref_array = ref_object.to_structure(include_bonds=True)
+    test_array = test_object.to_structure(include_bonds=True)
+    for cat in ref_array.get_annotation_categories():
+        assert (
+            test_array.get_annotation(cat) == ref_array.get_annotation(cat)
+        ).all()
+    assert test_array.bonds == ref_array.bonds
+
+
+@pytest.mark.parametrize(
+    "start, stop, step, chunk_bytes, use_plugin",
+    [
+        (None, None, None, None, True),
+        (None, None, None, None, False),
+        (3, None, None, None, True),
+        (None, 30, 7, None, True),
+        (1, None, 2, None, False),
+        # Transfer the models in multiple chunks
+        (None, None, None, 5000, True),
+        (2, 3, None, None, True),
+    ]
+)
+def test_state_loading(monkeypatch, start, stop, step, chunk_bytes,
+                       use_plugin):
+    """
+    Check if the selected models of an :class:`AtomArrayStack` are
+    correctly loaded as states, with and without the trajectory
+    plugin of *PyMOL*.
+    """
+    from pymol import CmdException
+
+    path = join(data_dir, "1l2y.cif")
+    pdbx_file = pdbx.PDBxFile.read(path)
+    ref_stack = pdbx.get_structure(pdbx_file)
+    ref_coord = ref_stack.coord[start:stop:step]
+
+    if chunk_bytes is not None:
+        monkeypatch.setattr(PyMOLObject, "STATE_CHUNK_BYTES", chunk_bytes)
+    if not use_plugin:
+        def load_traj(*args, **kwargs):
+            raise CmdException("unknown format 'dcd'")
+        monkeypatch.setattr(cmd, "load_traj", load_traj)
+
+    reset()
+    pymol_object = PyMOLObject.from_structure(
+        ref_stack, start=start, stop=stop, step=step
+    )
+    assert cmd.count_states(pymol_object.name) == len(ref_coord)
+    assert np.array_equal(pymol_object.get_coord(), ref_coord)
+    assert cmd.get_setting_int("defer_builds_mode") == 0
+
+
+@pytest.mark.parametrize("details_feedback", [False, True])
+def test_state_loading_output(capfd, details_feedback):
+    """
+    Check if loading the models of an :class:`AtomArrayStack` does not
+    print messages and if the feedback setting of *PyMOL* is retained.
+    """
+    from pymol.constants import fb_mask, fb_module
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    stack = pdbx.get_structure(pdbx_file)
+
+    reset()
+    action = "enable" if details_feedback else "disable"
+    cmd.feedback(action, "objectmolecule", "details")
+    try:
+        capfd.readouterr()
+        pymol_object = PyMOLObject.from_structure(stack)
+        assert cmd.count_states(pymol_object.name) == stack.stack_depth()
+        assert capfd.readouterr().out == ""
+        assert bool(cmd._feedback(
+            fb_module.objectmolecule, fb_mask.details
+        )) == details_feedback
+    finally:
+        cmd.feedback("enable", "objectmolecule", "details")
+
+
+def test_concurrent_state_loading_output(capfd):
+    """
+    Check if loading the models of an :class:`AtomArrayStack` into
+    multiple *PyMOL* instances from concurrent threads does not print
+    messages and leaves the standard output intact.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from ammolite import close_pymol_instance, create_pymol_instance
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    stack = pdbx.get_structure(pdbx_file)
+
+    def load(pymol_instance):
+        pymol_objects = [
+            PyMOLObject.from_structure(stack, pymol_instance=pymol_instance)
+            for _ in range(10)
+        ]
+        return [
+            pymol_instance.cmd.count_states(pymol_object.name)
+            for pymol_object in pymol_objects
+        ]
+
+    pymol_instances = [create_pymol_instance() for _ in range(4)]
+    try:
+        capfd.readouterr()
+        with ThreadPoolExecutor(len(pymol_instances)) as executor:
+            state_counts = [
+                count
+                for counts in executor.map(load, pymol_instances)
+                for count in counts
+            ]
+        assert capfd.readouterr().out == ""
+        assert state_counts == [stack.stack_depth()] * len(state_counts)
+    finally:
+        for pymol_instance in pymol_instances:
+            close_pymol_instance(pymol_instance)
+
+    # The standard output is not redirected anymore
+    print("python", flush=True)
+    os.write(1, b"fd\n")
+    assert capfd.readouterr().out == "python\nfd\n"
+
+
+def test_invalid_loader():
+    reset()
+    with pytest.raises(ValueError):
+        PyMOLObject.from_structure(
+            struc.array([struc.Atom([0, 0, 0], element="C")]),
+            loader="unknown"
+        )
+
+
+@pytest.mark.parametrize(
+    "path, include_bonds",
+    itertools.product(
+        glob.glob(join(data_dir, "*.cif")),
+        [False, True]
+    )
+)
+def test_bulk_extraction(path, include_bonds):
+    """
+    Check if the direct extraction of annotations and coordinates from
+    *PyMOL* gives the same result as the conversion of a *chempy*
+    model.
+    """
+    reset()
+    cmd.load(path, "test")
+    ref_array = convert_to_atom_array(cmd.get_model("test", 1), include_bonds)
+    test_array = PyMOLObject("test")._get_atom_array(1, include_bonds)
+
+    for cat in ref_array.get_annotation_categories():
+        assert (
+            test_array.get_annotation(cat) == ref_array.get_annotation(cat)
+        ).all()
+    assert np.array_equal(test_array.coord, ref_array.coord)
+    if include_bonds:
+        assert test_array.bonds == ref_array.bonds
+    else:
+        assert test_array.bonds is None
+
+
+@pytest.mark.parametrize(
+    "state, use_out",
+    itertools.product(
+        [None, 2, range(1, 11, 3), [5, 1]],
+        [False, True]
+    )
+)
+def test_get_coord(tmp_path, state, use_out):
+    """
+    Check if :meth:`PyMOLObject.get_coord()` returns the same
+    coordinates as the corresponding models of the original structure,
+    also if the coordinates are written into a memory-mapped array.
+    """
+    path = join(data_dir, "1l2y.cif")
+    pdbx_file = pdbx.PDBxFile.read(path)
+    ref_stack = pdbx.get_structure(pdbx_file)
+    if state is None:
+        ref_coord = ref_stack.coord
+    elif isinstance(state, int):
+        ref_coord = ref_stack.coord[state - 1]
+    else:
+        ref_coord = ref_stack.coord[np.array(state) - 1]
+
+    reset()
+    pymol_object = PyMOLObject.from_structure(ref_stack)
+    if use_out:
+        out = np.memmap(
+            tmp_path / "coord.bin", dtype=np.float32, mode="w+",
+            shape=ref_coord.shape
+        )
+        test_coord = pymol_object.get_coord(state, out=out)
+        assert test_coord is out
+    else:
+        test_coord = pymol_object.get_coord(state)
+
+    assert test_coord.dtype == np.float32
+    assert np.array_equal(test_coord, ref_coord)
+    if not isinstance(state, int):
+        test_stack = pymol_object.to_structure(state)
+        assert np.array_equal(test_stack.coord, ref_coord)
+
+
+def test_get_coord_invalid():
+    path = join(data_dir, "1l2y.cif")
+    ref_stack = pdbx.get_structure(pdbx.PDBxFile.read(path))
+    reset()
+    pymol_object = PyMOLObject.from_structure(ref_stack)
+    with pytest.raises(IndexError):
+        pymol_object.get_coord(range(0, 3))
+    with pytest.raises(ValueError):
+        pymol_object.get_coord(
+            None, out=np.zeros((1, 1, 3), dtype=np.float32)
+        )
+
+
+@pytest.mark.parametrize(
+    "format, start, stop, step, chunk_size",
+    [
+        ("xtc", None, None, None, None),
+        ("trr", None, None, None, None),
+        ("dcd", None, None, None, None),
+        ("trr", 3, None, None, 4),
+        ("trr", None, 30, 7, 2),
+        ("trr", 1, None, 2, 1),
+    ]
+)
+def test_from_trajectory(tmp_path, format, start, stop, step, chunk_size):
+    """
+    Check if the frames of a trajectory file are correctly loaded as
+    states, independent of the chunk size.
+    """
+    pytest.importorskip("mdtraj")
+    import biotite.structure.io as strucio
+
+    path = join(data_dir, "1l2y.cif")
+    pdbx_file = pdbx.PDBxFile.read(path)
+    ref_stack = pdbx.get_structure(pdbx_file)
+    traj_path = str(tmp_path / f"test.{format}")
+    strucio.save_structure(traj_path, ref_stack)
+    ref_coord = strucio.load_structure(traj_path, template=ref_stack[0]) \
+                .coord[start:stop:step]
+
+    reset()
+    pymol_object = PyMOLObject.from_trajectory(
+        ref_stack[0], traj_path, start=start, stop=stop, step=step,
+        chunk_size=chunk_size
+    )
+    assert cmd.count_states(pymol_object.name) == len(ref_coord)
+    assert np.allclose(pymol_object.get_coord(), ref_coord, atol=1e-3)
+    test_stack = pymol_object.to_structure()
+    for cat in ["chain_id", "res_id", "res_name", "atom_name", "element"]:
+        assert (
+            test_stack.get_annotation(cat) == ref_stack.get_annotation(cat)
+        ).all()
+
+
+@pytest.mark.parametrize("use_mask", [False, True])
+def test_from_trajectory_superimpose(tmp_path, use_mask):
+    """
+    Check if the frames are superimposed onto the topology, if
+    requested.
+    """
+    pytest.importorskip("mdtraj")
+    import biotite.structure.io as strucio
+
+    path = join(data_dir, "1l2y.cif")
+    pdbx_file = pdbx.PDBxFile.read(path)
+    ref_stack = pdbx.get_structure(pdbx_file)
+    traj_path = str(tmp_path / "test.trr")
+    strucio.save_structure(traj_path, ref_stack)
+    mask = ref_stack.atom_name == "CA" if use_mask else None
+    ref_coord, _ = struc.superimpose(ref_stack[0], ref_stack, mask)
+    
+    reset()
+    pymol_object = PyMOLObject.from_trajectory(
+        ref_stack[0], traj_path, chunk_size=5,
+        superimpose=mask if use_mask else True
+    )
+    assert np.allclose(pymol_object.get_coord(), ref_coord.coord, atol=1e-3)
+
+
+@pytest.mark.parametrize(
+    "state", [None, 1, 20, range(2, 38, 5), [3, 4, 5, 10, 1]]
+)
+def test_set_coord(state):
+    """
+    Check if replacing the coordinates of states changes only the
+    coordinates of the selected states and keeps the object
+    properties.
+    """
+    path = join(data_dir, "1l2y.cif")
+    ref_stack = pdbx.get_structure(pdbx.PDBxFile.read(path))
+    reset()
+    pymol_object = PyMOLObject.from_structure(ref_stack)
+    pymol_object.color("red")
+    ref_color = cmd.get_color_index("red")
+
+    ref_coord = ref_stack.coord.copy()
+    if isinstance(state, int):
+        new_coord = ref_coord[state - 1] + 1
+        ref_coord[state - 1] = new_coord
+    else:
+        indices = np.arange(len(ref_coord)) if state is None \
+                  else np.array(state) - 1
+        new_coord = ref_coord[indices] + 1
+        ref_coord[indices] = new_coord
+    pymol_object.set_coord(new_coord, state)
+
+    assert np.array_equal(pymol_object.get_coord(), ref_coord)
+    colors = []
+    cmd.iterate(pymol_object.name, "colors.append(color)",
+                space={"colors": colors})
+    assert colors == [ref_color] * len(colors)
+
+
+def test_append_states():
+    path = join(data_dir, "1l2y.cif")
+    ref_stack = pdbx.get_structure(pdbx.PDBxFile.read(path))
+    reset()
+    pymol_object = PyMOLObject.from_structure(ref_stack[0])
+    pymol_object.append_states(ref_stack.coord[1])
+    pymol_object.append_states(ref_stack.coord[2:])
+    assert np.array_equal(pymol_object.get_coord(), ref_stack.coord)
+
+
+def test_set_coord_invalid():
+    path = join(data_dir, "1l2y.cif")
+    ref_stack = pdbx.get_structure(pdbx.PDBxFile.read(path))
+    reset()
+    pymol_object = PyMOLObject.from_structure(ref_stack)
+    with pytest.raises(IndexError):
+        # Too few states
+        pymol_object.set_coord(ref_stack.coord[:-1])
+    with pytest.raises(IndexError):
+        # Nonexistent state
+        pymol_object.set_coord(ref_stack.coord[0], len(ref_stack) + 1)
+    with pytest.raises(IndexError):
+        # Wrong number of atoms
+        pymol_object.append_states(ref_stack.coord[:, :-1])
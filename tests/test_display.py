@@ -0,0 +1,185 @@
+import glob
+import struct
+import tempfile
+import zlib
+from os.path import join
+import numpy as np
+import pytest
+import biotite.structure.io.pdbx as pdbx
+import ammolite
+from ammolite import PyMOLObject, show, render_array
+from ammolite.display import _decode_png, _decode_png_numpy
+from .util import data_dir
+
+
+pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+structure = pdbx.get_structure(pdbx_file, model=1)
+
+
+def _get_temp_files():
+    return set(glob.glob(join(tempfile.gettempdir(), "ammolite_*")))
+
+
+@pytest.mark.parametrize("use_ray", [False, True])
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_show(monkeypatch, use_ray, in_memory):
+    """
+    Check if :func:`show()` returns a complete PNG image of the given
+    size and if no temporary files are left, also if *PyMOL* can only
+    write image files.
+    """
+    pytest.importorskip("IPython")
+
+    ammolite.reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    pymol_obj.show_as("sticks")
+    pymol_obj.zoom()
+    if not in_memory:
+        png = ammolite.cmd.png
+        # Simulate a PyMOL version without in-memory PNG output
+        monkeypatch.setattr(
+            ammolite.cmd, "png",
+            lambda filename, *args, **kwargs:
+                None if filename is None else png(filename, *args, **kwargs)
+        )
+
+    temp_files = _get_temp_files()
+    image = show((60, 40), use_ray)
+    assert image.data[:8] == b"\x89PNG\r\n\x1a\n"
+    assert image.data.endswith(b"IEND\xaeB`\x82")
+    width, height = struct.unpack(">II", image.data[16:24])
+    assert (width, height) == (60, 40)
+    assert _get_temp_files() == temp_files
+
+
+def test_render_array():
+    """
+    Check if :func:`render_array()` gives the same image as the PNG
+    output of *PyMOL* for a single view and for multiple views.
+    """
+    ammolite.reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    pymol_obj.show_as("spheres")
+    pymol_obj.zoom()
+    cmd = ammolite.cmd
+    size = (60, 40)
+
+    original_view = cmd.get_view()
+    image = render_array(size, use_ray=True)
+    assert image.shape == (40, 60, 4)
+    assert image.dtype == np.uint8
+    ref_image = _decode_png(cmd.png(None, *size, ray=1))
+    assert (image == ref_image).all()
+
+    cmd.turn("y", 90)
+    turned_view = cmd.get_view()
+    ref_turned_image = _decode_png(cmd.png(None, *size, ray=1))
+    cmd.set_view(original_view)
+
+    images = render_array(
+        size, use_ray=True, views=[turned_view, original_view]
+    )
+    assert images.shape == (2, 40, 60, 4)
+    assert (images[0] == ref_turned_image).all()
+    assert (images[1] == ref_image).all()
+    assert not (images[0] == images[1]).all()
+    # The original view is restored
+    assert np.allclose(cmd.get_view(), original_view)
+
+
+def _reference_decode_png(data):
+    """
+    Decode a non-interlaced 8-bit RGBA PNG image byte by byte, as
+    described in the PNG specification.
+    """
+    pos = 8
+    compressed = b""
+    while pos < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos : pos+8])
+        chunk = data[pos+8 : pos+8+length]
+        if chunk_type == b"IHDR":
+            width, height = struct.unpack(">II", chunk[:8])
+        elif chunk_type == b"IDAT":
+            compressed += chunk
+        pos += length + 12
+    raw = zlib.decompress(compressed)
+    stride = width * 4
+    image = []
+    prior = [0] * stride
+    for y in range(height):
+        filter_type = raw[y * (stride+1)]
+        line = raw[y * (stride+1) + 1 : (y+1) * (stride+1)]
+        current = []
+        for i, value in enumerate(line):
+            a = current[i-4] if i >= 4 else 0
+            b = prior[i]
+            c = prior[i-4] if i >= 4 else 0
+            if filter_type == 0:
+                prediction = 0
+            elif filter_type == 1:
+                prediction = a
+            elif filter_type == 2:
+                prediction = b
+            elif filter_type == 3:
+                prediction = (a + b) // 2
+            else:
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                if pa <= pb and pa <= pc:
+                    prediction = a
+                elif pb <= pc:
+                    prediction = b
+                else:
+                    prediction = c
+            current.append((value + prediction) % 256)
+        image.append(current)
+        prior = current
+    return np.array(image, dtype=np.uint8).reshape(height, width, 4)
+
+
+def _encode_png(width, height, filtered_data):
+    """
+    Create a PNG file from already filtered scanlines.
+    """
+    def chunk(chunk_type, content):
+        return (
+            struct.pack(">I", len(content)) + chunk_type + content
+            + struct.pack(">I", zlib.crc32(chunk_type + content))
+        )
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(filtered_data))
+        + chunk(b"IEND", b"")
+    )
+
+
+@pytest.mark.parametrize("decode", [_decode_png, _decode_png_numpy])
+@pytest.mark.parametrize("seed", range(5))
+def test_decode_png(decode, seed):
+    """
+    Check if a PNG image with random filter types is decoded like the
+    reference decoder does.
+    """
+    width, height = 23, 17
+    rng = np.random.default_rng(seed)
+    scanlines = rng.integers(0, 256, (height, 1 + width * 4), dtype=np.uint8)
+    # Cover all filter types
+    scanlines[:, 0] = np.arange(height) % 5
+    rng.shuffle(scanlines[:, 0])
+    data = _encode_png(width, height, scanlines.tobytes())
+    assert (decode(data) == _reference_decode_png(data)).all()
+
+
+@pytest.mark.parametrize("decode", [_decode_png, _decode_png_numpy])
+def test_decode_pymol_png(decode):
+    """
+    Check if an image rendered by *PyMOL* is decoded like the
+    reference decoder does.
+    """
+    ammolite.reset()
+    pymol_obj = PyMOLObject.from_structure(structure)
+    pymol_obj.show_as("spheres")
+    pymol_obj.zoom()
+    data = ammolite.cmd.png(None, 60, 40, ray=1)
+    assert (decode(data) == _reference_decode_png(data)).all()
@@ -0,0 +1,156 @@
+import threading
+import time
+from os.path import join
+import numpy as np
+import pytest
+import biotite.structure.io.pdbx as pdbx
+from ammolite import RenderPool, RenderError
+from ammolite.display import _decode_png
+from .util import data_dir
+
+
+pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+structure = pdbx.get_structure(pdbx_file, model=1)
+style = [
+    ("show_as", ("sticks",)),
+    ("color", ("red", structure.element == "O")),
+]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with RenderPool(n_workers=2) as pool:
+        yield pool
+
+
+def test_render(pool):
+    """
+    Check if the images are rendered in the requested output type and
+    if the order of the images is retained.
+    """
+    png_data = pool.submit(structure, style, size=(200, 150)).result()
+    assert png_data[:8] == b"\x89PNG\r\n\x1a\n"
+    image = pool.submit(
+        structure, style, size=(200, 150), output="array"
+    ).result()
+    assert image.shape == (150, 200, 4)
+    assert image.dtype == np.uint8
+    assert (image == _decode_png(png_data)).all()
+
+    n_images = 8
+    images = list(pool.map(
+        [structure[:i+1] for i in range(n_images)],
+        style=[("show_as", ("spheres",))], size=(20, 10)
+    ))
+    assert len(images) == n_images
+    # Each image contains a different number of atoms
+    assert len(set(images)) == n_images
+
+
+def test_render_error(pool):
+    """
+    Check if an exception raised in a worker is set for the future and
+    if the worker remains usable.
+    """
+    with pytest.raises(Exception):
+        pool.submit(structure, [("show", ("invalid",))]).result()
+    assert pool.submit(structure, style, size=(20, 10)).result()
+
+
+def test_back_pressure():
+    """
+    Check if :meth:`RenderPool.submit()` blocks, if the maximum number
+    of pending jobs is reached.
+    """
+    with RenderPool(n_workers=1, max_pending=1) as pool:
+        first = pool.submit(structure, style, size=(20, 10))
+        pool.submit(structure, style, size=(20, 10))
+        assert first.done()
+
+
+@pytest.mark.parametrize("max_retries", [0, 1])
+def test_crash_recovery(max_retries):
+    """
+    Check if a job is retried on a restarted worker, if the worker
+    rendering it died.
+    """
+    with RenderPool(n_workers=1, max_retries=max_retries) as pool:
+        # A job that takes sufficiently long to kill the worker meanwhile
+        future = pool.submit(
+            structure, [("show_as", ("spheres",))],
+            size=(1000, 1000), use_ray=True
+        )
+        worker = pool._workers[0]
+        while worker.job is None:
+            time.sleep(0.01)
+        worker.process.kill()
+
+        if max_retries == 0:
+            with pytest.raises(RenderError):
+                future.result()
+        else:
+            assert future.result()[:8] == b"\x89PNG\r\n\x1a\n"
+        # The dead worker was replaced
+        assert pool.n_workers == 1
+        assert pool._workers[0] is not worker
+        assert pool.submit(structure, style, size=(20, 10)).result()
+
+
+def _submit_slow_job(pool):
+    """
+    Submit a job that takes sufficiently long to act on the pool
+    meanwhile and wait until it is rendered by a worker.
+    """
+    future = pool.submit(
+        structure, [("show_as", ("spheres",))],
+        size=(1000, 1000), use_ray=True
+    )
+    while pool._workers[0].job is None:
+        time.sleep(0.01)
+    return future
+
+
+def test_close_running():
+    """
+    Check if the future of a job, that is currently rendered, is
+    resolved, when the pool is closed.
+    """
+    pool = RenderPool(n_workers=1)
+    future = _submit_slow_job(pool)
+    pool.close()
+    assert future.done()
+    exception = future.exception()
+    if exception is None:
+        # The worker finished the job before it was stopped
+        assert future.result()[:8] == b"\x89PNG\r\n\x1a\n"
+    else:
+        assert isinstance(exception, RenderError)
+
+
+def test_close_blocked_submit():
+    """
+    Check if a call of :meth:`RenderPool.submit()`, that is blocked due
+    to back-pressure, raises an exception, when the pool is closed.
+    """
+    pool = RenderPool(n_workers=1, max_pending=1)
+    future = _submit_slow_job(pool)
+    exceptions = []
+
+    def submit():
+        try:
+            pool.submit(structure, style, size=(20, 10))
+        except Exception as e:
+            exceptions.append(e)
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    # Give the thread time to block
+    time.sleep(0.5)
+    assert thread.is_alive()
+    pool.close()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert len(exceptions) == 1
+    assert isinstance(exceptions[0], RuntimeError)
+    assert future.done()
+
@@ -0,0 +1,198 @@
+import subprocess
+import sys
+import threading
+import time
+from os.path import join
+import numpy as np
+import pytest
+import biotite.structure.io.pdbx as pdbx
+import ammolite
+from ammolite import PyMOLObject, RemotePyMOL
+from .util import data_dir
+
+
+pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+structure = pdbx.get_structure(
+    pdbx_file, model=1, extra_fields=["b_factor", "occupancy", "charge"]
+)
+
+
+@pytest.fixture(scope="module")
+def server():
+    """
+    Start a headless *PyMOL* process with *XML-RPC* server and get its
+    port.
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "pymol", "-cqKR"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    port = None
+    deadline = time.time() + 60
+    while port is None and time.time() < deadline:
+        line = process.stdout.readline()
+        if not line:
+            break
+        if "xml-rpc server running" in line:
+            port = int(line.split()[-1])
+    if port is None:
+        process.kill()
+        pytest.fail("The PyMOL XML-RPC server could not be started")
+    yield port
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def remote(server):
+    remote = RemotePyMOL(port=server)
+    with ammolite.use_pymol_instance(remote):
+        # Set the PyMOL parameters required by ammolite
+        ammolite.reset()
+    yield remote
+    ammolite.close_pymol_instance(remote)
+
+
+def test_object(remote):
+    """
+    Check if a :class:`PyMOLObject` can be transferred to and from a
+    remote *PyMOL* process and if commands are executed remotely.
+    """
+    pymol_obj = PyMOLObject.from_structure(structure, pymol_instance=remote)
+    assert remote.cmd.get_names() == [pymol_obj.name]
+    test_structure = pymol_obj.to_structure(state=1)
+    for category in structure.get_annotation_categories():
+        assert (
+            test_structure.get_annotation(category)
+            == structure.get_annotation(category)
+        ).all()
+    assert np.allclose(test_structure.coord, structure.coord)
+
+    b_factor = np.arange(structure.array_length(), dtype=float)
+    pymol_obj.set_atom_property("b", b_factor)
+    assert (pymol_obj.get_atom_property("b") == b_factor).all()
+    pymol_obj.show_as("sticks", structure.res_id < 5)
+    assert remote.cmd.count_atoms(f"model {pymol_obj.name} and rep sticks") \
+        == np.count_nonzero(structure.res_id < 5)
+
+    ammolite.draw_cgo(
+        [ammolite.get_sphere_cgo((0, 0, 0), 1, (1, 0, 0))], "sphere",
+        pymol_instance=remote
+    )
+    assert "sphere" in remote.cmd.get_names()
+
+
+def test_png(remote, tmp_path):
+    """
+    Check if the image is rendered remotely and written locally.
+    """
+    pymol_obj = PyMOLObject.from_structure(structure, pymol_instance=remote)
+    pymol_obj.show_as("sticks")
+    file_name = str(tmp_path / "image.png")
+    remote.cmd.png(file_name, 40, 30)
+    with open(file_name, "rb") as file:
+        assert file.read() == remote.cmd.png(None, 40, 30)
+
+
+def test_batch(remote, server):
+    """
+    Check if commands within a batch are sent only on exit or with a
+    call, whose return value is required.
+    """
+    observer = RemotePyMOL(port=server)
+    pymol_obj = PyMOLObject.from_structure(
+        structure, "test", pymol_instance=remote
+    )
+    with remote.batch():
+        with remote.batch():
+            assert remote.cmd.show_as("spheres", "test") is None
+        # Not sent yet
+        assert observer.cmd.count_atoms("rep spheres") == 0
+        # Requires the return value -> sends the queued commands as well
+        assert remote.cmd.count_atoms("rep spheres") \
+            == structure.array_length()
+        remote.cmd.hide("spheres", "resi 1")
+    assert observer.cmd.count_atoms("rep spheres") \
+        == np.count_nonzero(structure.res_id != 1)
+
+    # Exceptions from queued commands are raised on sending
+    with pytest.raises(Exception):
+        with remote.batch():
+            remote.cmd.show("invalid", "test")
+    observer.stop()
+    del pymol_obj
+
+
+def test_threads(remote):
+    """
+    Check if the same :class:`RemotePyMOL` can be used from multiple
+    threads at the same time.
+    """
+    pymol_obj = PyMOLObject.from_structure(
+        structure, "test", pymol_instance=remote
+    )
+    results = {}
+
+    def count(res_id):
+        for _ in range(10):
+            results[res_id] = remote.cmd.count_atoms(f"test and resi {res_id}")
+
+    threads = [
+        threading.Thread(target=count, args=(res_id,)) for res_id in range(1, 9)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == len(threads)
+    for res_id, n_atoms in results.items():
+        assert n_atoms == np.count_nonzero(structure.res_id == res_id)
+    del pymol_obj
+
+
+def test_states(remote, monkeypatch):
+    """
+    Check if multiple states are transferred directly in a single
+    request instead of via a temporary file.
+    """
+    stack = pdbx.get_structure(pdbx_file)
+    sent_calls = []
+    send = remote._send
+
+    def counting_send(calls):
+        sent_calls.append([name for name, _, _ in calls])
+        return send(calls)
+    monkeypatch.setattr(remote, "_send", counting_send)
+
+    pymol_obj = PyMOLObject.from_structure(stack, pymol_instance=remote)
+    assert "load_traj" not in [name for names in sent_calls for name in names]
+    sent_calls.clear()
+    pymol_obj.append_states(stack.coord[:5])
+    # All states are sent in a single request
+    assert ["load_coordset"] * 5 in sent_calls
+    monkeypatch.undo()
+
+    assert remote.cmd.count_states(pymol_obj.name) \
+        == stack.stack_depth() + 5
+    assert np.allclose(pymol_obj.get_coord(), np.concatenate(
+        [stack.coord, stack.coord[:5]]
+    ))
+
+
+def test_feedback(remote):
+    """
+    Check if the feedback setting of the remote *PyMOL* process is
+    retained when loading multiple states.
+    """
+    from pymol.constants import fb_mask, fb_module
+
+    stack = pdbx.get_structure(pdbx_file)
+    remote.cmd.feedback("disable", "objectmolecule", "details")
+    try:
+        PyMOLObject.from_structure(stack, pymol_instance=remote)
+        assert not remote.cmd._feedback(
+            fb_module.objectmolecule, fb_mask.details
+        )
+    finally:
+        remote.cmd.feedback("enable", "objectmolecule", "details")
+    assert remote.cmd._feedback(fb_module.objectmolecule, fb_mask.details)
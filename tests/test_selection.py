@@ -33,4 +33,240 @@ def test_select(random_seed):
     # Get the mask from the occupancy back again
     test_mask = (test_b_factor == 1.0)
 
-    assert np.array_equal(test_mask, ref_mask)
\ No newline at end of file
+    assert np.array_equal(test_mask, ref_mask)
+
+
+def _selected_mask(selection, n_atoms):
+    """
+    Get the mask of atoms that are selected by the given expression.
+    """
+    indices = []
+    cmd.iterate(selection, "indices.append(index)", space={"indices": indices})
+    mask = np.zeros(n_atoms, dtype=bool)
+    mask[np.array(indices, dtype=int) - 1] = True
+    return mask
+
+
+@pytest.mark.parametrize("pdb_id", ["1aki", "1igy", "1o1z", "5ugo"])
+@pytest.mark.parametrize("mask_type", [
+    "ca", "carbon", "chain", "residues", "residues_ca", "negative",
+    "insertion", "random"
+])
+@pytest.mark.parametrize("from_pymol", [False, True])
+def test_select_structure(pdb_id, mask_type, from_pymol):
+    """
+    Check whether masks that follow the structure of the molecule
+    are compiled into expressions that select exactly the masked atoms,
+    irrespective of whether the annotations are taken from the uploaded
+    structure or from PyMOL.
+    """
+    reset()
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, f"{pdb_id}.cif"))
+    array = pdbx.get_structure(pdbx_file, model=1)
+    array.bonds = struc.connect_via_residue_names(array)
+    pymol_object = PyMOLObject.from_structure(array)
+    if from_pymol:
+        # Discard the annotations of the uploaded structure
+        pymol_object._hierarchy = None
+
+    first_res_id = array.res_id[0]
+    ref_mask = {
+        "ca": array.atom_name == "CA",
+        "carbon": array.element == "C",
+        "chain": array.chain_id == array.chain_id[-1],
+        "residues": (
+            (array.res_id >= first_res_id + 3)
+            & (array.res_id <= first_res_id + 20)
+            | (array.res_id >= first_res_id + 40)
+            & (array.res_id <= first_res_id + 45)
+        ),
+        "residues_ca": (array.res_id % 3 == 0) & (array.atom_name == "CA"),
+        "negative": (array.res_id <= 10) & (array.atom_name == "N"),
+        "insertion": (array.ins_code != "") | (array.res_id == 100),
+        "random": np.random.default_rng(0).choice(
+            [False, True], array.array_length()
+        ),
+    }[mask_type]
+    if not ref_mask.any():
+        pytest.skip("Mask is empty for this structure")
+
+    test_mask = _selected_mask(
+        pymol_object.where(ref_mask), array.array_length()
+    )
+    assert np.array_equal(test_mask, ref_mask)
+
+
+@pytest.mark.parametrize("mask_type, ref_expression", [
+    ("ca", "name CA"),
+    ("carbon", "elem C"),
+    ("chain_ca", "chain A+B and name CA"),
+])
+def test_select_concise(mask_type, ref_expression):
+    """
+    Check whether scattered masks are compiled into concise expressions
+    instead of index ranges.
+    """
+    reset()
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1igy.cif"))
+    array = pdbx.get_structure(pdbx_file, model=1)
+    array.bonds = struc.connect_via_residue_names(array)
+    pymol_object = PyMOLObject.from_structure(array)
+
+    ref_mask = {
+        "ca": array.atom_name == "CA",
+        "carbon": array.element == "C",
+        "chain_ca": np.isin(array.chain_id, ["A", "B"])
+                    & (array.atom_name == "CA"),
+    }[mask_type]
+    assert pymol_object.where(ref_mask) \
+        == f"model {pymol_object.name} and ({ref_expression})"
+
+
+def test_select_after_alter():
+    """
+    Check whether the selection expressions remain correct, after the
+    annotations were changed via :meth:`PyMOLObject.alter()`.
+    """
+    reset()
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    array = pdbx.get_structure(pdbx_file, model=1)
+    array.bonds = struc.connect_via_residue_names(array)
+    pymol_object = PyMOLObject.from_structure(array)
+
+    ca_mask = array.atom_name == "CA"
+    pymol_object.alter(ca_mask, "name='CX'")
+    test_mask = _selected_mask(
+        pymol_object.where(ca_mask), array.array_length()
+    )
+    assert np.array_equal(test_mask, ca_mask)
+    assert "CX" in pymol_object.where(ca_mask)
+
+
+def test_selection_cache(monkeypatch):
+    """
+    Check whether a mask, that is repeatedly given to commands,
+    is stored as hidden named selection, which selects the masked
+    atoms.
+    """
+    # Use the selection expression instead of atom flags
+    monkeypatch.setattr(PyMOLObject, "SELECTION_TAG_THRESHOLD", 1_000_000)
+    reset()
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    array = pdbx.get_structure(pdbx_file, model=1)
+    array.bonds = struc.connect_via_residue_names(array)
+    pymol_object = PyMOLObject.from_structure(array)
+    mask = np.random.default_rng(0).choice([False, True], array.array_length())
+
+    expression = pymol_object.where(mask)
+    # Equal masks give the same cache entry
+    assert pymol_object.where(mask.copy()) == expression
+    assert pymol_object._into_selection(mask) == expression
+    name = pymol_object._into_selection(mask)
+    assert name != expression
+    assert name.startswith("_")
+    assert name in cmd.get_names("selections")
+    assert np.array_equal(
+        _selected_mask(name, array.array_length()), mask
+    )
+    # The named selection is reused
+    assert pymol_object._into_selection(mask) == name
+    # 'where()' still gives a self-contained expression
+    assert pymol_object.where(mask) == expression
+
+
+def test_selection_cache_eviction(monkeypatch):
+    """
+    Check whether named selections are deleted, when the corresponding
+    mask is evicted from the cache or when the object is modified.
+    """
+    monkeypatch.setattr(PyMOLObject, "SELECTION_CACHE_SIZE", 2)
+    monkeypatch.setattr(PyMOLObject, "SELECTION_MATERIALIZATION_USES", 1)
+    reset()
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    array = pdbx.get_structure(pdbx_file, model=1)
+    array.bonds = struc.connect_via_residue_names(array)
+    pymol_object = PyMOLObject.from_structure(array)
+    masks = [array.res_id == res_id for res_id in (1, 2, 3)]
+
+    names = [pymol_object._into_selection(mask) for mask in masks]
+    # The least recently used selection was evicted
+    assert names[0] not in cmd.get_names("selections")
+    assert names[1] in cmd.get_names("selections")
+    assert names[2] in cmd.get_names("selections")
+    
+    # Changing the annotations invalidates all cached selections
+    pymol_object.alter(masks[2], "b=1.0")
+    assert names[1] not in cmd.get_names("selections")
+    assert names[2] not in cmd.get_names("selections")
+    assert len(pymol_object._selection_cache) == 0
+    
+    # The named selections are removed with the object
+    name = pymol_object._into_selection(masks[0])
+    assert name in cmd.get_names("selections")
+    del pymol_object
+    assert name not in cmd.get_names("selections")
+
+
+@pytest.mark.parametrize("threshold", [0, 1_000_000])
+def test_tagged_selection(monkeypatch, threshold):
+    """
+    Check whether masks are correctly selected via atom flags,
+    if the selection expression exceeds the threshold.
+    """
+    monkeypatch.setattr(PyMOLObject, "SELECTION_TAG_THRESHOLD", threshold)
+    reset()
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    array = pdbx.get_structure(pdbx_file, model=1)
+    array.bonds = struc.connect_via_residue_names(array)
+    array.set_annotation("b_factor", np.zeros(array.array_length()))
+    pymol_object = PyMOLObject.from_structure(array)
+    rng = np.random.default_rng(0)
+
+    for _ in range(3):
+        ref_mask = rng.choice([False, True], array.array_length())
+        selection = pymol_object._into_selection(ref_mask)
+        if threshold == 0:
+            # Tagged atoms are stored as named selection
+            assert selection in cmd.get_names("selections")
+        else:
+            assert "flag" not in selection
+        pymol_object.alter(ref_mask, "b=1.0")
+        test_mask = pymol_object.to_structure(state=1).b_factor == 1.0
+        assert np.array_equal(test_mask, ref_mask)
+        pymol_object.alter(None, "b=0.0")
+
+
+def test_tagged_selection_operands(monkeypatch):
+    """
+    Check whether two different tagged masks given to the same command
+    select their respective atoms.
+    """
+    monkeypatch.setattr(PyMOLObject, "SELECTION_TAG_THRESHOLD", 0)
+    reset()
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    array = pdbx.get_structure(pdbx_file, model=1)
+    array.bonds = struc.connect_via_residue_names(array)
+    pymol_object = PyMOLObject.from_structure(array)
+    # Two bonds far apart from each other
+    # -> each mask consists of multiple fragments
+    ref_bonds = array.bonds.as_array()[[0, 100], :2]
+    mask1 = np.zeros(array.array_length(), dtype=bool)
+    mask1[ref_bonds[:, 0]] = True
+    mask2 = np.zeros(array.array_length(), dtype=bool)
+    mask2[ref_bonds[:, 1]] = True
+
+    pymol_object.set_bond("stick_radius", 0.5, mask1, mask2)
+    _, bonds = cmd.get_bond("stick_radius", pymol_object.name)[0]
+    test_bonds = [
+        # PyMOL indices start at 1
+        (index1 - 1, index2 - 1) for index1, index2, value in bonds
+        if value is not None
+    ]
+    assert sorted(test_bonds) == sorted(map(tuple, ref_bonds.tolist()))
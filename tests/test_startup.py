@@ -21,4 +21,128 @@ def test_get_and_set_pymol_instance_typecheck():
     """
     ammolite.reset()
     with pytest.raises(ammolite.DuplicatePyMOLException):
-        assert get_and_set_pymol_instance(42)
\ No newline at end of file
+        assert get_and_set_pymol_instance(42)
+
+
+@pytest.mark.parametrize("profile", ammolite.PROFILES.keys())
+def test_profiles(profile):
+    """
+    Check if the settings of a profile are applied by
+    :func:`reset()` and if an invalid profile is rejected.
+    """
+    ammolite.reset(profile)
+    for name, value in ammolite.PROFILES[profile].items():
+        assert ammolite.cmd.get_setting_int(name) == value
+    assert ammolite.cmd.get_setting_int("retain_order") == 1
+
+    with pytest.raises(ValueError):
+        ammolite.setup_parameters(ammolite.pymol, "fast")
+    ammolite.reset()
+
+
+def test_suspend_updates():
+    """
+    Check if :func:`suspend_updates()` restores the previous state of
+    the setting, also for nested contexts and exceptions.
+    """
+    ammolite.reset()
+    cmd = ammolite.cmd
+    with ammolite.suspend_updates():
+        assert cmd.get_setting_int("suspend_updates") == 1
+        with ammolite.suspend_updates():
+            assert cmd.get_setting_int("suspend_updates") == 1
+        assert cmd.get_setting_int("suspend_updates") == 1
+    assert cmd.get_setting_int("suspend_updates") == 0
+
+    with pytest.raises(RuntimeError):
+        with ammolite.suspend_updates(ammolite.pymol):
+            raise RuntimeError()
+    assert cmd.get_setting_int("suspend_updates") == 0
+
+
+def test_independent_instances():
+    """
+    Check if independent *PyMOL* instances have separate workspaces and
+    if commands are routed to the correct instance, also when used
+    concurrently from multiple threads.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from os.path import join
+    import numpy as np
+    import biotite.structure.io.pdbx as pdbx
+    from .util import data_dir
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    atoms = pdbx.get_structure(pdbx_file, model=1)
+
+    ammolite.reset()
+    global_object = ammolite.PyMOLObject.from_structure(atoms)
+    instances = [ammolite.create_pymol_instance() for _ in range(4)]
+    assert ammolite.get_pymol_instances() == [ammolite.pymol] + instances
+    for instance in instances:
+        assert instance.cmd.get_setting_int("retain_order") == 1
+
+    def work(i):
+        instance = instances[i]
+        with ammolite.use_pymol_instance(instance):
+            assert ammolite.pymol is instance
+            pymol_object = ammolite.PyMOLObject.from_structure(atoms)
+            for _ in range(10):
+                pymol_object.set_atom_property(
+                    "b", np.full(atoms.array_length(), i)
+                )
+                pymol_object.color("red", atoms.res_id == i+1)
+            ammolite.draw_cgo(
+                [ammolite.get_sphere_cgo((0, 0, 0), 1, (1, 0, 0))]
+            )
+            return (
+                instance.cmd.get_names(),
+                pymol_object.to_structure(state=1).b_factor
+            )
+
+    with ThreadPoolExecutor(len(instances)) as executor:
+        results = list(executor.map(work, range(len(instances))))
+    for i, (names, b_factor) in enumerate(results):
+        # Only the objects created in the respective thread
+        assert len(names) == 2
+        assert (b_factor == i).all()
+    # The global instance is unaffected
+    assert ammolite.cmd.get_names() == [global_object.name]
+    assert ammolite.pymol not in instances
+
+    for instance in instances:
+        ammolite.close_pymol_instance(instance)
+    assert ammolite.get_pymol_instances() == [ammolite.pymol]
+    with pytest.raises(ValueError):
+        ammolite.close_pymol_instance(instances[0])
+
+
+def test_close_pymol_instance():
+    """
+    Check if a closed *PyMOL* instance is not kept alive by
+    *Ammolite*, e.g. by the color registry.
+    """
+    import gc
+    import weakref
+    from os.path import join
+    import biotite.structure.io.pdbx as pdbx
+    from ammolite.object import _color_registries
+    from .util import data_dir
+
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, "1l2y.cif"))
+    atoms = pdbx.get_structure(pdbx_file, model=1)
+
+    instance = ammolite.create_pymol_instance()
+    pymol_object = ammolite.PyMOLObject.from_structure(
+        atoms, pymol_instance=instance
+    )
+    pymol_object.color((0.1, 0.2, 0.3))
+    assert instance.cmd in _color_registries
+    del pymol_object
+    ammolite.close_pymol_instance(instance)
+    assert instance not in ammolite.get_pymol_instances()
+
+    cmd_ref = weakref.ref(instance.cmd)
+    del instance
+    gc.collect()
+    assert cmd_ref() is None
@@ -0,0 +1,199 @@
+import glob
+from os.path import join
+import numpy as np
+import pytest
+import biotite.structure as struc
+import biotite.structure.io.pdbx as pdbx
+from pymol import cmd
+from ammolite import PyMOLObject, reset
+from .util import data_dir
+
+
+def load_structure(pdb_id="1l2y", model=1):
+    pdbx_file = pdbx.PDBxFile.read(join(data_dir, f"{pdb_id}.cif"))
+    atoms = pdbx.get_structure(
+        pdbx_file, model=model,
+        extra_fields=["b_factor", "occupancy", "charge"]
+    )
+    atoms.bonds = struc.connect_via_residue_names(atoms)
+    return atoms
+
+
+def assert_synchronized(pymol_object, atoms):
+    test_atoms = pymol_object.to_structure(
+        state=1 if isinstance(atoms, struc.AtomArray) else None,
+        altloc="all", include_bonds=True
+    )
+    for category in [
+        "chain_id", "res_id", "ins_code", "res_name", "hetero",
+        "atom_name", "element", "charge"
+    ]:
+        assert (
+            test_atoms.get_annotation(category)
+            == atoms.get_annotation(category)
+        ).all()
+    for category in ["b_factor", "occupancy"]:
+        assert np.allclose(
+            test_atoms.get_annotation(category),
+            atoms.get_annotation(category)
+        )
+    assert np.array_equal(test_atoms.coord, atoms.coord)
+    test_atoms.bonds.remove_aromaticity()
+    ref_bonds = atoms.bonds.copy()
+    ref_bonds.remove_aromaticity()
+    assert test_atoms.bonds.as_set() == ref_bonds.as_set()
+
+
+def test_unchanged():
+    """
+    Synchronizing an unchanged structure should neither rebuild the
+    object nor send any command, that changes the object.
+    """
+    atoms = load_structure()
+    reset()
+    pymol_object = PyMOLObject.from_structure(atoms, track_changes=True)
+    pymol_object.color("red")
+    assert pymol_object.sync(atoms) is False
+    assert_synchronized(pymol_object, atoms)
+    colors = set()
+    cmd.iterate(pymol_object.name, "colors.add(color)",
+                space={"colors": colors})
+    assert colors == {cmd.get_color_index("red")}
+
+
+@pytest.mark.parametrize("use_snapshot", [False, True])
+def test_changed_annotations(use_snapshot):
+    """
+    Changes of annotations and coordinates should be transferred
+    without rebuilding the object.
+    """
+    atoms = load_structure()
+    reset()
+    uploaded_object = PyMOLObject.from_structure(atoms, track_changes=True)
+    if use_snapshot:
+        pymol_object = uploaded_object
+    else:
+        # Synchronize an object, that was not uploaded via this object
+        pymol_object = PyMOLObject(
+            uploaded_object.name, delete=False, track_changes=True
+        )
+    pymol_object.color("red")
+
+    rng = np.random.default_rng(0)
+    atoms = atoms.copy()
+    atoms.b_factor[rng.choice(atoms.array_length(), 10)] = 42.0
+    atoms.charge[:5] = -1
+    atoms.res_name[atoms.res_id == 3] = "ALA"
+    atoms.res_id[atoms.res_id == 5] = 105
+    atoms.ins_code[atoms.res_id == 6] = "A"
+    atoms.chain_id[-10:] = "B"
+    atoms.hetero[:3] = True
+    atoms.coord[10] += 1
+
+    assert pymol_object.sync(atoms) is False
+    assert_synchronized(pymol_object, atoms)
+    # The object properties should be kept
+    colors = set()
+    cmd.iterate(pymol_object.name, "colors.add(color)",
+                space={"colors": colors})
+    assert colors == {cmd.get_color_index("red")}
+
+
+def test_changed_topology():
+    """
+    Changing the number of atoms or the bonds should rebuild the
+    object.
+    """
+    atoms = load_structure()
+    reset()
+    pymol_object = PyMOLObject.from_structure(atoms, track_changes=True)
+
+    # Remove a residue
+    atoms = atoms[atoms.res_id != 10]
+    assert pymol_object.sync(atoms) is True
+    assert_synchronized(pymol_object, atoms)
+    # The object is valid again
+    pymol_object.show("sticks")
+
+    # Remove a bond
+    atoms = atoms.copy()
+    atoms.bonds.remove_bond(0, 1)
+    assert pymol_object.sync(atoms) is True
+    assert_synchronized(pymol_object, atoms)
+    assert pymol_object.sync(atoms) is False
+
+
+def test_stack():
+    stack = load_structure(model=None)
+    reset()
+    pymol_object = PyMOLObject.from_structure(stack, track_changes=True)
+    stack = stack.copy()
+    stack.coord[3] += 1
+    stack.b_factor[:] = 1.0
+    assert pymol_object.sync(stack) is False
+    assert_synchronized(pymol_object, stack)
+    # Fewer models
+    assert pymol_object.sync(stack[:10]) is True
+    assert_synchronized(pymol_object, stack[:10])
+
+
+@pytest.mark.parametrize("as_stack", [False, True])
+def test_untracked(as_stack):
+    """
+    Without change tracking no copy of the structure should be kept
+    and the object should be recreated on synchronization.
+    """
+    atoms = load_structure(model=None if as_stack else 1)
+    reset()
+    pymol_object = PyMOLObject.from_structure(atoms)
+    assert pymol_object._snapshot is None
+    assert pymol_object._hierarchy is None
+
+    atoms = atoms.copy()
+    atoms.b_factor[:] = 1.0
+    atoms.coord[..., 3, :] += 1
+    assert pymol_object.sync(atoms) is True
+    assert_synchronized(pymol_object, atoms)
+    assert pymol_object._snapshot is None
+    # The object is valid again
+    pymol_object.show("sticks")
+
+
+
+@pytest.mark.parametrize(
+    "constructor", ["init", "from_structure", "from_trajectory"]
+)
+@pytest.mark.parametrize("track_changes", [False, True])
+def test_track_changes_default(tmp_path, constructor, track_changes):
+    """
+    Check if change tracking is disabled by default and can be enabled
+    for each way to create a :class:`PyMOLObject`.
+    """
+    atoms = load_structure()
+    reset()
+    kwargs = {"track_changes": True} if track_changes else {}
+    if constructor == "init":
+        uploaded_object = PyMOLObject.from_structure(atoms)
+        pymol_object = PyMOLObject(
+            uploaded_object.name, delete=False, **kwargs
+        )
+    elif constructor == "from_structure":
+        pymol_object = PyMOLObject.from_structure(atoms, **kwargs)
+    else:
+        xtc = pytest.importorskip("biotite.structure.io.xtc")
+        file_name = str(tmp_path / "trajectory.xtc")
+        xtc_file = xtc.XTCFile()
+        xtc_file.set_coord(atoms.coord[np.newaxis])
+        xtc_file.write(file_name)
+        pymol_object = PyMOLObject.from_trajectory(
+            atoms, file_name, **kwargs
+        )
+        # Do not compare the coordinates, as XTC is lossy
+        atoms = atoms.copy()
+        atoms.coord = pymol_object.get_coord(state=1)
+
+    atoms = atoms.copy()
+    atoms.b_factor[:] = 1.0
+    # Only a tracked object is synchronized without rebuilding it
+    assert pymol_object.sync(atoms) is not track_changes
+    assert_synchronized(pymol_object, atoms)